@@ -0,0 +1,339 @@
+import asyncio
+import heapq
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from fastapi import HTTPException
+from pymongo import monitoring
+from starlette.responses import JSONResponse
+from app.config import settings
+from app.metrics import ADMISSION_LIMIT, REQUESTS_SHED
+
+# Admission control. Requests beyond the capacity of the MongoDB pool used to
+# queue for a connection for up to waitQueueTimeoutMS and then fail, so p99
+# climbed to the queue timeout under overload. Instead, every API request needs
+# a slot under an adaptive concurrency limit before it runs:
+#
+# - Priority classes: writes may fill the whole limit, plain reads
+#   read_share of it and history, export and report scans only scan_share, so
+#   scans are shed first and writes keep headroom. Scans are also shed while
+#   the pool's checkout wait is above its threshold.
+# - A request that does not fit waits up to queue_timeout for a slot (writes
+#   are served first), then gets 503 with Retry-After. A route at its own
+#   concurrency limit answers 429 with Retry-After at once.
+# - The limit follows observed latency: once per window it shrinks
+#   multiplicatively when the p90 time to first byte exceeds the target or the
+#   pool checkout wait exceeds its threshold, and grows by about sqrt(limit)
+#   when it was the bottleneck and latency stayed under the target.
+#
+# Requests are classified by method and path before routing; every route with
+# its own class or limit has a fixed path.
+# The middleware runs on the event loop; only the pool listener runs on
+# Motor's executor threads, hence the lock around the pool wait.
+
+WRITE, READ, SCAN = 0, 1, 2
+PRIORITY_NAMES = ("write", "read", "scan")
+
+SCAN_PATHS = frozenset({
+    "/api/v1/allocations/history",
+    "/api/v1/allocations/export",
+    "/api/v1/reports/utilization"
+})
+# Long-lived streams and operator endpoints are never shed
+EXEMPT_PREFIXES = ("/api/v1/feed/", "/api/v1/admin/")
+
+# Limit multiplier applied when a window is over target
+BACKOFF = 0.75
+
+
+def request_priority(method: str, path: str) -> Optional[int]:
+    # Priority class of a request, or None if it bypasses admission
+    if not path.startswith("/api/") or path.startswith(EXEMPT_PREFIXES):
+        return None
+    if method not in ("GET", "HEAD"):
+        return WRITE
+    return SCAN if path in SCAN_PATHS else READ
+
+
+class AdmissionController:
+    def __init__(
+            self,
+            initial_limit: int = 50,
+            min_limit: int = 8,
+            max_limit: int = 200,
+            target_latency: float = 0.25,
+            pool_wait_threshold: float = 0.1,
+            queue_timeout: float = 0.05,
+            window_seconds: float = 1.0,
+            shares: Sequence[float] = (1.0, 0.9, 0.5),
+            route_limits: Optional[Dict[str, int]] = None,
+            retry_after: int = 1
+        ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.pool_wait_threshold = pool_wait_threshold
+        self.queue_timeout = queue_timeout
+        self.window_seconds = window_seconds
+        self.shares = tuple(shares)
+        self.route_limits = dict(route_limits or {})  # "METHOD /path" -> most in flight
+        self.retry_after = retry_after
+
+        self.in_flight = [0, 0, 0]  # By priority class
+        self._route_in_flight: Dict[str, int] = dict.fromkeys(self.route_limits, 0)  # Limited routes only
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []  # Heap of (priority, arrival, future)
+        self._arrivals = 0
+
+        self._window_start = time.monotonic()
+        self._latencies: List[float] = []
+        self._peak = 0  # Most requests in flight during the window
+        self._shed_in_window = False
+        self._pool_lock = threading.Lock()
+        self._pool_wait_peak = 0.0  # Longest checkout wait in the current window
+        self.pool_wait = 0.0  # Longest checkout wait in the last window
+        self.shed = {429: 0, 503: 0}
+        ADMISSION_LIMIT.set(value=self.limit)
+
+    @property
+    def total(self) -> int:
+        return sum(self.in_flight)
+
+    def capacity(self, priority: int) -> int:
+        # In-flight requests below which a class is admitted
+        return max(1, int(self.limit * self.shares[priority]))
+
+    def _fits(self, priority: int) -> bool:
+        return self.total < self.capacity(priority)
+
+    def _admit(self, priority: int):
+        self.in_flight[priority] += 1
+        self._peak = max(self._peak, self.total)
+
+    def _route_done(self, route: str):
+        if route in self._route_in_flight:
+            self._route_in_flight[route] -= 1
+
+    def _reject(self, route: str, status: int) -> int:
+        if status == 503:
+            self._route_done(route)
+        self._shed_in_window = True
+        self.shed[status] += 1
+        return status
+
+    async def acquire(self, route: str, priority: int) -> Optional[int]:
+        # None once admitted (release must follow), else the status to answer with
+        route_limit = self.route_limits.get(route)
+        if route_limit is not None:
+            if self._route_in_flight[route] >= route_limit:
+                return self._reject(route, 429)
+            self._route_in_flight[route] += 1
+
+        # Arrivals roll the window too: a shed request never releases, so a
+        # pool wait spike must decay without any request completing
+        self._update_limit()
+        if priority == SCAN and self.pool_wait > self.pool_wait_threshold:
+            return self._reject(route, 503)
+        # Queued requests of the same or a higher class go first
+        if self._fits(priority) and not (self._waiters and self._waiters[0][0] <= priority):
+            self._admit(priority)
+            return None
+        if self.queue_timeout <= 0 or len(self._waiters) >= self.capacity(WRITE):
+            return self._reject(route, 503)
+
+        self._arrivals += 1
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, self._arrivals, future)
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            return None
+        except asyncio.TimeoutError:
+            if future.done():
+                # Granted just as the wait ran out
+                return None
+            self._leave(waiter)
+            return self._reject(route, 503)
+        except asyncio.CancelledError:
+            # The client went away while queued: hand back a slot granted in
+            # the meantime, or leave the queue, and free the route either way
+            if future.done() and not future.cancelled():
+                self.release(route, priority, None)
+            else:
+                self._leave(waiter)
+                self._route_done(route)
+            raise
+
+    def _leave(self, waiter: Tuple[int, int, asyncio.Future]):
+        # Drop a waiter that gave up, so it no longer counts against the queue
+        waiter[2].cancel()
+        self._waiters.remove(waiter)
+        heapq.heapify(self._waiters)
+
+    def release(self, route: str, priority: int, latency: Optional[float]):
+        self.in_flight[priority] -= 1
+        self._route_done(route)
+        if latency is not None:
+            self._latencies.append(latency)
+        self._update_limit()
+        self._grant()
+
+    def _grant(self):
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._fits(priority):
+                break
+            heapq.heappop(self._waiters)
+            self._admit(priority)
+            future.set_result(None)
+
+    def observe_pool_wait(self, seconds: float):
+        # From the pool listener, on Motor's threads
+        with self._pool_lock:
+            self._pool_wait_peak = max(self._pool_wait_peak, seconds)
+
+    def _update_limit(self):
+        now = time.monotonic()
+        if now - self._window_start < self.window_seconds:
+            return
+        with self._pool_lock:
+            self.pool_wait, self._pool_wait_peak = self._pool_wait_peak, 0.0
+        latencies = sorted(self._latencies)
+        p90 = latencies[int(len(latencies) * 0.9)] if latencies else 0.0
+
+        if p90 > self.target_latency or self.pool_wait > self.pool_wait_threshold:
+            self.limit = max(float(self.min_limit), self.limit * BACKOFF)
+        elif self._peak >= self.limit - 1 or self._shed_in_window:
+            self.limit = min(float(self.max_limit), self.limit + max(1.0, math.sqrt(self.limit)))
+
+        self._window_start = now
+        self._latencies = []
+        self._peak = self.total
+        self._shed_in_window = False
+        ADMISSION_LIMIT.set(value=self.limit)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": dict(zip(PRIORITY_NAMES, self.in_flight)),
+            "queued": sum(1 for _, _, future in self._waiters if not future.done()),
+            "pool_wait_ms": round(self.pool_wait * 1000, 3),
+            "shed": {str(status): count for status, count in self.shed.items()}
+        }
+
+
+def overloaded() -> HTTPException:
+    # For a pool checkout timeout or lost connection that got past admission
+    return HTTPException(
+        status_code=503,
+        detail="Service overloaded, retry later",
+        headers={"Retry-After": str(settings.admission_retry_after_seconds)}
+    )
+
+
+class AdmissionPoolListener(monitoring.ConnectionPoolListener):
+    # Feeds checkout waits to the controller
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        # A timed-out checkout waited at least the pool's wait queue timeout
+        duration = getattr(event, "duration", None)  # pymongo >= 4.7
+        self.controller.observe_pool_wait(duration if duration is not None else float("inf"))
+
+    def connection_checked_out(self, event):
+        duration = getattr(event, "duration", None)  # pymongo >= 4.7
+        if duration is not None:
+            self.controller.observe_pool_wait(duration)
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class AdmissionMiddleware:
+    # Plain ASGI middleware, like MetricsMiddleware; rejections never reach the routes
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        path = scope["path"]
+        priority = request_priority(method, path)
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = f"{method} {path}"
+        status = await self.controller.acquire(key, priority)
+        if status is not None:
+            REQUESTS_SHED.inc(method, PRIORITY_NAMES[priority], str(status))
+            response = JSONResponse(
+                {"detail": "Too many concurrent requests for this endpoint" if status == 429 else "Service overloaded, retry later"},
+                status_code=status,
+                headers={"Retry-After": str(self.controller.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        latency = None
+
+        async def send_wrapper(message):
+            # Time to first byte: a streamed export holds its slot, but its
+            # length says nothing about load
+            nonlocal latency
+            if latency is None and message["type"] == "http.response.start":
+                latency = time.perf_counter() - start
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.controller.release(key, priority, latency)
+
+
+# Shared by every request in this process
+admission_controller = AdmissionController(
+    initial_limit=settings.admission_initial_limit or settings.worker_pool_size(),
+    min_limit=settings.admission_min_limit,
+    max_limit=settings.admission_max_limit,
+    target_latency=settings.admission_target_latency_ms / 1000,
+    pool_wait_threshold=settings.admission_pool_wait_ms / 1000,
+    queue_timeout=settings.admission_queue_timeout_ms / 1000,
+    window_seconds=settings.admission_window_seconds,
+    shares=(1.0, settings.admission_read_share, settings.admission_scan_share),
+    route_limits=settings.admission_route_limits,
+    retry_after=settings.admission_retry_after_seconds
+)
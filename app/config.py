@@ -1,10 +1,158 @@
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     mongodb_url: str
     database_name: str
 
+    # MongoDB connection pool per worker process. With mongo_connection_budget
+    # set, the pool is the budget divided across web_concurrency workers (the
+    # same WEB_CONCURRENCY uvicorn reads for --workers), so adding workers never
+    # exceeds what the server was sized for
+    web_concurrency: int = 1
+    mongo_connection_budget: int = 0  # Total connections across workers; 0 uses mongo_max_pool_size per worker
+    mongo_max_pool_size: int = 50
+    mongo_min_pool_size: int = 10
+    mongo_max_idle_time_ms: int = 50000
+    mongo_wait_queue_timeout_ms: int = 5000
+
+    # Check the index version on startup (one read; indexes are only built
+    # when it is behind). The launcher checks once before forking workers and
+    # turns this off for them
+    index_check_on_startup: bool = True
+
+    # "mongo", or "memory" for the in-process engine (tests, benchmarks, edge sites)
+    storage_backend: str = "mongo"
+    memory_vehicle_count: int = 1000  # Fleet size of the memory backend (ids 1..N)
+    memory_employee_count: int = 1000  # Employees of the memory backend (ids 1..N)
+
+    # Vehicle availability occupancy index
+    occupancy_ttl_seconds: float = 60
+    occupancy_max_dates: int = 3660
+
+    # Read-through cache for allocation lookups and history pages. Writes
+    # invalidate it through an in-process bus, so unset it is only on for a
+    # single worker, or with cache_change_stream carrying other workers' writes
+    cache_enabled: Optional[bool] = None
+    cache_ttl_seconds: float = 30
+    cache_max_entries: int = 10000
+    cache_max_history_pages: int = 1024
+    cache_change_stream: bool = False  # Invalidate from a change stream (replica sets only)
+
+    # ETag/Last-Modified validators on list, history and fetch responses (304 on
+    # If-None-Match). Tags are built from this worker's write counters, so
+    # another worker would never match them: unset they are only on for a
+    # single worker. Tags are re-issued at least every etag_ttl_seconds,
+    # bounding how long a write made by another worker (not seen through the
+    # invalidation bus) can go unnoticed; 0 never rotates them
+    etags_enabled: Optional[bool] = None
+    etag_ttl_seconds: float = 30
+
+    # Encode list responses in one pass instead of validating them against response_model
+    fast_responses: bool = True
+
+    # Reject employee and vehicle ids missing from their collections, checked
+    # against in-process id sets: new ids show up within the refresh interval
+    # (or on the first miss), deleted ones within the reload interval
+    registry_enabled: bool = True
+    registry_refresh_seconds: float = 10
+    registry_reload_seconds: float = 300
+    registry_miss_refresh_seconds: float = 1
+
+    # Coalesce concurrent single creates into batched writes
+    coalesce_creates: bool = False
+    coalesce_window_ms: float = 2  # Longest a create waits for others to join its batch
+    coalesce_max_batch: int = 256  # Flush as soon as this many creates are waiting
+
+    # Per-(vehicle|employee, month) utilization counters kept in step with
+    # writes, which the reports read. Each create, update and delete then makes
+    # a second round trip after the allocation write; it is not atomic with
+    # that write, so a failure is counted (allocation_rollup_write_failures_total)
+    # and left for scripts.rebuild_rollups to repair
+    rollups_enabled: bool = True
+
+    # Move allocations older than archive_after_days from allocations to
+    # allocations_archive in the background; history reads merge both
+    archive_enabled: bool = False
+    archive_after_days: int = 90
+    archive_batch_size: int = 1000
+    archive_interval_seconds: float = 3600  # Pause between runs once caught up
+
+    # Allocation change feed (SSE and WebSocket). "local" publishes this
+    # process's writes; "change_stream" follows MongoDB (replica sets only) and
+    # sees every worker's writes. A local feed on one of several workers would
+    # silently miss the others' writes, so it is then turned off
+    feed_enabled: bool = True
+    feed_source: str = "local"
+    feed_history_size: int = 10000  # Events kept for resuming clients
+    feed_queue_size: int = 1000  # Events a slow client may fall behind before it is disconnected
+    feed_heartbeat_seconds: float = 15
+
+    # Admission control: API requests need a slot under an adaptive concurrency
+    # limit; ones that cannot get one within the queue timeout are shed with
+    # 503 and Retry-After instead of waiting on the MongoDB pool. Writes may fill
+    # the whole limit, reads read_share of it and history/export/report scans
+    # scan_share. Per-route limits ("METHOD /path") answer 429
+    admission_enabled: bool = True
+    admission_initial_limit: int = 0  # 0 starts at the worker's pool size
+    admission_min_limit: int = 8
+    admission_max_limit: int = 200
+    admission_target_latency_ms: float = 250  # p90 time to first byte above which the limit shrinks
+    admission_pool_wait_ms: float = 100  # Pool checkout wait above which scans are shed and the limit shrinks
+    admission_queue_timeout_ms: float = 50  # Longest a request waits for a slot
+    admission_window_seconds: float = 1  # How often the limit is adjusted
+    admission_read_share: float = 0.9
+    admission_scan_share: float = 0.5
+    admission_route_limits: Dict[str, int] = {
+        "GET /api/v1/allocations/export": 4,
+        "GET /api/v1/reports/utilization": 8
+    }
+    admission_retry_after_seconds: int = 1
+
+    # Operator endpoints under /api/v1/admin (cache, admission, profiler and
+    # slow-request log). They can clear caches and start the profiler, and
+    # admission never sheds them, so they are only mounted when enabled
+    admin_enabled: bool = False
+
+    # Profiling, both off by default and switchable at runtime through
+    # /api/v1/admin/profiler and /api/v1/admin/slow-requests: a sampling
+    # profiler of the event loop thread, and a ring buffer of requests slower
+    # than the threshold with their MongoDB commands and stack samples
+    profiling_enabled: bool = False
+    profiling_interval_ms: float = 10
+    slow_request_log_enabled: bool = False
+    slow_request_threshold_ms: float = 500
+    slow_request_log_size: int = 100
+    slow_request_max_commands: int = 100  # Commands kept per captured request
+
+    # Prometheus metrics at /metrics (request latency, MongoDB commands and pool)
+    metrics_enabled: bool = True
+
     class Config:
         env_file = ".env"
 
+    def worker_pool_size(self) -> int:
+        # maxPoolSize of this worker's MongoDB client
+        if self.mongo_connection_budget > 0:
+            return max(1, self.mongo_connection_budget // max(1, self.web_concurrency))
+        return self.mongo_max_pool_size
+
+    def cache_active(self) -> bool:
+        # Whether this worker caches lookups and history pages
+        if self.cache_enabled is not None:
+            return self.cache_enabled
+        return self.web_concurrency <= 1 or self.cache_change_stream
+
+    def etags_active(self) -> bool:
+        # Whether list, history and fetch responses carry validators
+        if self.etags_enabled is not None:
+            return self.etags_enabled
+        return self.web_concurrency <= 1
+
+    def feed_active(self) -> bool:
+        # Whether this worker serves the change feed
+        if not self.feed_enabled:
+            return False
+        return self.web_concurrency <= 1 or self.feed_source == "change_stream"
+
 settings = Settings()
\ No newline at end of file
@@ -1,6 +1,12 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from .config import settings
+from .admission import AdmissionPoolListener, admission_controller
+from .metrics import mongo_event_listeners
+from .profiling import CommandCaptureListener, profiler
 import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Global connection pool
 _client = None
@@ -9,13 +15,20 @@ _db = None
 async def init_db():
     global _client, _db
     if _client is None:
-        # Configure connection pool
+        # Configure connection pool, sized for this worker's share of the connection budget
+        pool_size = settings.worker_pool_size()
+        listeners = mongo_event_listeners() if settings.metrics_enabled else []
+        if settings.admission_enabled:
+            listeners.append(AdmissionPoolListener(admission_controller))
+        # Attributes commands to slow-request captures; idle while the slow log is off
+        listeners.append(CommandCaptureListener(profiler))
         _client = AsyncIOMotorClient(
             settings.mongodb_url,
-            maxPoolSize=50,
-            minPoolSize=10,
-            maxIdleTimeMS=50000,
-            waitQueueTimeoutMS=5000
+            maxPoolSize=pool_size,
+            minPoolSize=min(settings.mongo_min_pool_size, pool_size),
+            maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+            waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+            event_listeners=listeners
         )
         _db = _client[settings.database_name]
     return _db
@@ -25,21 +38,85 @@ async def get_database():
         await init_db()
     return _db
 
-async def create_indexes(db):
-    # Create compound indexes for common queries
-    await db.allocations.create_index([
+def close_db():
+    # Closes the pool; the next get_database opens a new one
+    global _client, _db
+    if _client is not None:
+        _client.close()
+    _client = None
+    _db = None
+
+# Change streams return pre-images ("whenAvailable") from this server version on
+PRE_IMAGES_VERSION = (6, 0)
+
+async def server_version(db) -> tuple:
+    info = await db.client.server_info()
+    return tuple(info.get("versionArray", [0])[:2])
+
+async def change_stream_options(db, purpose: str) -> dict:
+    # watch() options for a change stream: pre-images where the server has
+    # them; older servers reject the option, so it is left out with a warning
+    version = await server_version(db)
+    if version >= PRE_IMAGES_VERSION:
+        return {"full_document_before_change": "whenAvailable"}
+    logger.warning(
+        "MongoDB %s has no change stream pre-images (needs %d.%d); %s runs without them",
+        ".".join(map(str, version)), *PRE_IMAGES_VERSION, purpose
+    )
+    return {}
+
+# Bump whenever create_indexes changes, so the next startup check or
+# migration run (python -m scripts.migrate) builds the new indexes
+INDEX_VERSION = 1
+
+async def indexes_current(db, name: str) -> bool:
+    # One read: whether the indexes recorded under name are at INDEX_VERSION
+    marker = await db.migrations.find_one({"_id": name})
+    return marker is not None and marker.get("version", 0) >= INDEX_VERSION
+
+async def record_indexes(db, name: str):
+    await db.migrations.update_one(
+        {"_id": name},
+        {"$max": {"version": INDEX_VERSION}, "$currentDate": {"applied_at": True}},
+        upsert=True
+    )
+
+async def create_indexes(db, collection: str = "allocations"):
+    # Create compound indexes for common queries (on the archive collection too,
+    # so history queries can use the same index hints on both)
+    allocations = db[collection]
+    await allocations.create_index([
         ("vehicle_id", 1),
         ("allocation_date", 1)
     ], unique=True)
     
-    await db.allocations.create_index([
+    # An employee can only hold one vehicle per date
+    await allocations.create_index([
         ("employee_id", 1),
         ("allocation_date", 1)
-    ])
+    ], unique=True)
     
     # Compound index for history queries
-    await db.allocations.create_index([
+    await allocations.create_index([
         ("employee_id", 1),
         ("vehicle_id", 1),
         ("allocation_date", 1)
-    ])
\ No newline at end of file
+    ])
+
+    # Keyset pagination over the unfiltered history (sort by date, _id tie-breaker)
+    await allocations.create_index([
+        ("allocation_date", 1),
+        ("_id", 1)
+    ])
+
+    # Utilization rollups: report scans by month range, or by entity over months
+    await db.allocation_rollups.create_index([
+        ("dimension", 1),
+        ("month", 1),
+        ("entity_id", 1)
+    ], unique=True)
+    await db.allocation_rollups.create_index([
+        ("dimension", 1),
+        ("entity_id", 1),
+        ("month", 1)
+    ])
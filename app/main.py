@@ -1,9 +1,89 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import allocation
-from app.database import get_database, create_indexes
+from pymongo.errors import ConnectionFailure
+from app.admission import AdmissionMiddleware, overloaded
+from app.config import settings
+from app.routes import admin, allocation, assignment, feed, metrics, report, vehicle
+from app.database import get_database
+from app.metrics import MetricsMiddleware
+from app.profiling import ProfilingMiddleware, profiler
+from app.services.archive import archiver
+from app.services.cache import invalidation_bus, watch_allocation_changes
+from app.services.feed import close_change_source, get_change_source
+from app.services.registry import entity_registry
+from app.storage import close_store, get_store
 
-app = FastAPI(title="Vehicle Allocation System")
+# Startup lines go out with uvicorn's own
+logger = logging.getLogger("uvicorn.error")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Per worker: open the store, start background tasks; on shutdown stop
+    # them and close the MongoDB pool so connections are released promptly
+    started = time.perf_counter()
+    store = await get_store()
+    # Indexes are built at most once per INDEX_VERSION; the launcher
+    # (python -m scripts.serve) checks before forking, so workers skip even the read
+    if settings.index_check_on_startup and await store.ensure_indexes():
+        logger.info("Created indexes")
+
+    tasks = []
+    # Employee and vehicle ids for write validation, kept fresh in the background
+    if settings.registry_enabled:
+        await entity_registry.load(store)
+        tasks.append(asyncio.create_task(entity_registry.run(store)))
+
+    # Move old allocations out of the hot collection
+    if settings.archive_enabled:
+        tasks.append(asyncio.create_task(archiver.run(store)))
+
+    # Change feed source; the change stream source follows MongoDB in the background
+    if settings.feed_enabled and not settings.feed_active():
+        logger.warning(
+            "Change feed disabled: FEED_SOURCE=%s only sees this worker's writes and WEB_CONCURRENCY=%d; "
+            "set FEED_SOURCE=change_stream to serve it",
+            settings.feed_source, settings.web_concurrency
+        )
+    if settings.feed_active():
+        source = await get_change_source()
+        tasks.append(asyncio.create_task(source.run()))
+
+    # Let writes from other workers invalidate this worker's cache
+    if settings.storage_backend == "mongo" and settings.cache_active() and settings.cache_change_stream:
+        db = await get_database()
+        tasks.append(asyncio.create_task(watch_allocation_changes(db, invalidation_bus)))
+
+    # Opt-in profiling; the admin API can switch it on later without a restart
+    profiler.attach()
+    if settings.profiling_enabled or settings.slow_request_log_enabled:
+        profiler.configure(profiling=settings.profiling_enabled, slow_log=settings.slow_request_log_enabled)
+
+    logger.info("Worker %d ready in %.0f ms", os.getpid(), (time.perf_counter() - started) * 1000)
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        profiler.stop()
+        close_change_source()
+        close_store()
+
+app = FastAPI(title="Vehicle Allocation System", lifespan=lifespan)
+
+# Innermost, so slow-request captures time the routes themselves
+app.add_middleware(ProfilingMiddleware)
+
+# Shed load before it queues on the MongoDB pool (inside CORS, so rejections
+# carry CORS headers; inside metrics, so they are counted)
+if settings.admission_enabled:
+    app.add_middleware(AdmissionMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -14,11 +94,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
+# Pool checkout timeouts and lost connections are overload, not server errors
+@app.exception_handler(ConnectionFailure)
+async def connection_failure_handler(request, exc):
+    return await http_exception_handler(request, overloaded())
+
 # Include routers
 app.include_router(allocation.router, prefix="/api/v1", tags=["allocations"])
-
-# Startup event to create indexes
-@app.on_event("startup")
-async def startup_event():
-    db = await get_database()
-    await create_indexes(db)
\ No newline at end of file
+app.include_router(vehicle.router, prefix="/api/v1", tags=["vehicles"])
+app.include_router(assignment.router, prefix="/api/v1", tags=["assignments"])
+app.include_router(feed.router, prefix="/api/v1", tags=["feed"])
+app.include_router(report.router, prefix="/api/v1", tags=["reports"])
+if settings.admin_enabled:
+    app.include_router(admin.router, prefix="/api/v1", tags=["admin"])
+if settings.metrics_enabled:
+    app.include_router(metrics.router)
@@ -0,0 +1,270 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+from pymongo import monitoring
+from starlette.routing import Match
+
+# Minimal Prometheus registry and collectors. Observations are a lock, a
+# bisect and two additions, so the metrics can stay on in production. Pymongo
+# listeners fire on Motor's executor threads, hence the locks.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for labels, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[Metric] = []
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ("method", "route", "status")
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled", ("method", "route"))
+
+# Create coalescing (app/services/coalescer.py)
+CREATE_BATCH_SIZE = Histogram(
+    "allocation_create_batch_size", "Creates written per coalesced batch", (), (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+
+# Utilization rollups (AllocationService._record_rollups)
+ROLLUP_WRITE_FAILURES = Counter(
+    "allocation_rollup_write_failures_total", "Rollup adjustments lost after their allocation write; reports drift until rebuilt", ()
+)
+
+# Admission control (app/admission.py)
+REQUESTS_SHED = Counter(
+    "http_requests_shed_total", "Requests rejected by admission control", ("method", "priority", "status")
+)
+ADMISSION_LIMIT = Gauge("admission_concurrency_limit", "Current adaptive concurrency limit", ())
+
+# MongoDB commands
+COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trip time", ("command", "outcome")
+)
+
+# MongoDB connection pool
+POOL_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("address",)
+)
+POOL_CHECKOUT_FAILURES = Counter(
+    "mongodb_pool_checkout_failures_total", "Failed connection checkouts", ("address", "reason")
+)
+POOL_CONNECTIONS = Gauge("mongodb_pool_connections", "Open connections in the pool", ("address",))
+POOL_CHECKED_OUT = Gauge("mongodb_pool_checked_out_connections", "Connections currently checked out", ("address",))
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        COMMAND_DURATION.observe(event.duration_micros / 1_000_000, event.command_name, "succeeded")
+
+    def failed(self, event):
+        COMMAND_DURATION.observe(event.duration_micros / 1_000_000, event.command_name, "failed")
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = f"{event.address[0]}:{event.address[1]}"
+        POOL_CONNECTIONS.set(address, value=0)
+        POOL_CHECKED_OUT.set(address, value=0)
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.inc(f"{event.address[0]}:{event.address[1]}")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.dec(f"{event.address[0]}:{event.address[1]}")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        address = f"{event.address[0]}:{event.address[1]}"
+        POOL_CHECKOUT_FAILURES.inc(address, str(event.reason))
+        duration = getattr(event, "duration", None)  # pymongo >= 4.7
+        if duration is not None:
+            POOL_CHECKOUT_WAIT.observe(duration, address)
+
+    def connection_checked_out(self, event):
+        address = f"{event.address[0]}:{event.address[1]}"
+        POOL_CHECKED_OUT.inc(address)
+        duration = getattr(event, "duration", None)  # pymongo >= 4.7
+        if duration is not None:
+            POOL_CHECKOUT_WAIT.observe(duration, address)
+
+    def connection_checked_in(self, event):
+        POOL_CHECKED_OUT.dec(f"{event.address[0]}:{event.address[1]}")
+
+
+def mongo_event_listeners() -> list:
+    return [CommandMetricsListener(), PoolMetricsListener()]
+
+
+def route_template(scope) -> str:
+    # Label by route template (/allocations/{allocation_id}), never by raw path,
+    # so the number of series stays bounded
+    app = scope.get("app")
+    if app is not None:
+        for route in app.router.routes:
+            if getattr(route, "path", None) is None:
+                continue
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+    return "unmatched"
+
+
+def matched_template(scope) -> Optional[str]:
+    # Template of the route that handled the request, once routing is done.
+    # Newer FastAPI versions route included routers lazily, and their routes
+    # carry only their own part of the path, so the literal prefix (/api/v1)
+    # is taken back from the request path
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    regex = getattr(route, "path_regex", None)
+    if template is None or regex is None:
+        return template
+    path = scope["path"]
+    if regex.match(path):
+        return template
+    start = path.find("/", 1)
+    while start != -1:
+        if regex.match(path[start:]):
+            return path[:start] + template
+        start = path.find("/", start + 1)
+    return template
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: cheaper than BaseHTTPMiddleware and streaming-safe
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            template = route if route != "unmatched" else matched_template(scope) or route
+            REQUEST_DURATION.observe(time.perf_counter() - start, method, template, status)
+            REQUESTS_IN_FLIGHT.dec(method, route)
@@ -1,6 +1,6 @@
 from datetime import date
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Annotated, Any, Optional, List, Dict
 from bson import ObjectId
 
 class AllocationBase(BaseModel):
@@ -12,6 +12,17 @@ class AllocationBase(BaseModel):
 class AllocationCreate(AllocationBase):
     pass
 
+class AllocationBulkCreate(BaseModel):
+    items: List[AllocationCreate] = Field(..., min_length=1, max_length=10000)
+
+class AllocationSeriesCreate(BaseModel):
+    employee_id: int
+    vehicle_id: int
+    start_date: date  # Inclusive
+    end_date: date  # Inclusive
+    weekdays: Optional[List[Annotated[int, Field(ge=0, le=6)]]] = None  # 0 = Monday; every day when None
+    purpose: str
+
 class AllocationUpdate(BaseModel):
     employee_id: Optional[int] = None
     vehicle_id: Optional[int] = None
@@ -36,3 +47,150 @@ class AllocationListResponse(BaseModel):
     status: str
     message: str
     data: List[Allocation]
+    next_cursor: Optional[str] = None  # Pass back as `cursor` to fetch the next page
+    total: Optional[int] = None  # Matching rows, when include_total is set
+    total_estimated: Optional[bool] = None  # Whether total comes from collection metadata
+
+class AllocationBulkItemResult(BaseModel):
+    index: int  # Position of the item in the request batch
+    status: str
+    message: str
+    data: Optional[Allocation] = None
+
+class AllocationBulkResponse(BaseModel):
+    status: str
+    message: str
+    data: List[AllocationBulkItemResult]
+
+class AllocationSeriesResponse(BaseModel):
+    status: str
+    message: str
+    data: List[Allocation]  # One allocation per date of the series, in date order
+
+class AssignmentRequest(BaseModel):
+    employee_id: int
+    allocation_date: date
+    purpose: str
+    preferred_vehicle_ids: List[int] = []  # Tried first, in order
+    eligible_vehicle_ids: Optional[List[int]] = None  # Any free vehicle when None
+
+class AssignmentCreate(BaseModel):
+    items: List[AssignmentRequest] = Field(..., min_length=1, max_length=10000)
+    dry_run: bool = False  # Compute the assignment without booking it
+
+class AssignmentItemResult(BaseModel):
+    index: int  # Position of the request in the batch
+    status: str
+    message: str
+    vehicle_id: Optional[int] = None  # Assigned vehicle
+    data: Optional[Allocation] = None  # Created allocation (not set on dry runs)
+
+class AssignmentResponse(BaseModel):
+    status: str
+    message: str
+    data: List[AssignmentItemResult]
+
+class VehicleAvailability(BaseModel):
+    start_date: date
+    end_date: date
+    count: int
+    vehicle_ids: List[int]  # Vehicles free on every date in the range
+
+class VehicleAvailabilityResponse(BaseModel):
+    status: str
+    message: str
+    data: VehicleAvailability
+
+class CacheStats(BaseModel):
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+class CacheStatsResponse(BaseModel):
+    status: str
+    message: str
+    data: Dict[str, CacheStats]  # Keyed by cache name (lookups, history, totals)
+
+class AdmissionStats(BaseModel):
+    limit: int  # Current adaptive concurrency limit
+    in_flight: Dict[str, int]  # By priority class (write, read, scan)
+    queued: int
+    pool_wait_ms: float  # Longest pool checkout wait in the last window
+    shed: Dict[str, int]  # Rejections by status (429, 503)
+
+class AdmissionStatsResponse(BaseModel):
+    status: str
+    message: str
+    data: AdmissionStats
+
+class StackSamples(BaseModel):
+    stack: str  # Folded: outermost frame first, "dir/file.py:function" separated by ";"
+    samples: int
+
+class FunctionSamples(BaseModel):
+    function: str
+    samples: int  # Samples with the function anywhere on the stack
+
+class ProfileData(BaseModel):
+    enabled: bool
+    interval_ms: float
+    samples: int
+    stacks: List[StackSamples]
+    functions: List[FunctionSamples]
+
+class ProfileResponse(BaseModel):
+    status: str
+    message: str
+    data: ProfileData
+
+class ProfilerUpdate(BaseModel):
+    enabled: bool
+    interval_ms: Optional[float] = Field(None, ge=1, le=1000)
+
+class MongoCommandCapture(BaseModel):
+    command: str
+    collection: Optional[str]
+    shape: Any  # The command with every value replaced by its type name
+    duration_ms: float
+    outcome: str
+
+class SlowRequest(BaseModel):
+    method: str
+    route: str
+    query: str  # Parameter names only
+    status: int
+    started_at: float
+    duration_ms: float
+    mongo_ms: float  # Sum of the command durations
+    sampled_cpu_ms: float  # Stack samples taken while the request was running, times the interval
+    commands: List[MongoCommandCapture]
+    dropped_commands: int
+    stacks: List[StackSamples]
+
+class SlowRequestLog(BaseModel):
+    enabled: bool
+    threshold_ms: float
+    requests: List[SlowRequest]  # Newest first
+
+class SlowRequestLogResponse(BaseModel):
+    status: str
+    message: str
+    data: SlowRequestLog
+
+class SlowRequestLogUpdate(BaseModel):
+    enabled: bool
+    threshold_ms: Optional[float] = Field(None, ge=0)
+
+class UtilizationRow(BaseModel):
+    entity_id: int  # Vehicle or employee id, per group_by
+    month: str  # YYYY-MM
+    allocated_days: int
+    days_in_month: int
+    utilization: float  # allocated_days / days_in_month
+
+class UtilizationResponse(BaseModel):
+    status: str
+    message: str
+    data: List[UtilizationRow]
@@ -0,0 +1,306 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+from urllib.parse import parse_qsl
+from pymongo import monitoring
+from app.config import settings
+from app.metrics import matched_template
+
+# Opt-in profiling, switched on and off at runtime through the admin API:
+#
+# - A sampling profiler: a daemon thread reads the event loop thread's stack
+#   every interval (sys._current_frames) and counts it as a folded stack
+#   ("file:function;file:function;..."), the input format of flame graph
+#   tools. Nothing runs in the request path, and nothing at all while off.
+# - A slow-request log: every request gets a capture holding its normalized
+#   route and query, the MongoDB commands it issued (shapes only, no values)
+#   with their durations, and the stack samples taken while its task was the
+#   one running. Captures of requests slower than the threshold are kept in a
+#   ring buffer. Commands are attributed through a context variable, which
+#   Motor copies into its executor threads where the command listener runs.
+#
+# Samples are attributed to a request by the task running on the loop at the
+# time, so a capture's stacks only cover its own CPU time, not time spent
+# awaiting MongoDB or other requests.
+
+# Distinct folded stacks kept by the profiler; further ones are counted as "[other]"
+MAX_STACKS = 10000
+MAX_DEPTH = 64
+# Stacks and functions returned per capture or profile
+TOP_STACKS = 20
+
+# Command fields that carry session or routing metadata, not the query
+IGNORED_COMMAND_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "signature"}
+
+_capture: contextvars.ContextVar = contextvars.ContextVar("request_capture", default=None)
+
+
+def normalize_query(query_string: bytes) -> str:
+    # Parameter names with their values elided, sorted: one entry per query shape
+    names = sorted({name for name, _ in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)})
+    return "&".join(f"{name}=?" for name in names)
+
+
+def command_shape(value, depth: int = 0):
+    # Keys and nesting of a command with every value replaced by its type name
+    if isinstance(value, dict):
+        if depth >= 4:
+            return "{...}"
+        return {
+            key: command_shape(item, depth + 1)
+            for key, item in value.items() if key not in IGNORED_COMMAND_FIELDS
+        }
+    if isinstance(value, (list, tuple)):
+        return [command_shape(value[0], depth + 1), f"x{len(value)}"] if value else []
+    return type(value).__name__
+
+
+@dataclass
+class RequestCapture:
+    method: str
+    path: str
+    query: str
+    started_at: float  # Unix time
+    route: Optional[str] = None  # Route template, once routed
+    status: int = 500
+    duration_ms: float = 0.0
+    commands: List[dict] = field(default_factory=list)
+    dropped_commands: int = 0
+    stacks: Counter = field(default_factory=Counter)
+    _pending: Dict[int, tuple] = field(default_factory=dict)  # MongoDB request id -> (name, collection, shape)
+
+    def summary(self, interval: float) -> dict:
+        mongo_ms = sum(command["duration_ms"] for command in self.commands)
+        return {
+            "method": self.method,
+            "route": self.route or self.path,
+            "query": self.query,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3),
+            "mongo_ms": round(mongo_ms, 3),
+            "sampled_cpu_ms": round(sum(self.stacks.values()) * interval * 1000, 3),
+            "commands": self.commands,
+            "dropped_commands": self.dropped_commands,
+            "stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(TOP_STACKS)]
+        }
+
+
+class Profiler:
+    def __init__(self, interval: float = 0.01, slow_threshold: float = 0.5, slow_log_size: int = 100, max_commands: int = 100):
+        self.interval = interval
+        self.profiling = False
+        self.slow_log_enabled = False
+        self.slow_threshold = slow_threshold
+        self.max_commands = max_commands
+        self.slow_requests: Deque[dict] = deque(maxlen=slow_log_size)
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._labels: Dict[object, str] = {}  # Code object -> "file:function"
+        self._captures: Dict[asyncio.Task, RequestCapture] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def attach(self):
+        # Called on the event loop thread (application startup or the admin API)
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+
+    def configure(
+            self,
+            profiling: Optional[bool] = None,
+            interval: Optional[float] = None,
+            slow_log: Optional[bool] = None,
+            slow_threshold: Optional[float] = None
+        ):
+        # Runtime toggle; the sampler thread runs while either feature is on
+        if self._loop is None:
+            self.attach()
+        if profiling is not None:
+            self.profiling = profiling
+        if interval is not None:
+            self.interval = interval
+        if slow_log is not None:
+            self.slow_log_enabled = slow_log
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+
+        wanted = self.profiling or self.slow_log_enabled
+        if wanted and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        elif not wanted and self._thread is not None:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def clear(self):
+        with self._lock:
+            self.samples = 0
+            self.stacks.clear()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            directory, filename = os.path.split(code.co_filename)
+            label = self._labels[code] = f"{os.path.basename(directory)}/{filename}:{code.co_name}"
+        return label
+
+    def _fold(self, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < MAX_DEPTH:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = self._fold(frame)
+            task = asyncio.current_task(self._loop)
+            del frame
+            with self._lock:
+                if self.profiling:
+                    self.samples += 1
+                    if stack in self.stacks or len(self.stacks) < MAX_STACKS:
+                        self.stacks[stack] += 1
+                    else:
+                        self.stacks["[other]"] += 1
+                capture = self._captures.get(task) if task is not None else None
+                if capture is not None:
+                    capture.stacks[stack] += 1
+
+    def profile(self, limit: int = TOP_STACKS) -> dict:
+        with self._lock:
+            stacks = self.stacks.most_common()
+            samples = self.samples
+        inclusive: Counter = Counter()
+        for stack, count in stacks:
+            for label in set(stack.split(";")):
+                inclusive[label] += count
+        return {
+            "enabled": self.profiling,
+            "interval_ms": self.interval * 1000,
+            "samples": samples,
+            "stacks": [{"stack": stack, "samples": count} for stack, count in stacks[:limit]],
+            "functions": [{"function": label, "samples": count} for label, count in inclusive.most_common(limit)]
+        }
+
+    def folded(self) -> str:
+        # Every stack, one "stack count" line each (flamegraph.pl, speedscope)
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def begin(self, capture: RequestCapture) -> asyncio.Task:
+        # Called from the request's task
+        task = asyncio.current_task()
+        with self._lock:
+            self._captures[task] = capture
+        return task
+
+    def end(self, task, capture: RequestCapture):
+        with self._lock:
+            self._captures.pop(task, None)
+        if capture.duration_ms >= self.slow_threshold * 1000:
+            self.slow_requests.appendleft(capture.summary(self.interval))
+
+
+class CommandCaptureListener(monitoring.CommandListener):
+    # Runs on Motor's executor threads, inside the context of the request that
+    # issued the command
+    def __init__(self, profiler: "Profiler"):
+        self.profiler = profiler
+
+    def started(self, event):
+        capture = _capture.get()
+        if capture is None:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        capture._pending[event.request_id] = (
+            event.command_name,
+            collection if isinstance(collection, str) else None,
+            command_shape(command)
+        )
+
+    def _finished(self, event, outcome: str):
+        capture = _capture.get()
+        if capture is None:
+            return
+        pending = capture._pending.pop(event.request_id, None)
+        if pending is None:
+            return
+        if len(capture.commands) >= self.profiler.max_commands:
+            capture.dropped_commands += 1
+            return
+        name, collection, shape = pending
+        capture.commands.append({
+            "command": name,
+            "collection": collection,
+            "shape": shape,
+            "duration_ms": event.duration_micros / 1000,
+            "outcome": outcome
+        })
+
+    def succeeded(self, event):
+        self._finished(event, "succeeded")
+
+    def failed(self, event):
+        self._finished(event, "failed")
+
+
+class ProfilingMiddleware:
+    # Plain ASGI middleware; a single attribute check per request while the slow log is off
+    def __init__(self, app, instance: Optional[Profiler] = None):
+        self.app = app
+        self.profiler = instance or profiler
+
+    async def __call__(self, scope, receive, send):
+        profiler = self.profiler
+        if scope["type"] != "http" or not profiler.slow_log_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        capture = RequestCapture(scope["method"], scope["path"], normalize_query(scope.get("query_string", b"")), time.time())
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+            await send(message)
+
+        token = _capture.set(capture)
+        task = profiler.begin(capture)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            capture.duration_ms = (time.perf_counter() - start) * 1000
+            capture.route = matched_template(scope)
+            profiler.end(task, capture)
+            _capture.reset(token)
+
+
+# Shared by every request in this process
+profiler = Profiler(
+    interval=settings.profiling_interval_ms / 1000,
+    slow_threshold=settings.slow_request_threshold_ms / 1000,
+    slow_log_size=settings.slow_request_log_size,
+    max_commands=settings.slow_request_max_commands
+)
+
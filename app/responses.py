@@ -0,0 +1,84 @@
+import json
+from datetime import datetime
+from email.utils import formatdate
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+# Fast response path for list endpoints. Rows are encoded once, straight from
+# the projected MongoDB documents, and written as bytes, instead of being built
+# into Allocation models and then validated and serialized again by FastAPI
+# against response_model. The response_model stays on the route, so the
+# OpenAPI schema is unchanged.
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_allocation(document: dict) -> dict:
+    # Same field order and encoding as Allocation serialized by alias
+    allocation_id = document["_id"]
+    allocation_date = document["allocation_date"]
+    return {
+        "employee_id": document["employee_id"],
+        "vehicle_id": document["vehicle_id"],
+        "allocation_date": (allocation_date.date() if isinstance(allocation_date, datetime) else allocation_date).isoformat(),
+        "purpose": document["purpose"],
+        "_id": str(allocation_id) if isinstance(allocation_id, ObjectId) else allocation_id
+    }
+
+
+def allocation_list_response(
+        message: str,
+        documents: List[dict],
+        next_cursor: Optional[str] = None,
+        total: Optional[int] = None,
+        total_estimated: Optional[bool] = None
+    ) -> FastJSONResponse:
+    return FastJSONResponse({
+        "status": "success",
+        "message": message,
+        "data": [encode_allocation(document) for document in documents],
+        "next_cursor": next_cursor,
+        "total": total,
+        "total_estimated": total_estimated
+    })
+
+
+# Conditional GET. Representations of dates before today never change (past
+# allocations cannot be created, updated or deleted), so they may be cached for
+# good; everything else must be revalidated with its ETag.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def validator_headers(etag: str, modified_at: float, immutable: bool = False) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified_at, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison, as If-None-Match requires
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
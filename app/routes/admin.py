@@ -0,0 +1,112 @@
+from typing import Literal
+from fastapi import APIRouter, Query
+from fastapi.responses import PlainTextResponse
+from app.admission import admission_controller
+from app.models.schemas import (
+    AdmissionStatsResponse,
+    CacheStatsResponse,
+    ProfileResponse,
+    ProfilerUpdate,
+    SlowRequestLogResponse,
+    SlowRequestLogUpdate
+)
+from app.profiling import profiler
+from app.services.cache import allocation_cache
+
+router = APIRouter()
+
+@router.get("/admin/cache", response_model=CacheStatsResponse)
+async def get_cache_stats():
+    return {
+        "status": "success",
+        "message": "Cache statistics retrieved successfully",
+        "data": allocation_cache.stats()
+    }
+
+@router.delete("/admin/cache", response_model=CacheStatsResponse)
+async def clear_cache():
+    allocation_cache.clear()
+    return {
+        "status": "success",
+        "message": "Cache cleared",
+        "data": allocation_cache.stats()
+    }
+
+@router.get("/admin/admission", response_model=AdmissionStatsResponse)
+async def get_admission_stats():
+    return {
+        "status": "success",
+        "message": "Admission control statistics retrieved successfully",
+        "data": admission_controller.stats()
+    }
+
+@router.get("/admin/profiler", response_model=ProfileResponse)
+async def get_profile(
+    format: Literal["json", "folded"] = "json",
+    limit: int = Query(20, ge=1, le=1000)
+):
+    # format=folded returns every stack as "stack count" lines for flame graph tools
+    if format == "folded":
+        return PlainTextResponse(profiler.folded())
+    return {
+        "status": "success",
+        "message": "Profile retrieved successfully",
+        "data": profiler.profile(limit)
+    }
+
+@router.put("/admin/profiler", response_model=ProfileResponse)
+async def configure_profiler(update: ProfilerUpdate):
+    profiler.configure(
+        profiling=update.enabled,
+        interval=update.interval_ms / 1000 if update.interval_ms is not None else None
+    )
+    return {
+        "status": "success",
+        "message": f"Profiler {'enabled' if update.enabled else 'disabled'}",
+        "data": profiler.profile()
+    }
+
+@router.delete("/admin/profiler", response_model=ProfileResponse)
+async def clear_profile():
+    profiler.clear()
+    return {
+        "status": "success",
+        "message": "Profile cleared",
+        "data": profiler.profile()
+    }
+
+def slow_request_log(limit: int = 100) -> dict:
+    return {
+        "enabled": profiler.slow_log_enabled,
+        "threshold_ms": profiler.slow_threshold * 1000,
+        "requests": list(profiler.slow_requests)[:limit]
+    }
+
+@router.get("/admin/slow-requests", response_model=SlowRequestLogResponse)
+async def get_slow_requests(limit: int = Query(100, ge=1, le=1000)):
+    return {
+        "status": "success",
+        "message": "Slow requests retrieved successfully",
+        "data": slow_request_log(limit)
+    }
+
+@router.put("/admin/slow-requests", response_model=SlowRequestLogResponse)
+async def configure_slow_requests(update: SlowRequestLogUpdate):
+    profiler.configure(
+        slow_log=update.enabled,
+        slow_threshold=update.threshold_ms / 1000 if update.threshold_ms is not None else None
+    )
+    return {
+        "status": "success",
+        "message": f"Slow request log {'enabled' if update.enabled else 'disabled'}",
+        "data": slow_request_log()
+    }
+
+@router.delete("/admin/slow-requests", response_model=SlowRequestLogResponse)
+async def clear_slow_requests():
+    profiler.slow_requests.clear()
+    return {
+        "status": "success",
+        "message": "Slow requests cleared",
+        "data": slow_request_log()
+    }
@@ -1,20 +1,67 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import Optional
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import Dict, Literal, Optional
 from datetime import date
-from app.database import get_database
+from bson.errors import InvalidId
+from pymongo.errors import ConnectionFailure
+from app.admission import overloaded
+from app.config import settings
+from app.responses import (
+    FastJSONResponse,
+    allocation_list_response,
+    etag_matches,
+    not_modified,
+    validator_headers
+)
 from app.models.schemas import (
     AllocationCreate,
+    AllocationBulkCreate,
+    AllocationBulkResponse,
+    AllocationSeriesCreate,
+    AllocationSeriesResponse,
     AllocationUpdate,
     AllocationResponse,
     AllocationListResponse
 )
-from app.services.allocation import AllocationService
+from app.services.allocation import AllocationService, SeriesConflictError, to_datetime
+from app.services.cache import allocation_cache, history_filter_key
+from app.services.coalescer import create_coalescer
+from app.services.export import EXPORT_FIELDS, EXPORT_MEDIA_TYPES, export_stream, parse_fields
+from app.services.feed import get_change_source
+from app.services.occupancy import occupancy_index
+from app.services.pagination import next_cursor
+from app.services.registry import entity_registry
+from app.services.versions import Version, version_tracker
+from app.storage import SORT_FIELDS, get_store
 
 router = APIRouter()
 
 async def get_allocation_service():
-    db = await get_database()
-    return AllocationService(db)
+    store = await get_store()
+    cache = allocation_cache if settings.cache_active() else None
+    registry = entity_registry if settings.registry_enabled else None
+    versions = version_tracker if settings.etags_active() else None
+    feed = await get_change_source() if settings.feed_active() else None
+    return AllocationService(
+        store, occupancy_index, cache, rollups=settings.rollups_enabled, registry=registry, versions=versions,
+        feed=feed
+    )
+
+# Most ids accepted by one batch fetch
+MAX_FETCH_IDS = 100
+
+def conditional_headers(request: Request, version: Version, immutable: bool = False) -> Optional[Dict[str, str]]:
+    # ETag, Last-Modified and Cache-Control for a read, or None when validators are disabled
+    if not settings.etags_active():
+        return None
+    etag = version_tracker.etag(version, request.url.path, request.url.query)
+    return validator_headers(etag, version.modified_at, immutable)
+
+def is_not_modified(request: Request, headers: Optional[Dict[str, str]]) -> bool:
+    # Checked before the query runs
+    return headers is not None and etag_matches(request.headers.get("if-none-match"), headers["ETag"])
 
 @router.post("/allocations/", response_model=AllocationResponse)
 async def create_allocation(
@@ -23,7 +70,10 @@ async def create_allocation(
 ):
     try:
         # Create allocation and get the resulting Allocation object
-        result = await service.create_allocation(allocation)
+        if settings.coalesce_creates:
+            result = await create_coalescer.submit(service, allocation)
+        else:
+            result = await service.create_allocation(allocation)
         
         return {
             "status": "success",
@@ -33,21 +83,101 @@ async def create_allocation(
     except ValueError as e:
         # Return a 400 error for ValueErrors
         raise HTTPException(status_code=400, detail=str(e))
+    except ConnectionFailure:
+        raise overloaded()
     except Exception as e:
         # Optionally handle other exceptions to avoid leaking information
         raise HTTPException(status_code=500, detail="An error occurred while creating allocation.")
 
+@router.post("/allocations/bulk", response_model=AllocationBulkResponse)
+async def create_allocations_bulk(
+    batch: AllocationBulkCreate,
+    service: AllocationService = Depends(get_allocation_service)
+):
+    try:
+        results = await service.create_allocations_bulk(batch.items)
+    except ConnectionFailure:
+        raise overloaded()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="An error occurred while creating allocations.")
+
+    created = sum(1 for result in results if result["status"] == "success")
+    return {
+        "status": "success",
+        "message": f"Created {created} of {len(results)} allocations",
+        "data": results
+    }
+
+@router.post("/allocations/series", response_model=AllocationSeriesResponse)
+async def create_allocation_series(
+    series: AllocationSeriesCreate,
+    service: AllocationService = Depends(get_allocation_service)
+):
+    try:
+        results = await service.create_allocation_series(series)
+    except SeriesConflictError as e:
+        # Nothing was booked; list every conflicting date so the client can adjust the series
+        raise HTTPException(status_code=400, detail={"message": str(e), "conflicts": jsonable_encoder(e.conflicts)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ConnectionFailure:
+        raise overloaded()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="An error occurred while creating allocations.")
+
+    return {
+        "status": "success",
+        "message": f"Created {len(results)} allocations",
+        "data": results
+    }
+
 @router.get("/allocations/", response_model=AllocationListResponse)
 async def list_allocations(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    ids: Optional[str] = Query(None, description=f"Comma-separated allocation ids to fetch (up to {MAX_FETCH_IDS}); paging is ignored"),
     service: AllocationService = Depends(get_allocation_service)
 ):
-    allocations = await service.get_allocations(skip, limit)
+    allocation_ids = [allocation_id.strip() for allocation_id in ids.split(",") if allocation_id.strip()] if ids else None
+    if allocation_ids is not None and len(allocation_ids) > MAX_FETCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_FETCH_IDS} ids can be fetched at once")
+
+    if allocation_ids is not None:
+        version = version_tracker.ids_version(allocation_ids)
+    else:
+        version = version_tracker.filter_version(history_filter_key(None, None, None, None))
+    headers = conditional_headers(request, version)
+    if is_not_modified(request, headers):
+        return not_modified(headers)
+
+    try:
+        if allocation_ids is not None:
+            allocations = await service.get_allocations_by_ids(allocation_ids)
+        else:
+            allocations = await service.get_allocations(skip, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if headers is not None and allocation_ids is not None:
+        # A batch of past allocations never changes
+        today = to_datetime(date.today())
+        headers = conditional_headers(request, version, all(a["allocation_date"] < today for a in allocations))
+
+    message = "Allocations retrieved successfully"
+    page_cursor = next_cursor(allocations, limit, "_id", 1) if allocation_ids is None else None
+    if settings.fast_responses:
+        result = allocation_list_response(message, allocations, page_cursor)
+        result.headers.update(headers or {})
+        return result
+    response.headers.update(headers or {})
     return {
         "status": "success",
-        "message": "Allocations retrieved successfully",
-        "data": allocations  # allocations will be a list of Allocation objects
+        "message": message,
+        "data": allocations,
+        "next_cursor": page_cursor
     }
 
 @router.put("/allocations/{allocation_id}", response_model=AllocationResponse)
@@ -81,25 +211,130 @@ async def delete_allocation(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/allocations/export")
+async def export_allocation_history(
+    employee_id: Optional[int] = Query(None, description="Filter by employee ID"),
+    vehicle_id: Optional[int] = Query(None, description="Filter by vehicle ID"),
+    start_date: Optional[date] = Query(None, description="Filter by start date"),
+    end_date: Optional[date] = Query(None, description="Filter by end date"),
+    sort_by: str = Query("allocation_date", description=f"Field to sort by ({', '.join(SORT_FIELDS)})"),
+    sort_order: int = Query(-1, description="Sort order: 1 for ascending, -1 for descending"),
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="Output format"),
+    fields: str = Query(",".join(EXPORT_FIELDS), description="Comma-separated fields to export"),
+    batch_size: int = Query(1000, ge=1, le=10000, description="Rows fetched and written per chunk"),
+    service: AllocationService = Depends(get_allocation_service)
+):
+    try:
+        selected = parse_fields(fields)
+        # Rows are streamed straight from the cursor, one batch in memory at a time
+        rows = service.iter_allocation_history(
+            employee_id, vehicle_id, start_date, end_date, sort_by, sort_order, selected, batch_size
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        export_stream(rows, format, selected, batch_size),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="allocations.{format}"'}
+    )
+
 @router.get("/allocations/history", response_model=AllocationListResponse)
 async def get_allocation_history(
+    request: Request,
+    response: Response,
     employee_id: Optional[int] = Query(None, description="Filter by employee ID"),
     vehicle_id: Optional[int] = Query(None, description="Filter by vehicle ID"),
     start_date: Optional[date] = Query(None, description="Filter by start date"),
     end_date: Optional[date] = Query(None, description="Filter by end date"),
     skip: int = Query(0, ge=0, description="Number of records to skip for pagination"),
     limit: int = Query(10, ge=1, description="Maximum number of records to return"),
-    sort_by: str = Query("allocation_date", description="Field to sort by"),
+    sort_by: str = Query("allocation_date", description=f"Field to sort by ({', '.join(SORT_FIELDS)})"),
     sort_order: int = Query(-1, description="Sort order: 1 for ascending, -1 for descending"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page (skip is ignored)"),
+    include_total: bool = Query(False, description="Also return the number of matching rows"),
+    explain: bool = Query(False, description="Return the query plan and execution statistics instead of rows"),
     service: AllocationService = Depends(get_allocation_service)
 ):
-    # Fetch allocations with pagination and sorting
-    allocations = await service.get_allocation_history(
-        employee_id, vehicle_id, start_date, end_date, skip, limit, sort_by, sort_order
+    if explain:
+        try:
+            plan = await service.explain_allocation_history(
+                employee_id, vehicle_id, start_date, end_date, skip, limit, sort_by, sort_order, cursor
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return FastJSONResponse({"status": "success", "message": "Allocation history query plan", "data": plan})
+
+    # A range entirely before today can no longer change
+    history_filter = history_filter_key(
+        employee_id, vehicle_id,
+        to_datetime(start_date) if start_date is not None else None,
+        to_datetime(end_date) if end_date is not None else None
+    )
+    headers = conditional_headers(
+        request, version_tracker.filter_version(history_filter), end_date is not None and end_date < date.today()
     )
-    
+    if is_not_modified(request, headers):
+        return not_modified(headers)
+
+    # Fetch allocations with pagination and sorting
+    total, total_estimated = None, None
+    try:
+        page = service.get_allocation_history(
+            employee_id, vehicle_id, start_date, end_date, skip, limit, sort_by, sort_order, cursor
+        )
+        if include_total:
+            # The count runs concurrently with the page fetch (and is usually cached)
+            allocations, (total, total_estimated) = await asyncio.gather(
+                page, service.count_allocation_history(employee_id, vehicle_id, start_date, end_date)
+            )
+        else:
+            allocations = await page
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    message = "Allocation history retrieved successfully"
+    page_cursor = next_cursor(allocations, limit, sort_by, sort_order)
+    if settings.fast_responses:
+        result = allocation_list_response(message, allocations, page_cursor, total, total_estimated)
+        result.headers.update(headers or {})
+        return result
+    response.headers.update(headers or {})
+    return {
+        "status": "success",
+        "message": message,
+        "data": allocations,
+        "next_cursor": page_cursor,
+        "total": total,
+        "total_estimated": total_estimated
+    }
+
+# Registered after /allocations/export and /allocations/history so those paths
+# are not taken for an id
+@router.get("/allocations/{allocation_id}", response_model=AllocationResponse)
+async def get_allocation(
+    allocation_id: str,
+    request: Request,
+    response: Response,
+    service: AllocationService = Depends(get_allocation_service)
+):
+    version = version_tracker.ids_version([allocation_id])
+    headers = conditional_headers(request, version)
+    if is_not_modified(request, headers):
+        return not_modified(headers)
+
+    try:
+        allocation = await service.get_allocation(allocation_id)
+    except InvalidId as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if allocation is None:
+        raise HTTPException(status_code=404, detail="Allocation not found")
+
+    if headers is not None:
+        # A past allocation never changes
+        response.headers.update(conditional_headers(request, version, allocation.allocation_date < date.today()))
     return {
         "status": "success",
-        "message": "Allocation history retrieved successfully",
-        "data": allocations
-    }
\ No newline at end of file
+        "message": "Allocation retrieved successfully",
+        "data": allocation
+    }
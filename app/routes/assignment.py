@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException, Depends
+from pymongo.errors import ConnectionFailure
+from app.admission import overloaded
+from app.models.schemas import AssignmentCreate, AssignmentResponse
+from app.routes.allocation import get_allocation_service
+from app.services.allocation import AllocationService
+from app.services.assignment import AssignmentService
+from app.services.occupancy import occupancy_index
+
+router = APIRouter()
+
+async def get_assignment_service(allocations: AllocationService = Depends(get_allocation_service)):
+    return AssignmentService(allocations, occupancy_index)
+
+@router.post("/assignments", response_model=AssignmentResponse)
+async def assign_vehicles(
+    batch: AssignmentCreate,
+    service: AssignmentService = Depends(get_assignment_service)
+):
+    try:
+        results = await service.assign(batch.items, batch.dry_run)
+    except ConnectionFailure:
+        raise overloaded()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="An error occurred while assigning vehicles.")
+
+    assigned = sum(1 for result in results if result["status"] == "success")
+    return {
+        "status": "success",
+        "message": f"Assigned vehicles to {assigned} of {len(results)} requests" + (" (dry run)" if batch.dry_run else ""),
+        "data": results
+    }
@@ -0,0 +1,98 @@
+import json
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from datetime import date
+from app.config import settings
+from app.services.allocation import to_datetime
+from app.services.cache import history_filter_key
+from app.services.feed import change_broker, get_change_source
+
+router = APIRouter()
+
+def feed_filter(
+        employee_id: Optional[int],
+        vehicle_id: Optional[int],
+        start_date: Optional[date],
+        end_date: Optional[date]
+    ) -> tuple:
+    # Same filter as the history endpoint
+    return history_filter_key(
+        employee_id, vehicle_id,
+        to_datetime(start_date) if start_date is not None else None,
+        to_datetime(end_date) if end_date is not None else None
+    )
+
+@router.get("/feed/allocations")
+async def allocation_feed(
+    request: Request,
+    employee_id: Optional[int] = None,
+    vehicle_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    resume: Optional[str] = Query(None, description="Token of the last event received; EventSource sends it as Last-Event-ID")
+):
+    # Server-Sent Events: one "create", "update" or "delete" event per matching
+    # write. A "reset" event means events were missed and the view must be reloaded.
+    if not settings.feed_active():
+        raise HTTPException(status_code=404, detail="Change feed is disabled")
+    await get_change_source()
+    subscription = change_broker.subscribe(
+        feed_filter(employee_id, vehicle_id, start_date, end_date),
+        request.headers.get("last-event-id") or resume
+    )
+
+    async def events():
+        try:
+            if subscription.reset:
+                yield "event: reset\ndata: {}\n\n"
+            while not subscription.closed or subscription.pending:
+                event = await subscription.next(settings.feed_heartbeat_seconds)
+                if event is None:
+                    if await request.is_disconnected():
+                        break
+                    if not subscription.closed:
+                        yield ": keepalive\n\n"
+                    continue
+                yield f"id: {event.token}\nevent: {event.op}\ndata: {event.payload}\n\n"
+        finally:
+            change_broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/feed/allocations/ws")
+async def allocation_feed_ws(
+    websocket: WebSocket,
+    employee_id: Optional[int] = None,
+    vehicle_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    resume: Optional[str] = None
+):
+    # Same events as the SSE feed, one JSON message each; {"op": "reset"} means reload
+    if not settings.feed_active():
+        await websocket.close(code=1008)
+        return
+    await get_change_source()
+    await websocket.accept()
+    subscription = change_broker.subscribe(feed_filter(employee_id, vehicle_id, start_date, end_date), resume)
+    try:
+        if subscription.reset:
+            await websocket.send_text(json.dumps({"op": "reset"}))
+        while not subscription.closed or subscription.pending:
+            event = await subscription.next(settings.feed_heartbeat_seconds)
+            if event is None:
+                if not subscription.closed:
+                    await websocket.send_text(json.dumps({"op": "heartbeat"}))
+                continue
+            await websocket.send_text(event.payload)
+        # Fell behind: the client reconnects with the last token it received
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        change_broker.unsubscribe(subscription)
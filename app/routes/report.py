@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Literal, Optional
+from app.models.schemas import UtilizationResponse
+from app.services.utilization import UtilizationService
+from app.storage import get_store
+
+router = APIRouter()
+
+async def get_utilization_service():
+    store = await get_store()
+    return UtilizationService(store)
+
+@router.get("/reports/utilization", response_model=UtilizationResponse)
+async def get_utilization(
+    start_month: str = Query(..., description="First month of the report (YYYY-MM)"),
+    end_month: Optional[str] = Query(None, description="Last month of the report (YYYY-MM, defaults to start_month)"),
+    group_by: Literal["vehicle", "employee"] = Query("vehicle"),
+    entity_id: Optional[int] = Query(None, description="Report a single vehicle or employee"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    service: UtilizationService = Depends(get_utilization_service)
+):
+    try:
+        report = await service.get_utilization(
+            group_by, start_month, end_month or start_month, entity_id, skip, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "status": "success",
+        "message": "Utilization report retrieved successfully",
+        "data": report
+    }
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Optional
+from datetime import date
+from app.models.schemas import VehicleAvailabilityResponse
+from app.services.occupancy import occupancy_index
+from app.services.vehicle import VehicleService
+from app.storage import get_store
+
+router = APIRouter()
+
+async def get_vehicle_service():
+    store = await get_store()
+    return VehicleService(store, occupancy_index)
+
+@router.get("/vehicles/available", response_model=VehicleAvailabilityResponse)
+async def get_available_vehicles(
+    start_date: date = Query(..., description="First date the vehicle must be free"),
+    end_date: Optional[date] = Query(None, description="Last date the vehicle must be free (defaults to start_date)"),
+    service: VehicleService = Depends(get_vehicle_service)
+):
+    try:
+        vehicle_ids = await service.get_available_vehicles(start_date, end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "status": "success",
+        "message": "Available vehicles retrieved successfully",
+        "data": {
+            "start_date": start_date,
+            "end_date": end_date or start_date,
+            "count": len(vehicle_ids),
+            "vehicle_ids": vehicle_ids
+        }
+    }
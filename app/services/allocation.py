@@ -1,142 +1,470 @@
-from datetime import date, datetime
-from typing import Optional, List
-from motor.motor_asyncio import AsyncIOMotorDatabase
+import logging
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Optional, List, Tuple
 from bson import ObjectId
-from app.models.schemas import AllocationCreate, AllocationUpdate,  Allocation
+from bson.errors import InvalidId
+from app.metrics import ROLLUP_WRITE_FAILURES
+from app.services.cache import AllocationCache, history_filter_key, history_key
+from app.services.occupancy import OccupancyIndex
+from app.services.pagination import decode_cursor
+from app.services.registry import EntityRegistry
+from app.services.utilization import rollup_deltas
+from app.services.versions import VersionTracker
+from app.storage import ALLOCATION_FIELDS, AllocationStore, DuplicateAllocationError, HistoryQuery, plan_history
+from app.models.schemas import AllocationCreate, AllocationSeriesCreate, AllocationUpdate,  Allocation
+
+logger = logging.getLogger(__name__)
+
+VEHICLE_CONFLICT_MESSAGE = "Vehicle already allocated for this date"
+EMPLOYEE_CONFLICT_MESSAGE = "This employee already has allocated a vehicle for themselves at this date"
+# A unique index other than the two allocation rules
+CONFLICT_MESSAGE = "Allocation conflicts with an existing allocation"
+# A bulk item whose insert failed for a reason other than an allocation conflict
+INSERT_ERROR_MESSAGE = "An error occurred while creating allocation."
+
+# Conflicting unique field reported by the store -> message returned to clients
+CONFLICT_MESSAGES = {
+    "vehicle_id": VEHICLE_CONFLICT_MESSAGE,
+    "employee_id": EMPLOYEE_CONFLICT_MESSAGE
+}
+
+
+# Field whose id does not exist -> message returned to clients
+MISSING_MESSAGES = {
+    "vehicle_id": "Vehicle {} does not exist",
+    "employee_id": "Employee {} does not exist"
+}
+
+
+# Longest date range a series may span
+MAX_SERIES_DAYS = 366
+
+
+class SeriesConflictError(ValueError):
+    # A series was rejected as a whole; conflicts lists every date that clashed
+    def __init__(self, conflicts: List[dict]):
+        super().__init__(f"{len(conflicts)} date(s) of the series are already allocated; nothing was booked")
+        self.conflicts = conflicts  # {"allocation_date", "field", "message"}, in date order
+
+
+def series_dates(series: AllocationSeriesCreate) -> List[date]:
+    # Expand a range or weekly recurrence into its dates
+    days = (series.end_date - series.start_date).days + 1
+    if days < 1:
+        raise ValueError("end_date must not be before start_date")
+    if days > MAX_SERIES_DAYS:
+        raise ValueError(f"A series cannot span more than {MAX_SERIES_DAYS} days")
+    weekdays = set(range(7) if series.weekdays is None else series.weekdays)
+    dates = [
+        series.start_date + timedelta(days=offset) for offset in range(days)
+        if (series.start_date + timedelta(days=offset)).weekday() in weekdays
+    ]
+    if not dates:
+        raise ValueError("The series contains no dates")
+    return dates
+
+
+def to_datetime(value: date) -> datetime:
+    # Allocation dates are stored as midnight datetimes
+    return datetime.combine(value, datetime.min.time())
+
 
 class AllocationService:
-    def __init__(self, db: AsyncIOMotorDatabase):
-        self.db = db
+    def __init__(
+            self,
+            store: AllocationStore,
+            occupancy: Optional[OccupancyIndex] = None,
+            cache: Optional[AllocationCache] = None,
+            rollups: bool = False,
+            registry: Optional[EntityRegistry] = None,
+            versions: Optional[VersionTracker] = None,
+            feed=None
+        ):
+        self.store = store
+        # These are kept in step with every write when provided
+        self.occupancy = occupancy
+        self.cache = cache
+        self.versions = versions  # Version counters behind the ETag validators
+        self.feed = feed  # Change feed source (app.services.feed) told about every write
+        self.rollups = rollups  # Maintain the utilization counters on every write
+        self.registry = registry  # Validates employee and vehicle ids without a round trip
+
+    async def _check_references(self, employee_id: Optional[int], vehicle_id: Optional[int]):
+        if self.registry is None:
+            return
+        field = await self.registry.missing(self.store, employee_id, vehicle_id)
+        if field is not None:
+            raise ValueError(MISSING_MESSAGES[field].format(employee_id if field == "employee_id" else vehicle_id))
+
+    async def _record_rollups(self, removed: List[Optional[dict]], added: List[Optional[dict]]):
+        if not self.rollups:
+            return
+        deltas = rollup_deltas(removed, added)
+        if not deltas:
+            return
+        try:
+            await self.store.adjust_rollups(deltas)
+        except Exception as e:
+            # The allocation write already succeeded; the rebuild command repairs drift
+            ROLLUP_WRITE_FAILURES.inc()
+            logger.warning("Failed to update utilization rollups: %s", e)
+
+    def _record_write(self, allocation_id: Optional[str], before: Optional[dict], after: Optional[dict]):
+        # before/after hold employee_id, vehicle_id and allocation_date (as datetime)
+        if self.occupancy is not None:
+            if before:
+                self.occupancy.release(before["vehicle_id"], before["allocation_date"])
+            if after:
+                self.occupancy.occupy(after["vehicle_id"], after["allocation_date"])
+        if self.cache is not None:
+            self.cache.record_write(allocation_id, before, after)
+        if self.versions is not None:
+            self.versions.record(allocation_id, before, after)
+        if self.feed is not None:
+            self.feed.record(before, after)
 
     async def create_allocation(self, allocation: AllocationCreate) -> dict:
-        # Convert the allocation_date to a datetime object
-        allocation_date = datetime.combine(allocation.allocation_date, datetime.min.time())
-        
-        # Check if the vehicle is already allocated for the date
-        existing_vehicle_allocation = await self.db.allocations.find_one({
-            "vehicle_id": allocation.vehicle_id,
-            "allocation_date": allocation_date  # Use the datetime object here
-        })
-        if existing_vehicle_allocation:
-            raise ValueError("Vehicle already allocated for this date")
-
-        # Check if the employee is already allocated a vehicle for the same date
-        existing_employee_allocation = await self.db.allocations.find_one({
-            "employee_id": allocation.employee_id,
-            "allocation_date": allocation_date  # Check if the employee is already allocated for the same date
-        })
-        if existing_employee_allocation:
-            raise ValueError("This employee already has allocated a vehicle for themselves at this date")
-
-        # Check if the allocation date is in the future
+        # Check if the allocation date is in the future (no round trip needed)
         if allocation.allocation_date <= date.today():
             raise ValueError("Allocation date must be in the future")
 
+        # Both ids must exist (answered in-process)
+        await self._check_references(allocation.employee_id, allocation.vehicle_id)
+
         # Create allocation (store the datetime object)
         allocation_dict = allocation.model_dump()
-        allocation_dict["allocation_date"] = allocation_date  # Update the dict with the datetime
+        allocation_dict["allocation_date"] = to_datetime(allocation.allocation_date)
 
-        result = await self.db.allocations.insert_one(allocation_dict)
-        
-        # Convert ObjectId to string
-        allocation_data = await self.db.allocations.find_one({"_id": result.inserted_id})
-        allocation_data["_id"] = str(allocation_data["_id"])  # Convert ObjectId to string
+        # The unique (vehicle_id, allocation_date) and (employee_id, allocation_date)
+        # indexes enforce both conflict rules atomically, so a single insert is enough
+        try:
+            await self.store.insert(allocation_dict)
+        except DuplicateAllocationError as e:
+            raise ValueError(CONFLICT_MESSAGES.get(e.field, CONFLICT_MESSAGE)) from e
+
+        self._record_write(None, None, allocation_dict)
+        await self._record_rollups([], [allocation_dict])
+
+        # The insert sets _id on the dict, so the response is built without a read back
+        allocation_dict["_id"] = str(allocation_dict["_id"])  # Convert ObjectId to string
+
+        return allocation_dict
+
+    async def create_allocations_bulk(self, allocations: List[AllocationCreate]) -> List[dict]:
+        # One result per input item, in input order
+        results: List[dict] = [None] * len(allocations)
+        today = date.today()
+
+        def fail(index: int, message: str):
+            results[index] = {"index": index, "status": "error", "message": message, "data": None}
+
+        # Validate dates locally and drop conflicts inside the batch (first item wins)
+        candidates = []
+        batch_vehicles = set()
+        batch_employees = set()
+        for index, allocation in enumerate(allocations):
+            if allocation.allocation_date <= today:
+                fail(index, "Allocation date must be in the future")
+                continue
+            try:
+                await self._check_references(allocation.employee_id, allocation.vehicle_id)
+            except ValueError as e:
+                fail(index, str(e))
+                continue
+            allocation_date = to_datetime(allocation.allocation_date)
+            vehicle_key = (allocation.vehicle_id, allocation_date)
+            employee_key = (allocation.employee_id, allocation_date)
+            if vehicle_key in batch_vehicles:
+                fail(index, VEHICLE_CONFLICT_MESSAGE)
+                continue
+            if employee_key in batch_employees:
+                fail(index, EMPLOYEE_CONFLICT_MESSAGE)
+                continue
+            batch_vehicles.add(vehicle_key)
+            batch_employees.add(employee_key)
+            candidates.append((index, allocation, allocation_date))
+
+        if not candidates:
+            return results
+
+        # Find existing bookings for the whole batch in one set-based query
+        taken_vehicles = set()
+        taken_employees = set()
+        existing_allocations = await self.store.find_conflicts([
+            (allocation.vehicle_id, allocation.employee_id, allocation_date)
+            for _, allocation, allocation_date in candidates
+        ])
+        for existing in existing_allocations:
+            taken_vehicles.add((existing["vehicle_id"], existing["allocation_date"]))
+            taken_employees.add((existing["employee_id"], existing["allocation_date"]))
+
+        to_insert = []
+        for index, allocation, allocation_date in candidates:
+            if (allocation.vehicle_id, allocation_date) in taken_vehicles:
+                fail(index, VEHICLE_CONFLICT_MESSAGE)
+                continue
+            if (allocation.employee_id, allocation_date) in taken_employees:
+                fail(index, EMPLOYEE_CONFLICT_MESSAGE)
+                continue
+            allocation_dict = allocation.model_dump()
+            allocation_dict["allocation_date"] = allocation_date
+            to_insert.append((index, allocation_dict))
+
+        if not to_insert:
+            return results
+
+        # Unordered insert so one late conflict (a concurrent writer) does not stop the rest
+        failed = {
+            position: CONFLICT_MESSAGES.get(field, INSERT_ERROR_MESSAGE)
+            for position, field in (await self.store.insert_many([doc for _, doc in to_insert])).items()
+        }
+
+        created = []
+        for position, (index, allocation_dict) in enumerate(to_insert):
+            if position in failed:
+                fail(index, failed[position])
+                continue
+            if self.occupancy is not None:
+                self.occupancy.occupy(allocation_dict["vehicle_id"], allocation_dict["allocation_date"])
+            created.append(allocation_dict)
+            allocation_dict["_id"] = str(allocation_dict["_id"])  # Convert ObjectId to string
+            results[index] = {
+                "index": index,
+                "status": "success",
+                "message": "Allocation created successfully",
+                "data": allocation_dict
+            }
+
+        # One invalidation for the whole batch
+        if self.cache is not None and created:
+            self.cache.record_write(None, *created)
+        if self.versions is not None and created:
+            self.versions.record(None, *created)
+        if self.feed is not None:
+            for allocation_dict in created:
+                self.feed.record(None, allocation_dict)
+        await self._record_rollups([], created)
+
+        return results
+
+    async def create_allocation_series(self, series: AllocationSeriesCreate) -> List[dict]:
+        # Books every date of the series or none: one conflict query for the
+        # whole series, one insert for all of it, and if a concurrent writer
+        # takes a date in between, the dates already inserted are deleted again
+        dates = series_dates(series)
+        if dates[0] <= date.today():
+            raise ValueError("Allocation date must be in the future")
+
+        await self._check_references(series.employee_id, series.vehicle_id)
+
+        documents = [
+            {
+                "employee_id": series.employee_id,
+                "vehicle_id": series.vehicle_id,
+                "allocation_date": to_datetime(allocation_date),
+                "purpose": series.purpose
+            }
+            for allocation_date in dates
+        ]
+
+        conflicts = {}
+        for existing in await self.store.find_conflicts([
+            (series.vehicle_id, series.employee_id, document["allocation_date"]) for document in documents
+        ]):
+            # Report the vehicle clash when both apply, as create_allocation does
+            field = "vehicle_id" if existing["vehicle_id"] == series.vehicle_id else "employee_id"
+            conflicts.setdefault(existing["allocation_date"], field)
+        if conflicts:
+            raise SeriesConflictError(self._series_conflicts(conflicts))
+
+        failed = await self.store.insert_many(documents)
+        if failed:
+            await self.store.delete_many([
+                document["_id"] for position, document in enumerate(documents) if position not in failed
+            ])
+            if any(field is None for field in failed.values()):
+                raise RuntimeError("Failed to insert the allocation series")
+            raise SeriesConflictError(self._series_conflicts({
+                documents[position]["allocation_date"]: field for position, field in failed.items()
+            }))
+
+        for document in documents:
+            if self.occupancy is not None:
+                self.occupancy.occupy(document["vehicle_id"], document["allocation_date"])
+        if self.cache is not None:
+            self.cache.record_write(None, *documents)
+        if self.versions is not None:
+            self.versions.record(None, *documents)
+        if self.feed is not None:
+            for document in documents:
+                self.feed.record(None, document)
+        await self._record_rollups([], documents)
+
+        for document in documents:
+            document["_id"] = str(document["_id"])  # Convert ObjectId to string
+        return documents
+
+    @staticmethod
+    def _series_conflicts(conflicts: dict) -> List[dict]:
+        # {allocation_date: field} -> the conflicts reported to the client
+        return [
+            {"allocation_date": allocation_date.date(), "field": field, "message": CONFLICT_MESSAGES[field]}
+            for allocation_date, field in sorted(conflicts.items())
+        ]
 
-        return allocation_data
-    
     async def get_allocation(self, allocation_id: str) -> Allocation:
         # Convert the allocation_id string to ObjectId
         allocation_object_id = ObjectId(allocation_id)
         
+        # Serve repeated lookups (update and delete pre-reads) from the cache
+        if self.cache is not None:
+            cached = self.cache.get_allocation(allocation_id)
+            if cached is not None:
+                return cached
+
         # Fetch the allocation from the database
-        allocation = await self.db.allocations.find_one({"_id": allocation_object_id})
+        allocation = await self.store.find_by_id(allocation_object_id)
         
         if allocation:
             # Convert ObjectId to string for the _id field
             allocation["_id"] = str(allocation["_id"])
-            return Allocation(**allocation)  # Return Allocation instance
+            allocation = Allocation(**allocation)  # Return Allocation instance
+            if self.cache is not None:
+                self.cache.set_allocation(allocation_id, allocation)
+            return allocation
         return None  # Return None if not found
 
 
-    async def get_allocations(self, skip: int = 0, limit: int = 10) -> List[Allocation]:
-        cursor = self.db.allocations.find().skip(skip).limit(limit)
-        allocations = await cursor.to_list(length=limit)
+    async def get_allocations_by_ids(self, allocation_ids: List[str]) -> List[dict]:
+        # One $in query; rows come back in request order, unknown ids are left out
+        try:
+            object_ids = [ObjectId(allocation_id) for allocation_id in allocation_ids]
+        except InvalidId as e:
+            raise ValueError(str(e)) from e
+        found = {document["_id"]: document for document in await self.store.find_by_ids(object_ids)}
+        allocations = []
+        for object_id in dict.fromkeys(object_ids):
+            document = found.get(object_id)
+            if document is not None:
+                document["_id"] = str(document["_id"])  # Convert ObjectId to string
+                allocations.append(document)
+        return allocations
+
+    async def get_allocations(self, skip: int = 0, limit: int = 10, cursor: Optional[str] = None) -> List[dict]:
+        query = HistoryQuery(sort_by="_id", sort_order=1, skip=skip, limit=limit, fields=ALLOCATION_FIELDS)
+        if cursor:
+            # Resume after the last _id seen instead of skipping (skip is ignored)
+            query.after = decode_cursor(cursor, "_id", 1)
+            query.skip = 0
+
+        allocations = await self.store.find(query)
 
-        # Convert ObjectId to string for the _id field
+        # Convert ObjectId to string for the _id field; the route validates the
+        # rows against Allocation (or encodes them directly in fast mode)
         for allocation in allocations:
             allocation["_id"] = str(allocation["_id"])  # Convert ObjectId to string
 
-        # Now create Allocation instances
-        return [Allocation(**allocation) for allocation in allocations]
+        return allocations
 
-    async def update_allocation(self, allocation_id: str, update_data: AllocationUpdate) -> dict:
-        # Fetch the current allocation
-        allocation = await self.get_allocation(allocation_id)
-        if not allocation:
-            raise ValueError("Allocation not found")
+    async def _guard_failure(self, allocation_object_id: ObjectId, action: str) -> ValueError:
+        # Only read when a guarded write matched nothing, to tell why
+        if await self.store.find_by_id(allocation_object_id) is None:
+            return ValueError("Allocation not found")
+        return ValueError(f"Cannot {action} past allocations")
 
-        # Check if allocation date has passed (existing allocation date)
-        if allocation.allocation_date <= date.today():
-            raise ValueError("Cannot update past allocations")
-
-        # Prepare the update dictionary
+    async def update_allocation(self, allocation_id: str, update_data: AllocationUpdate) -> dict:
+        allocation_object_id = ObjectId(allocation_id)
         update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
+        if not update_dict:
+            # Nothing to write: the same checks against a plain read
+            allocation = await self.get_allocation(allocation_id)
+            if not allocation:
+                raise ValueError("Allocation not found")
+            if allocation.allocation_date <= date.today():
+                raise ValueError("Cannot update past allocations")
+            return allocation
 
-        # If updating allocation_date, vehicle_id, or employee_id, ensure constraints are met
-        if update_data.allocation_date or update_data.vehicle_id or update_data.employee_id:
-            # Convert allocation_date to datetime if present in update
-            new_allocation_date = allocation.allocation_date
-            if update_data.allocation_date:
-                new_allocation_date = datetime.combine(update_data.allocation_date, datetime.min.time())
-
-            # Check if the allocation date is in the future
-            if new_allocation_date.date() <= date.today():
+        # The new date must be in the future (no round trip needed)
+        if update_data.allocation_date:
+            if update_data.allocation_date <= date.today():
                 raise ValueError("Allocation date must be in the future")
+            update_dict["allocation_date"] = to_datetime(update_data.allocation_date)
 
-            # If vehicle_id is being updated, check if it's different from the existing one
-            if update_data.vehicle_id and update_data.vehicle_id != allocation.vehicle_id:
-                existing_vehicle_allocation = await self.db.allocations.find_one({
-                    "vehicle_id": update_data.vehicle_id,
-                    "allocation_date": new_allocation_date
-                })
-                if existing_vehicle_allocation and existing_vehicle_allocation["_id"] != allocation_id:
-                    raise ValueError("Vehicle already allocated for this date")
-
-            # If employee_id is being updated, check if it's different from the existing one
-            if update_data.employee_id and update_data.employee_id != allocation.employee_id:
-                existing_employee_allocation = await self.db.allocations.find_one({
-                    "employee_id": update_data.employee_id,
-                    "allocation_date": new_allocation_date
-                })
-                if existing_employee_allocation and existing_employee_allocation["_id"] != allocation_id:
-                    raise ValueError("This employee already has an allocated vehicle for this date")
-
-            # If allocation_date is being updated, add it to update_dict
-            if update_data.allocation_date:
-                update_dict["allocation_date"] = new_allocation_date
-
-        # If there are updates to apply, perform the update in the database
-        if update_dict:
-            await self.db.allocations.update_one(
-                {"_id": ObjectId(allocation_id)},
-                {"$set": update_dict}
-            )
+        # New employee and vehicle ids must exist (answered in-process)
+        await self._check_references(update_data.employee_id, update_data.vehicle_id)
 
-        # Return the updated allocation
-        return await self.get_allocation(allocation_id)
+        # One conditional find_one_and_update: it only matches an allocation that
+        # is still in the future, and the unique (vehicle_id|employee_id,
+        # allocation_date) indexes reject a conflicting change atomically
+        try:
+            before = await self.store.update(allocation_object_id, update_dict, after=to_datetime(date.today()))
+        except DuplicateAllocationError as e:
+            raise ValueError(CONFLICT_MESSAGES.get(e.field, CONFLICT_MESSAGE)) from e
+        if before is None:
+            raise await self._guard_failure(allocation_object_id, "update")
 
-        
+        # The new document is the old one with the $set applied, so no read back
+        after = dict(before, **update_dict)
+        self._record_write(allocation_id, before, after)
+        await self._record_rollups([before], [after])
+        after["_id"] = allocation_id
+        return Allocation(**after)
 
     async def delete_allocation(self, allocation_id: str):
-        allocation = await self.get_allocation(allocation_id)
-        if not allocation:
-            raise ValueError("Allocation not found")
+        # One conditional find_one_and_delete, guarded like update_allocation
+        allocation_object_id = ObjectId(allocation_id)
+        deleted = await self.store.delete(allocation_object_id, after=to_datetime(date.today()))
+        if deleted is None:
+            raise await self._guard_failure(allocation_object_id, "delete")
+        self._record_write(allocation_id, deleted, None)
+        await self._record_rollups([deleted], [])
 
-        # Check if allocation date has passed
-        if allocation.allocation_date <= date.today():  # Use dot notation
-            raise ValueError("Cannot delete past allocations")
+    @staticmethod
+    def _history_query(
+            employee_id: Optional[int],
+            vehicle_id: Optional[int],
+            start_date: Optional[date],
+            end_date: Optional[date],
+            sort_by: str,
+            sort_order: int
+        ) -> HistoryQuery:
+        query = HistoryQuery(sort_by=sort_by, sort_order=sort_order)
+        
+        # Filter by employee_id (0 is a valid id, so compare against None)
+        if employee_id is not None:
+            query.employee_id = employee_id
+        
+        # Filter by vehicle_id
+        if vehicle_id is not None:
+            query.vehicle_id = vehicle_id
+        
+        # Filter by allocation_date range (start_date to end_date)
+        if start_date is not None:
+            query.start = to_datetime(start_date)
+        if end_date is not None:
+            query.end = to_datetime(end_date)
+
+        # Reject sorts no index can serve before any round trip
+        plan_history(query)
+        return query
 
-        await self.db.allocations.delete_one({"_id": ObjectId(allocation_id)})
+    def iter_allocation_history(
+            self,
+            employee_id: Optional[int] = None,
+            vehicle_id: Optional[int] = None,
+            start_date: Optional[date] = None,
+            end_date: Optional[date] = None,
+            sort_by: str = "allocation_date",
+            sort_order: int = -1,
+            fields: Optional[List[str]] = None,  # Projection; all fields when None
+            batch_size: int = 1000  # Documents fetched per server round trip
+        ) -> AsyncIterator[dict]:
+        # Stream the whole filtered history without materializing it, so memory is
+        # bounded by one cursor batch however many rows match. The query is planned
+        # (and possibly rejected) here, before the response starts streaming
+        query = self._history_query(employee_id, vehicle_id, start_date, end_date, sort_by, sort_order)
+        query.fields = fields
+        return self.store.iterate(query, batch_size)
 
     async def get_allocation_history(
             self, 
@@ -147,36 +475,87 @@ class AllocationService:
             skip: int = 0,  # Pagination: skip the first N results
             limit: int = 10,  # Pagination: limit the number of results
             sort_by: str = "allocation_date",  # Sorting: field to sort by
-            sort_order: int = -1  # Sorting: 1 for ascending, -1 for descending
+            sort_order: int = -1,  # Sorting: 1 for ascending, -1 for descending
+            cursor: Optional[str] = None  # Keyset pagination: resume after this cursor
         ) -> list:
-        query = {}
-        
-        # Filter by employee_id
-        if employee_id:
-            query["employee_id"] = employee_id
-        
-        # Filter by vehicle_id
-        if vehicle_id:
-            query["vehicle_id"] = vehicle_id
-        
-        # Filter by allocation_date range (start_date to end_date)
-        if start_date or end_date:
-            query["allocation_date"] = {}
-            if start_date:
-                query["allocation_date"]["$gte"] = datetime.combine(start_date, datetime.min.time())
-            if end_date:
-                query["allocation_date"]["$lte"] = datetime.combine(end_date, datetime.min.time())
-
-        # Apply pagination and sorting
-        cursor = self.db.allocations.find(query).skip(skip).limit(limit).sort(sort_by, sort_order)
-        
-        # Fetch the allocation documents
-        allocations = await cursor.to_list(length=limit)
+        query = self._history_query(employee_id, vehicle_id, start_date, end_date, sort_by, sort_order)
+        query.skip = skip
+        query.limit = limit
+        query.fields = ALLOCATION_FIELDS
+
+        # Identical dashboard queries are served from the cache until a matching write
+        key = None
+        if self.cache is not None:
+            key = history_key(
+                query.employee_id, query.vehicle_id, query.start, query.end,
+                skip, limit, sort_by, sort_order, cursor
+            )
+            cached = self.cache.get_history(key)
+            if cached is not None:
+                return cached
+
+        # Seek past the last (sort key, _id) seen; skip is ignored when a cursor is given
+        if cursor:
+            query.after = decode_cursor(cursor, sort_by, sort_order)
+            query.skip = 0
+
+        # Fetch the allocation documents, sorted with _id as a tie-breaker
+        allocations = await self.store.find(query)
 
         # Convert ObjectId to string for serialization
         for allocation in allocations:
             allocation["_id"] = str(allocation["_id"])  # Convert ObjectId to string
 
+        if key is not None:
+            self.cache.set_history(key, allocations)
+
         return allocations
 
+    async def explain_allocation_history(
+            self,
+            employee_id: Optional[int] = None,
+            vehicle_id: Optional[int] = None,
+            start_date: Optional[date] = None,
+            end_date: Optional[date] = None,
+            skip: int = 0,
+            limit: int = 10,
+            sort_by: str = "allocation_date",
+            sort_order: int = -1,
+            cursor: Optional[str] = None
+        ) -> dict:
+        # The plan and execution statistics of the page get_allocation_history would
+        # fetch; never cached
+        query = self._history_query(employee_id, vehicle_id, start_date, end_date, sort_by, sort_order)
+        query.skip = skip
+        query.limit = limit
+        query.fields = ALLOCATION_FIELDS
+        if cursor:
+            query.after = decode_cursor(cursor, sort_by, sort_order)
+            query.skip = 0
+        return await self.store.explain(query)
+
+    async def count_allocation_history(
+            self,
+            employee_id: Optional[int] = None,
+            vehicle_id: Optional[int] = None,
+            start_date: Optional[date] = None,
+            end_date: Optional[date] = None
+        ) -> Tuple[int, bool]:
+        # Returns (total, estimated). Totals depend only on the filter, so every
+        # page, sort and cursor of one history view shares a single cached count
+        query = self._history_query(employee_id, vehicle_id, start_date, end_date, "allocation_date", -1)
+        history_filter = history_filter_key(query.employee_id, query.vehicle_id, query.start, query.end)
+
+        # No filter: collection metadata answers without a scan
+        if history_filter == (None, None, None, None):
+            return await self.store.estimated_count(), True
+
+        if self.cache is not None:
+            cached = self.cache.get_total(history_filter)
+            if cached is not None:
+                return cached, False
 
+        total = await self.store.count(query)
+        if self.cache is not None:
+            self.cache.set_total(history_filter, total)
+        return total, False
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from app.config import settings
+from app.storage import ArchivingAllocationStore
+from app.storage.archive import archive_horizon
+
+logger = logging.getLogger(__name__)
+
+# Background archiver for the hot/archive split (app.storage.archive). Each run
+# moves batches of allocations dated before the horizon until none are left,
+# yielding between batches so request latency is unaffected, then sleeps for
+# the interval. Copies are idempotent, so several workers running it at once
+# only repeat each other's work.
+
+
+class Archiver:
+    def __init__(self, batch_size: int = 1000, interval_seconds: float = 3600):
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.archived = 0  # Allocations moved by this process
+
+    async def archive(self, store: ArchivingAllocationStore) -> int:
+        # One full run; returns the number of allocations moved
+        cutoff = archive_horizon(store.archive_after_days)
+        moved = 0
+        while True:
+            count = await store.archive_batch(cutoff, self.batch_size)
+            moved += count
+            self.archived += count
+            if count < self.batch_size:
+                return moved
+            await asyncio.sleep(0)
+
+    async def run(self, store: ArchivingAllocationStore):
+        # Background loop started with the app
+        while True:
+            try:
+                moved = await self.archive(store)
+                if moved:
+                    logger.info("Archived %d allocations", moved)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Allocation archival failed: %s", e)
+            await asyncio.sleep(self.interval_seconds)
+
+
+# Shared by the app and scripts
+archiver = Archiver(settings.archive_batch_size, settings.archive_interval_seconds)
@@ -0,0 +1,208 @@
+from datetime import date, datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.models.schemas import AllocationCreate, AssignmentRequest
+from app.services.allocation import AllocationService, to_datetime
+from app.services.occupancy import OccupancyIndex
+
+# Automatic vehicle assignment. Each date is an independent bipartite matching
+# between that date's requests and the vehicles free on it. Vehicle sets are
+# the occupancy bitsets over the index's dense vehicle positions (request ids
+# are translated first, and ids outside the fleet drop out), so every step
+# works on whole rows of the request-by-vehicle matrix at once with
+# big-integer AND/OR instead of per-vehicle loops:
+#
+# 1. Greedy: requests with the fewest eligible vehicles go first and take
+#    their first free preferred vehicle, else their lowest free eligible one.
+#    This already matches nearly everything on realistic inputs.
+# 2. Augmenting paths: every request left over runs a breadth-first search over
+#    alternating paths (eligible vehicle -> the request holding it -> that
+#    request's other eligible vehicles ...) and, on reaching a free vehicle,
+#    shifts the path along by one. Vehicles visited by failed searches are
+#    skipped until the next success, since they cannot reach a free vehicle
+#    while the matching is unchanged. The result is a maximum matching.
+#
+# Preferences steer the greedy pass; an augmenting path may move a request off
+# its preferred vehicle when that is the only way to assign one more request.
+
+_bit_count = getattr(int, "bit_count", None)
+
+
+def popcount(mask: int) -> int:
+    # int.bit_count from Python 3.10
+    return _bit_count(mask) if _bit_count is not None else bin(mask).count("1")
+
+
+def lowest_bit(mask: int) -> int:
+    return (mask & -mask).bit_length() - 1
+
+
+def ids_to_mask(positions: Sequence[int]) -> int:
+    mask = 0
+    for position in positions:
+        mask |= 1 << position
+    return mask
+
+
+def match_requests(eligible: List[int], preferences: List[Sequence[int]]) -> List[Optional[int]]:
+    # eligible[i] is the bitset of vehicle positions request i may take (already
+    # limited to free vehicles) and preferences[i] its preferred positions;
+    # returns the position matched to each request, or None
+    count = len(eligible)
+    assigned: List[Optional[int]] = [None] * count
+    owner: Dict[int, int] = {}  # Vehicle -> request holding it
+    taken = 0
+
+    for i in sorted(range(count), key=lambda i: popcount(eligible[i])):
+        mask = eligible[i]
+        if not mask:
+            continue
+        vehicle_id = next(
+            (v for v in preferences[i] if (mask >> v) & 1 and not (taken >> v) & 1),
+            None
+        )
+        if vehicle_id is None:
+            available = mask & ~taken
+            if not available:
+                continue
+            vehicle_id = lowest_bit(available)
+        assigned[i] = vehicle_id
+        owner[vehicle_id] = i
+        taken |= 1 << vehicle_id
+
+    dead = 0  # Vehicles that cannot reach a free vehicle under the current matching
+    for root in range(count):
+        if assigned[root] is not None or not eligible[root] & ~dead:
+            continue
+        visited = dead
+        parent: Dict[int, int] = {}  # Vehicle -> request it was reached from
+        layer = [root]
+        found = None
+        while layer and found is None:
+            next_layer = []
+            for request in layer:
+                reached = eligible[request] & ~visited
+                if not reached:
+                    continue
+                visited |= reached
+                free = reached & ~taken
+                if free:
+                    found = (request, lowest_bit(free))
+                    break
+                while reached:
+                    low = reached & -reached
+                    reached ^= low
+                    vehicle_id = low.bit_length() - 1
+                    parent[vehicle_id] = request
+                    next_layer.append(owner[vehicle_id])
+            layer = next_layer
+
+        if found is None:
+            dead = visited
+            continue
+
+        # Shift the path: each request on it takes the vehicle it reached
+        request, vehicle_id = found
+        taken |= 1 << vehicle_id
+        while True:
+            previous = assigned[request]
+            assigned[request] = vehicle_id
+            owner[vehicle_id] = request
+            if previous is None:
+                break
+            vehicle_id, request = previous, parent[previous]
+        dead = 0
+
+    return assigned
+
+
+class AssignmentService:
+    def __init__(self, allocations: AllocationService, occupancy: OccupancyIndex):
+        self.allocations = allocations
+        self.store = allocations.store
+        self.occupancy = occupancy
+
+    async def assign(self, requests: List[AssignmentRequest], dry_run: bool = False) -> List[dict]:
+        # One result per request, in input order. Matched requests are written
+        # together through create_allocations_bulk (one conflict query and one
+        # insert_many for the whole assignment) unless dry_run is set.
+        results: List[dict] = [None] * len(requests)
+        today = date.today()
+
+        def fail(index: int, message: str):
+            results[index] = {"index": index, "status": "error", "message": message, "vehicle_id": None, "data": None}
+
+        by_date: Dict[datetime, List[int]] = {}
+        for index, request in enumerate(requests):
+            if request.allocation_date <= today:
+                fail(index, "Allocation date must be in the future")
+                continue
+            by_date.setdefault(to_datetime(request.allocation_date), []).append(index)
+
+        # Employees already holding a vehicle on a requested date, in one query
+        busy = {
+            (existing["employee_id"], existing["allocation_date"])
+            for existing in await self.store.find_conflicts([
+                (None, requests[index].employee_id, allocation_date)
+                for allocation_date, indexes in by_date.items() for index in indexes
+            ])
+        } if by_date else set()
+
+        matched: List[Tuple[int, int]] = []  # (request index, vehicle id)
+        masks: Dict[Tuple[int, ...], int] = {}  # Eligibility lists shared by many requests are converted once
+        for allocation_date, indexes in by_date.items():
+            free = await self.occupancy.free_mask(self.store, [allocation_date])
+            candidates = []
+            seen_employees = set()
+            for index in indexes:
+                request = requests[index]
+                if (request.employee_id, allocation_date) in busy:
+                    fail(index, "This employee already has allocated a vehicle for themselves at this date")
+                    continue
+                if request.employee_id in seen_employees:
+                    fail(index, "Duplicate request for this employee and date")
+                    continue
+                seen_employees.add(request.employee_id)
+                candidates.append(index)
+
+            eligible = []
+            for index in candidates:
+                ids = requests[index].eligible_vehicle_ids
+                if ids is None:
+                    eligible.append(free)
+                    continue
+                key = tuple(ids)
+                if key not in masks:
+                    masks[key] = self.occupancy.to_mask(ids)
+                eligible.append(masks[key] & free)
+
+            positions = match_requests(
+                eligible,
+                [self.occupancy.to_positions(requests[index].preferred_vehicle_ids) for index in candidates]
+            )
+            for index, position in zip(candidates, positions):
+                if position is None:
+                    fail(index, "No eligible vehicle is free on this date")
+                else:
+                    matched.append((index, self.occupancy.vehicle_id(position)))
+
+        if dry_run:
+            for index, vehicle_id in matched:
+                results[index] = {
+                    "index": index, "status": "success", "message": "Vehicle assigned (dry run)",
+                    "vehicle_id": vehicle_id, "data": None
+                }
+            return results
+
+        created = await self.allocations.create_allocations_bulk([
+            AllocationCreate(
+                employee_id=requests[index].employee_id,
+                vehicle_id=vehicle_id,
+                allocation_date=requests[index].allocation_date,
+                purpose=requests[index].purpose
+            )
+            for index, vehicle_id in matched
+        ]) if matched else []
+        for (index, vehicle_id), result in zip(matched, created):
+            # A result can still fail if a concurrent writer took the vehicle or employee
+            results[index] = dict(result, index=index, vehicle_id=vehicle_id)
+        return results
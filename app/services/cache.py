@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from app.config import settings
+from app.database import change_stream_options
+
+logger = logging.getLogger(__name__)
+
+# In-process read-through cache for allocation lookups, history pages and
+# history totals. Writes invalidate exactly the entries they can affect: the
+# written id, and every cached history page and total whose filter matches the
+# document before or after the write. Other workers are told through an InvalidationBus.
+
+# Bulk writes touching more documents than this clear the history cache
+MAX_MATCHED_DOCUMENTS = 64
+
+
+class LRUCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]  # Expired
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable):
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]):
+        for key in [key for key in self._entries if predicate(key)]:
+            self.pop(key)
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+def history_key(
+        employee_id: Optional[int],
+        vehicle_id: Optional[int],
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        skip: int,
+        limit: int,
+        sort_by: str,
+        sort_order: int,
+        cursor: Optional[str]
+    ) -> tuple:
+    # The filter comes first so invalidation can match it without parsing
+    return (history_filter_key(employee_id, vehicle_id, start_date, end_date), skip, limit, sort_by, sort_order, cursor)
+
+
+def history_filter_key(
+        employee_id: Optional[int],
+        vehicle_id: Optional[int],
+        start_date: Optional[datetime],
+        end_date: Optional[datetime]
+    ) -> tuple:
+    # Normalized history filter; keys cached totals and matches filter_matches
+    return (employee_id, vehicle_id, start_date, end_date)
+
+
+def filter_matches(history_filter: tuple, document: dict) -> bool:
+    employee_id, vehicle_id, start_date, end_date = history_filter
+    allocation_date = document.get("allocation_date")
+    if employee_id is not None and document.get("employee_id") != employee_id:
+        return False
+    if vehicle_id is not None and document.get("vehicle_id") != vehicle_id:
+        return False
+    if allocation_date is not None:
+        if start_date is not None and allocation_date < start_date:
+            return False
+        if end_date is not None and allocation_date > end_date:
+            return False
+    return True
+
+
+class LocalInvalidationBus:
+    # Stand-in for a cross-worker pub/sub channel (Redis, NATS, ...): delivers
+    # each published event to every subscriber in this process
+    def __init__(self):
+        self._subscribers: List[Callable[[dict], None]] = []
+
+    def subscribe(self, callback: Callable[[dict], None]):
+        self._subscribers.append(callback)
+
+    def publish(self, event: dict):
+        for callback in list(self._subscribers):
+            callback(event)
+
+
+class AllocationCache:
+    def __init__(self, max_entries: int, max_history_pages: int, ttl_seconds: float):
+        self.lookups = LRUCache(max_entries, ttl_seconds)
+        self.history = LRUCache(max_history_pages, ttl_seconds)
+        self.totals = LRUCache(max_history_pages, ttl_seconds)  # Keyed by the history filter alone
+        self.origin = uuid.uuid4().hex  # Lets the cache ignore its own published events
+        self._bus = None
+
+    def attach(self, bus):
+        self._bus = bus
+        bus.subscribe(self.handle_event)
+
+    def get_allocation(self, allocation_id: str):
+        return self.lookups.get(allocation_id)
+
+    def set_allocation(self, allocation_id: str, allocation: Any):
+        self.lookups.set(allocation_id, allocation)
+
+    def get_history(self, key: tuple):
+        return self.history.get(key)
+
+    def set_history(self, key: tuple, page: list):
+        self.history.set(key, page)
+
+    def get_total(self, history_filter: tuple) -> Optional[int]:
+        return self.totals.get(history_filter)
+
+    def set_total(self, history_filter: tuple, total: int):
+        self.totals.set(history_filter, total)
+
+    def invalidate(self, allocation_id: Optional[str], documents: Iterable[Optional[dict]]):
+        documents = [document for document in documents if document]
+        if allocation_id:
+            self.lookups.pop(allocation_id)
+        if not documents or len(documents) > MAX_MATCHED_DOCUMENTS:
+            # Nothing known about the document (e.g. a delete without a pre-image),
+            # or a bulk write large enough that matching each page costs more
+            self.history.clear()
+            self.totals.clear()
+            return
+        self.history.pop_where(lambda key: any(filter_matches(key[0], d) for d in documents))
+        self.totals.pop_where(lambda key: any(filter_matches(key, d) for d in documents))
+
+    def record_write(self, allocation_id: Optional[str], *documents: Optional[dict]):
+        # Called by AllocationService after every successful write
+        documents = [
+            {
+                "employee_id": d.get("employee_id"),
+                "vehicle_id": d.get("vehicle_id"),
+                "allocation_date": d.get("allocation_date")
+            }
+            for d in documents if d
+        ]
+        self.invalidate(allocation_id, documents)
+        if self._bus is not None:
+            self._bus.publish({
+                "origin": self.origin,
+                "allocation_id": allocation_id,
+                "documents": [
+                    dict(d, allocation_date=d["allocation_date"].isoformat() if d["allocation_date"] else None)
+                    for d in documents
+                ]
+            })
+
+    def handle_event(self, event: dict):
+        # Invalidation published by another worker (or a change stream)
+        if event.get("origin") == self.origin:
+            return
+        documents = [
+            dict(d, allocation_date=datetime.fromisoformat(d["allocation_date"]) if d.get("allocation_date") else None)
+            for d in event.get("documents", [])
+        ]
+        self.invalidate(event.get("allocation_id"), documents)
+
+    def clear(self):
+        self.lookups.clear()
+        self.history.clear()
+        self.totals.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"lookups": self.lookups.stats(), "history": self.history.stats(), "totals": self.totals.stats()}
+
+
+async def watch_allocation_changes(db: AsyncIOMotorDatabase, bus):
+    # Drive invalidation from a MongoDB change stream (requires a replica set).
+    # Pre-images are used when the server (6.0+) and the collection have them
+    # enabled; without one a delete only carries its _id and clears every
+    # cached history page.
+    options = None
+    while True:
+        try:
+            if options is None:
+                # Checked once, not on every retry
+                options = await change_stream_options(db, "cache invalidation")
+            async with db.allocations.watch(full_document="updateLookup", **options) as stream:
+                async for change in stream:
+                    documents = [change.get("fullDocumentBeforeChange"), change.get("fullDocument")]
+                    bus.publish({
+                        "origin": "change-stream",
+                        "allocation_id": str(change.get("documentKey", {}).get("_id")),
+                        "documents": [
+                            {
+                                "employee_id": d.get("employee_id"),
+                                "vehicle_id": d.get("vehicle_id"),
+                                "allocation_date": d["allocation_date"].isoformat() if d.get("allocation_date") else None
+                            }
+                            for d in documents if d
+                        ]
+                    })
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Allocation change stream failed, retrying: %s", e)
+            await asyncio.sleep(1)
+
+
+# Shared by every request in this process
+invalidation_bus = LocalInvalidationBus()
+allocation_cache = AllocationCache(
+    settings.cache_max_entries,
+    settings.cache_max_history_pages,
+    settings.cache_ttl_seconds
+)
+allocation_cache.attach(invalidation_bus)
@@ -0,0 +1,85 @@
+import asyncio
+import contextvars
+from typing import List, Optional, Set, Tuple
+from app.config import settings
+from app.metrics import CREATE_BATCH_SIZE
+from app.models.schemas import AllocationCreate
+from app.services.allocation import INSERT_ERROR_MESSAGE
+
+# Write coalescing for single creates. Concurrent create_allocation calls are
+# queued for up to flush_seconds (or until max_batch are waiting) and written
+# together through create_allocations_bulk: one conflict query and one
+# unordered insert_many for the whole batch instead of a round trip and a pool
+# checkout per request. Every caller still gets its own result or its own
+# ValueError, exactly as from create_allocation; within a batch the earliest
+# caller wins a conflict, as it would have done sequentially. An insert that
+# failed for any other reason raises RuntimeError (a 500), not ValueError.
+#
+# A batch is written in an empty context, not in the first caller's, so its
+# MongoDB commands are not charged to that request's slow-request capture.
+
+
+class CreateCoalescer:
+    def __init__(self, flush_seconds: float = 0.002, max_batch: int = 256):
+        self.flush_seconds = flush_seconds
+        self.max_batch = max_batch
+        self._pending: List[Tuple[AllocationCreate, asyncio.Future]] = []
+        self._service = None  # AllocationService of the first caller of the pending batch
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes: Set[asyncio.Task] = set()  # The loop only holds tasks weakly
+
+    async def submit(self, service, allocation: AllocationCreate) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self._pending:
+            self._service = service
+            self._timer = loop.call_later(self.flush_seconds, self._flush, context=contextvars.Context())
+        self._pending.append((allocation, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        # A cancelled caller's item is still written with the rest of its batch
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Created inside an empty context, which the task copies, also when
+            # a full batch is flushed from a caller's submit
+            task = contextvars.Context().run(asyncio.ensure_future, self._write(self._service, batch))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    @staticmethod
+    async def _write(service, batch: List[Tuple[AllocationCreate, asyncio.Future]]):
+        CREATE_BATCH_SIZE.observe(len(batch))
+        if len(batch) == 1:
+            # Nothing to coalesce: the single insert path is one round trip
+            allocation, future = batch[0]
+            try:
+                future.set_result(await service.create_allocation(allocation))
+            except Exception as e:
+                future.set_exception(e)
+            return
+
+        try:
+            results = await service.create_allocations_bulk([allocation for allocation, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if result["status"] == "success":
+                future.set_result(result["data"])
+            elif result["message"] == INSERT_ERROR_MESSAGE:
+                future.set_exception(RuntimeError(result["message"]))
+            else:
+                # Conflicts and validation errors, as create_allocation raises them
+                future.set_exception(ValueError(result["message"]))
+
+
+# Shared by every request in this process
+create_coalescer = CreateCoalescer(settings.coalesce_window_ms / 1000, settings.coalesce_max_batch)
@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, List
+from bson import ObjectId
+from app.storage import ALLOCATION_FIELDS
+
+# Streaming encoders for the history export. Rows are buffered one batch at a
+# time, so each chunk written to the socket holds at most batch_size rows.
+
+EXPORT_FIELDS = ALLOCATION_FIELDS
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+
+def parse_fields(fields: str) -> List[str]:
+    # Comma-separated projection limited to the schema fields, in request order
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown export fields: {', '.join(unknown)}")
+    if not selected:
+        raise ValueError("At least one export field is required")
+    return list(dict.fromkeys(selected))
+
+
+def encode_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        # Allocation dates are midnight datetimes; export the date part like the API
+        return value.date().isoformat()
+    return value
+
+
+async def export_ndjson(rows: AsyncIterator[dict], fields: List[str], batch_size: int) -> AsyncIterator[bytes]:
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps({field: encode_value(row.get(field)) for field in fields}))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def export_csv(rows: AsyncIterator[dict], fields: List[str], batch_size: int) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    count = 0
+    async for row in rows:
+        writer.writerow([encode_value(row.get(field)) for field in fields])
+        count += 1
+        if count >= batch_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def export_stream(rows: AsyncIterator[dict], fmt: str, fields: List[str], batch_size: int) -> AsyncIterator[bytes]:
+    if fmt == "csv":
+        return export_csv(rows, fields, batch_size)
+    return export_ndjson(rows, fields, batch_size)
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Set
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from app.config import settings
+from app.database import change_stream_options, get_database
+from app.responses import encode_allocation
+from app.services.cache import filter_matches
+
+logger = logging.getLogger(__name__)
+
+# Allocation change feed. Writes reach an in-process ChangeBroker from a
+# pluggable source: LocalChangeSource publishes what this process's
+# AllocationService writes; ChangeStreamSource follows a MongoDB change stream
+# and so sees the writes of every worker. The broker numbers each event,
+# serializes it once, keeps the last history_size events for resuming, and
+# fans it out to the subscribers whose filter matches the document before or
+# after the write. Subscribers are indexed by vehicle and employee id, so an
+# event only visits the subscriptions that can match it.
+#
+# Every subscriber has a bounded queue. One that falls behind is closed rather
+# than allowed to hold memory; it reconnects with the token of the last event
+# it received and is replayed from the history, or told to reload when the
+# history no longer reaches back that far.
+
+
+@dataclass
+class ChangeEvent:
+    seq: int
+    token: str  # Resume token: "<broker epoch>.<seq>"
+    op: str  # "create", "update" or "delete"
+    documents: List[dict]  # Documents before and after the write, for filter matching
+    payload: str  # JSON sent to clients
+
+
+def event_matches(history_filter: tuple, event: ChangeEvent) -> bool:
+    if not event.documents:
+        return True
+    return any(filter_matches(history_filter, document) for document in event.documents)
+
+
+@dataclass(eq=False)
+class Subscription:
+    history_filter: tuple  # Normalized like app.services.cache.history_filter_key
+    max_pending: int
+    pending: Deque[ChangeEvent] = field(default_factory=deque)
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    reset: bool = False  # Events were missed: the client must reload
+    closed: bool = False  # Fell behind; the client should reconnect and resume
+
+    def push(self, event: ChangeEvent) -> bool:
+        # Returns False once the queue is full
+        if len(self.pending) >= self.max_pending:
+            self.closed = True
+            self.ready.set()
+            return False
+        self.pending.append(event)
+        self.ready.set()
+        return True
+
+    async def next(self, timeout: float) -> Optional[ChangeEvent]:
+        # The next event, or None on timeout or when the subscription is closed
+        if not self.pending and not self.closed:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.pending.popleft() if self.pending else None
+
+
+class ChangeBroker:
+    def __init__(self, history_size: int = 10000, queue_size: int = 1000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._seq = 0
+        self._history: Deque[ChangeEvent] = deque(maxlen=history_size)
+        self._by_vehicle: Dict[int, Set[Subscription]] = {}
+        self._by_employee: Dict[int, Set[Subscription]] = {}
+        self._unkeyed: Set[Subscription] = set()
+        self.dropped = 0  # Subscriptions closed for falling behind
+
+    def __len__(self) -> int:
+        return len(self._unkeyed) + sum(map(len, self._by_vehicle.values())) + sum(map(len, self._by_employee.values()))
+
+    def _bucket(self, subscription: Subscription) -> Set[Subscription]:
+        employee_id, vehicle_id = subscription.history_filter[:2]
+        if vehicle_id is not None:
+            return self._by_vehicle.setdefault(vehicle_id, set())
+        if employee_id is not None:
+            return self._by_employee.setdefault(employee_id, set())
+        return self._unkeyed
+
+    def publish(self, op: str, allocation_id: str, before: Optional[dict], after: Optional[dict]):
+        self._seq += 1
+        token = f"{self.epoch}.{self._seq}"
+        # A document known only by its _id (a delete without a pre-image) may match any filter
+        documents = [document for document in (before, after) if document and "allocation_date" in document]
+        event = ChangeEvent(self._seq, token, op, documents, json.dumps({
+            "id": token,
+            "op": op,
+            "allocation_id": allocation_id,
+            "allocation": encode_allocation(after) if after else None,
+            "previous": encode_allocation(before) if before and "allocation_date" in before else None,
+            "at": time.time()
+        }))
+        self._history.append(event)
+
+        if documents:
+            candidates = set(self._unkeyed)
+            for document in documents:
+                candidates.update(self._by_vehicle.get(document.get("vehicle_id"), ()))
+                candidates.update(self._by_employee.get(document.get("employee_id"), ()))
+        else:
+            candidates = set(self._unkeyed).union(*self._by_vehicle.values(), *self._by_employee.values())
+        for subscription in candidates:
+            if event_matches(subscription.history_filter, event):
+                if not subscription.push(event):
+                    self.unsubscribe(subscription)
+                    self.dropped += 1
+
+    def subscribe(self, history_filter: tuple, resume_token: Optional[str] = None) -> Subscription:
+        # Replays the retained events after resume_token, then follows live events
+        subscription = Subscription(history_filter, self.queue_size)
+        if resume_token:
+            epoch, _, seq = resume_token.partition(".")
+            oldest = self._history[0].seq if self._history else self._seq + 1
+            if epoch != self.epoch or not seq.isdigit() or int(seq) < oldest - 1:
+                subscription.reset = True
+            else:
+                subscription.pending.extend(
+                    event for event in self._history
+                    if event.seq > int(seq) and event_matches(history_filter, event)
+                )
+        self._bucket(subscription).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._bucket(subscription).discard(subscription)
+
+
+def operation(before: Optional[dict], after: Optional[dict]) -> str:
+    if before is None:
+        return "create"
+    return "delete" if after is None else "update"
+
+
+class LocalChangeSource:
+    # Publishes the writes made through this process's AllocationService
+    def __init__(self, broker: ChangeBroker):
+        self.broker = broker
+
+    def record(self, before: Optional[dict], after: Optional[dict]):
+        document = after or before
+        self.broker.publish(operation(before, after), str(document["_id"]), before, after)
+
+    async def run(self):
+        pass
+
+
+class ChangeStreamSource:
+    # Publishes every write to the allocations collection, whichever worker made
+    # it (replica sets only); the service's own records are ignored
+    def __init__(self, broker: ChangeBroker, db: AsyncIOMotorDatabase):
+        self.broker = broker
+        self.db = db
+        self._resume_after = None
+        self._options = None  # watch() options, checked once against the server
+
+    def record(self, before: Optional[dict], after: Optional[dict]):
+        pass
+
+    async def run(self):
+        operations = {"insert": "create", "update": "update", "replace": "update", "delete": "delete"}
+        while True:
+            try:
+                if self._options is None:
+                    self._options = await change_stream_options(self.db, "change feed")
+                async with self.db.allocations.watch(
+                    full_document="updateLookup",
+                    resume_after=self._resume_after,
+                    **self._options
+                ) as stream:
+                    async for change in stream:
+                        self._resume_after = stream.resume_token
+                        op = operations.get(change.get("operationType"))
+                        if op is None:
+                            continue
+                        before = change.get("fullDocumentBeforeChange")
+                        after = change.get("fullDocument") if op != "delete" else None
+                        if op == "delete" and before is None:
+                            # Without a pre-image only the id is known
+                            before = {"_id": change["documentKey"]["_id"]}
+                        self.broker.publish(op, str(change["documentKey"]["_id"]), before, after)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Allocation change feed stream failed, retrying: %s", e)
+                await asyncio.sleep(1)
+
+
+# Shared by every subscriber in this process
+change_broker = ChangeBroker(settings.feed_history_size, settings.feed_queue_size)
+_source = None
+
+
+async def get_change_source():
+    # One source per process, chosen by FEED_SOURCE ("local" or "change_stream");
+    # the in-memory backend has no change stream, so it is always local
+    global _source
+    if _source is None:
+        if settings.feed_source == "change_stream" and settings.storage_backend != "memory":
+            _source = ChangeStreamSource(change_broker, await get_database())
+        else:
+            _source = LocalChangeSource(change_broker)
+    return _source
+
+
+def close_change_source():
+    # Application shutdown; the change stream source holds the closed client
+    global _source
+    _source = None
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.config import settings
+from app.storage import AllocationStore
+
+# Per-date occupancy bitsets. Every vehicle id gets a dense bit position the
+# first time it is seen (from the fleet or an allocation), and a date's mask
+# has the bit of each vehicle allocated on that date set, so "which vehicles
+# are free from X to Y" is the fleet mask minus the OR of the date masks, with
+# no scan of the allocations collection once the dates are loaded. Positions
+# are never reassigned, so cached masks stay valid as the fleet grows, and a
+# mask is as wide as the number of distinct ids, however large the ids are.
+
+
+def mask_to_ids(mask: int) -> List[int]:
+    # Set bit positions; walks the binary string once, far cheaper than testing each bit
+    bits = bin(mask)[:1:-1]
+    return [i for i, bit in enumerate(bits) if bit == "1"]
+
+
+class OccupancyIndex:
+    def __init__(self, ttl_seconds: float = 60, max_dates: int = 3660):
+        self.ttl_seconds = ttl_seconds  # Bounds staleness from writes made by other workers
+        self.max_dates = max_dates
+        self._dates: "OrderedDict[datetime, Tuple[int, float]]" = OrderedDict()
+        # One load in flight per date; later callers await it
+        self._loading: Dict[datetime, asyncio.Future] = {}
+        self._pending: Dict[datetime, list] = {}  # Writes seen while a date is being loaded
+        self._positions: Dict[int, int] = {}  # Vehicle id -> bit position
+        self._vehicle_ids: List[int] = []  # Bit position -> vehicle id
+        self._fleet_mask = 0
+        self._fleet_loaded_at: Optional[float] = None
+
+    def _fresh(self, loaded_at: Optional[float]) -> bool:
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds
+
+    def _bit(self, vehicle_id: int) -> int:
+        # Assigns the next position to an id seen for the first time
+        position = self._positions.get(vehicle_id)
+        if position is None:
+            position = self._positions[vehicle_id] = len(self._vehicle_ids)
+            self._vehicle_ids.append(vehicle_id)
+        return 1 << position
+
+    def to_mask(self, vehicle_ids: Iterable[int]) -> int:
+        # Bitset of the given ids; ids never seen are not in the fleet and are dropped
+        mask = 0
+        for vehicle_id in vehicle_ids:
+            position = self._positions.get(vehicle_id)
+            if position is not None:
+                mask |= 1 << position
+        return mask
+
+    def to_positions(self, vehicle_ids: Iterable[int]) -> List[int]:
+        # Bit positions of the given ids, in order, dropping ids never seen
+        return [self._positions[vehicle_id] for vehicle_id in vehicle_ids if vehicle_id in self._positions]
+
+    def vehicle_id(self, position: int) -> int:
+        return self._vehicle_ids[position]
+
+    def to_ids(self, mask: int) -> List[int]:
+        # Vehicle ids of a bitset, ascending
+        return sorted(self._vehicle_ids[position] for position in mask_to_ids(mask))
+
+    def _apply(self, allocation_date: datetime, vehicle_id: int, occupied: bool):
+        if allocation_date in self._pending:
+            self._pending[allocation_date].append((vehicle_id, occupied))
+        entry = self._dates.get(allocation_date)
+        if entry is None:
+            return  # Not cached; the next load reads the write from the database
+        mask, loaded_at = entry
+        bit = self._bit(vehicle_id)
+        self._dates[allocation_date] = (mask | bit if occupied else mask & ~bit, loaded_at)
+
+    def occupy(self, vehicle_id: int, allocation_date: datetime):
+        self._apply(allocation_date, vehicle_id, True)
+
+    def release(self, vehicle_id: int, allocation_date: datetime):
+        self._apply(allocation_date, vehicle_id, False)
+
+    def invalidate(self):
+        self._dates.clear()
+        self._fleet_loaded_at = None
+
+    async def _load_fleet(self, store: AllocationStore):
+        mask = 0
+        async for vehicle_id in store.vehicle_ids():
+            if isinstance(vehicle_id, int):
+                mask |= self._bit(vehicle_id)
+        self._fleet_mask = mask
+        self._fleet_loaded_at = time.monotonic()
+
+    async def _load_dates(self, store: AllocationStore, dates: List[datetime]) -> Dict[datetime, int]:
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for allocation_date in dates:
+            futures[allocation_date] = self._loading[allocation_date] = loop.create_future()
+            self._pending[allocation_date] = []
+        masks = {allocation_date: 0 for allocation_date in dates}
+        try:
+            async for allocation_date, vehicle_id in store.vehicles_on_dates(dates):
+                masks[allocation_date] |= self._bit(vehicle_id)
+
+            loaded_at = time.monotonic()
+            for allocation_date in dates:
+                # Replay writes that raced with the load
+                mask = masks[allocation_date]
+                for vehicle_id, occupied in self._pending[allocation_date]:
+                    bit = self._bit(vehicle_id)
+                    mask = mask | bit if occupied else mask & ~bit
+                masks[allocation_date] = mask
+                self._dates[allocation_date] = (mask, loaded_at)
+                self._dates.move_to_end(allocation_date)
+                futures[allocation_date].set_result(mask)
+        except BaseException as e:
+            # Waiters fail with the loader; a cancelled loader is not their cancellation
+            error = e if isinstance(e, Exception) else RuntimeError("Occupancy load was cancelled")
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(error)
+                    future.exception()  # Retrieved even if nobody was waiting
+            raise
+        finally:
+            for allocation_date in dates:
+                self._loading.pop(allocation_date, None)
+                self._pending.pop(allocation_date, None)
+
+        while len(self._dates) > self.max_dates:
+            self._dates.popitem(last=False)
+        return masks
+
+    async def occupied_mask(self, store: AllocationStore, dates: Iterable[datetime]) -> int:
+        mask = 0
+        missing = []
+        waiting = []
+        for allocation_date in dates:
+            entry = self._dates.get(allocation_date)
+            if entry is not None and self._fresh(entry[1]):
+                mask |= entry[0]
+            elif allocation_date in self._loading:
+                waiting.append(self._loading[allocation_date])
+            else:
+                missing.append(allocation_date)
+
+        if missing:
+            for loaded in (await self._load_dates(store, missing)).values():
+                mask |= loaded
+        for future in waiting:
+            # Shielded: a cancelled waiter must not cancel the load other requests share
+            mask |= await asyncio.shield(future)
+        return mask
+
+    async def free_mask(self, store: AllocationStore, dates: Iterable[datetime]) -> int:
+        # Fleet vehicles free on every one of the dates, as a bitset over positions
+        if not self._fresh(self._fleet_loaded_at):
+            await self._load_fleet(store)
+        occupied = await self.occupied_mask(store, dates)
+        return self._fleet_mask & ~occupied
+
+    async def available_vehicle_ids(self, store: AllocationStore, dates: Iterable[datetime]) -> List[int]:
+        return self.to_ids(await self.free_mask(store, dates))
+
+
+# Shared by every request in this process
+occupancy_index = OccupancyIndex(settings.occupancy_ttl_seconds, settings.occupancy_max_dates)
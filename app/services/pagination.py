@@ -0,0 +1,51 @@
+import base64
+import binascii
+import json
+from typing import Any, Optional, Tuple
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
+
+# Keyset pagination: a cursor records the (sort key, _id) of the last row of a
+# page, so the next page starts with an index range seek instead of a skip.
+
+
+def encode_cursor(sort_by: str, sort_order: int, value: Any, last_id: str) -> str:
+    payload = json_util.dumps({"s": sort_by, "o": sort_order, "v": value, "id": str(last_id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, sort_by: str, sort_order: int) -> Tuple[Any, ObjectId]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        last_id = ObjectId(payload["id"])
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+    # A cursor is only valid for the ordering it was issued for
+    if payload.get("s") != sort_by or payload.get("o") != sort_order:
+        raise ValueError("Cursor does not match the requested sort order")
+
+    return payload.get("v"), last_id
+
+
+def seek_filter(sort_by: str, sort_order: int, value: Any, last_id: ObjectId) -> dict:
+    after = "$gt" if sort_order == 1 else "$lt"
+    if sort_by == "_id":
+        return {"_id": {after: last_id}}
+
+    # The inclusive bound on the sort key drives the index range seek; the $or
+    # only has to break ties between rows sharing the last sort key
+    inclusive = "$gte" if sort_order == 1 else "$lte"
+    return {
+        sort_by: {inclusive: value},
+        "$or": [{sort_by: {after: value}}, {"_id": {after: last_id}}]
+    }
+
+
+def next_cursor(page: list, limit: int, sort_by: str, sort_order: int) -> Optional[str]:
+    # A short page means there is nothing left to fetch
+    if not page or len(page) < limit:
+        return None
+    last = page[-1]
+    return encode_cursor(sort_by, sort_order, last.get(sort_by), last["_id"])
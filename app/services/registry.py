@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Dict, Optional
+from app.config import settings
+from app.storage import AllocationStore
+
+logger = logging.getLogger(__name__)
+
+# In-process registry of the employee and vehicle ids that exist, so writes can
+# reject unknown ids without a round trip. Loaded at startup, then refreshed in
+# the background: new ids (greater than the largest one known) are picked up
+# every refresh_seconds, and a full reload every reload_seconds drops deleted
+# ones. A lookup that misses may trigger one early refresh, at most once per
+# miss_refresh_seconds, so an id created moments ago is not rejected.
+
+# Ids below this live in a bitmap (at most 8 MiB); anything else in a set
+MAX_BITMAP_ID = 1 << 26
+
+
+class IdSet:
+    def __init__(self):
+        self._bits = bytearray()
+        self._sparse = set()
+        self.max_id: Optional[int] = None
+        self.size = 0
+
+    def add(self, entity_id):
+        if not isinstance(entity_id, int):
+            return  # Allocations reference integer ids only
+        if entity_id in self:
+            return
+        if 0 <= entity_id < MAX_BITMAP_ID:
+            byte = entity_id >> 3
+            if byte >= len(self._bits):
+                self._bits.extend(bytes(max(byte + 1 - len(self._bits), len(self._bits))))
+            self._bits[byte] |= 1 << (entity_id & 7)
+        else:
+            self._sparse.add(entity_id)
+        self.size += 1
+        if self.max_id is None or entity_id > self.max_id:
+            self.max_id = entity_id
+
+    def __contains__(self, entity_id: int) -> bool:
+        if 0 <= entity_id < MAX_BITMAP_ID:
+            byte = entity_id >> 3
+            return byte < len(self._bits) and bool(self._bits[byte] & (1 << (entity_id & 7)))
+        return entity_id in self._sparse
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class EntityRegistry:
+    def __init__(self, refresh_seconds: float = 10, reload_seconds: float = 300, miss_refresh_seconds: float = 1):
+        self.refresh_seconds = refresh_seconds
+        self.reload_seconds = reload_seconds
+        self.miss_refresh_seconds = miss_refresh_seconds
+        self._ids: Dict[str, IdSet] = {}
+        self._reloaded_at: Optional[float] = None
+        self._refreshed_at: Optional[float] = None
+        self._refreshing: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._reloaded_at is not None
+
+    @staticmethod
+    def _sources(store: AllocationStore) -> Dict[str, Callable[..., AsyncIterator[int]]]:
+        return {"employee_id": store.employee_ids, "vehicle_id": store.vehicle_ids}
+
+    async def load(self, store: AllocationStore):
+        ids = {}
+        for field, source in self._sources(store).items():
+            ids[field] = IdSet()
+            async for entity_id in source():
+                ids[field].add(entity_id)
+        self._ids = ids
+        self._reloaded_at = self._refreshed_at = time.monotonic()
+
+    async def refresh(self, store: AllocationStore):
+        # Incremental: only ids above the largest one already known
+        for field, source in self._sources(store).items():
+            known = self._ids.setdefault(field, IdSet())
+            async for entity_id in source(after=known.max_id):
+                known.add(entity_id)
+        self._refreshed_at = time.monotonic()
+
+    async def run(self, store: AllocationStore):
+        # Background refresh loop started with the app
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                if self._reloaded_at is None or time.monotonic() - self._reloaded_at >= self.reload_seconds:
+                    await self.load(store)
+                else:
+                    await self.refresh(store)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Entity registry refresh failed: %s", e)
+
+    def unknown(self, field: str, entity_id: int) -> bool:
+        # O(1); False until the registry is loaded, so validation never blocks startup
+        return self.loaded and entity_id not in self._ids.get(field, ())
+
+    async def missing(self, store: AllocationStore, employee_id: Optional[int], vehicle_id: Optional[int]) -> Optional[str]:
+        # The field whose id does not exist, if any
+        for field, entity_id in (("employee_id", employee_id), ("vehicle_id", vehicle_id)):
+            if entity_id is None or not self.unknown(field, entity_id):
+                continue
+            await self.refresh_on_miss(store)
+            if self.unknown(field, entity_id):
+                return field
+        return None
+
+    async def refresh_on_miss(self, store: AllocationStore):
+        # Rate limited and shared by concurrent misses, so unknown ids cannot
+        # turn into a round trip per request
+        if self._refreshing is None:
+            if self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.miss_refresh_seconds:
+                return
+            self._refreshing = asyncio.ensure_future(self.refresh(store))
+        refreshing = self._refreshing
+        try:
+            await asyncio.shield(refreshing)
+        except Exception as e:
+            logger.warning("Entity registry refresh failed: %s", e)
+        finally:
+            if self._refreshing is refreshing and refreshing.done():
+                self._refreshing = None
+
+
+# Shared by every request in this process
+entity_registry = EntityRegistry(
+    settings.registry_refresh_seconds,
+    settings.registry_reload_seconds,
+    settings.registry_miss_refresh_seconds
+)
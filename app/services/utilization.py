@@ -0,0 +1,75 @@
+import calendar
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+from app.storage import ROLLUP_DIMENSIONS, AllocationStore, RollupKey
+
+# Utilization reports are answered from per-(vehicle, month) and
+# per-(employee, month) counters that AllocationService adjusts on every write,
+# so a report reads one rollup document per row instead of the allocation log.
+
+MAX_REPORT_MONTHS = 24
+
+
+def month_key(value: datetime) -> str:
+    return value.strftime("%Y-%m")
+
+
+def parse_month(value: str) -> date:
+    try:
+        return datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise ValueError(f"Invalid month '{value}', expected YYYY-MM")
+
+
+def rollup_deltas(removed: Iterable[Optional[dict]], added: Iterable[Optional[dict]]) -> Dict[RollupKey, int]:
+    # removed/added hold employee_id, vehicle_id and allocation_date (as datetime).
+    # Counters an update leaves unchanged cancel out and are dropped.
+    deltas: Dict[RollupKey, int] = {}
+    for documents, sign in ((removed, -1), (added, 1)):
+        for document in documents:
+            if not document:
+                continue
+            month = month_key(document["allocation_date"])
+            for dimension in ROLLUP_DIMENSIONS:
+                key = (dimension, document[f"{dimension}_id"], month)
+                deltas[key] = deltas.get(key, 0) + sign
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+class UtilizationService:
+    def __init__(self, store: AllocationStore):
+        self.store = store
+
+    async def get_utilization(
+            self,
+            group_by: str,
+            start_month: str,
+            end_month: str,
+            entity_id: Optional[int] = None,
+            skip: int = 0,
+            limit: int = 100
+        ) -> List[dict]:
+        if group_by not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"group_by must be one of {', '.join(ROLLUP_DIMENSIONS)}")
+        start, end = parse_month(start_month), parse_month(end_month)
+        if end < start:
+            raise ValueError("end_month must not be before start_month")
+        if (end.year - start.year) * 12 + end.month - start.month >= MAX_REPORT_MONTHS:
+            raise ValueError(f"Month range cannot exceed {MAX_REPORT_MONTHS} months")
+
+        rollups = await self.store.find_rollups(
+            group_by, month_key(start), month_key(end), entity_id, skip, limit
+        )
+
+        report = []
+        for rollup in rollups:
+            month = parse_month(rollup["month"])
+            days_in_month = calendar.monthrange(month.year, month.month)[1]
+            report.append({
+                "entity_id": rollup["entity_id"],
+                "month": rollup["month"],
+                "allocated_days": rollup["days"],
+                "days_in_month": days_in_month,
+                "utilization": round(rollup["days"] / days_in_month, 4)
+            })
+        return report
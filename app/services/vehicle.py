@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+from typing import List, Optional
+from app.services.allocation import to_datetime
+from app.services.occupancy import OccupancyIndex
+from app.storage import AllocationStore
+
+MAX_AVAILABILITY_DAYS = 366
+
+
+class VehicleService:
+    def __init__(self, store: AllocationStore, occupancy: OccupancyIndex):
+        self.store = store
+        self.occupancy = occupancy
+
+    async def get_available_vehicles(self, start_date: date, end_date: Optional[date] = None) -> List[int]:
+        # A single date when no end date is given
+        end_date = end_date or start_date
+        if end_date < start_date:
+            raise ValueError("end_date must not be before start_date")
+
+        days = (end_date - start_date).days + 1
+        if days > MAX_AVAILABILITY_DAYS:
+            raise ValueError(f"Date range cannot exceed {MAX_AVAILABILITY_DAYS} days")
+
+        # A vehicle is available only if it is free on every date in the range
+        dates = [to_datetime(start_date + timedelta(days=offset)) for offset in range(days)]
+        return await self.occupancy.available_vehicle_ids(self.store, dates)
@@ -0,0 +1,116 @@
+import hashlib
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Deque, Dict, Iterable, Optional, Tuple
+from app.config import settings
+from app.services.cache import allocation_cache, filter_matches, invalidation_bus
+
+# Version counters behind the ETag and Last-Modified validators of list,
+# history and fetch responses. Every write bumps a collection-wide counter and
+# is logged (ids and filter fields) in a bounded ring, so the version of a
+# history filter or a set of ids is the last logged write that touches it,
+# found without a query. Filters untouched by every logged write get the
+# version of the oldest write that has been dropped from the ring. Lookups are
+# memoized per collection version, so repeated polls between writes are O(1).
+#
+# Writes from other workers arrive through the invalidation bus (and the
+# change stream, when enabled). Tags also carry a token that rotates every
+# ttl_seconds, which bounds how long a validator can outlive a write this
+# process was not told about, as the cache TTL does for cached pages.
+
+# Writes kept in the ring
+MAX_LOGGED_WRITES = 4096
+
+
+@dataclass(frozen=True)
+class Version:
+    number: int
+    modified_at: float  # Unix time of the write, as seen by this process
+
+
+@dataclass(frozen=True)
+class LoggedWrite:
+    version: Version
+    allocation_ids: Tuple[str, ...]
+    documents: Tuple[dict, ...]  # employee_id, vehicle_id, allocation_date before and after
+
+
+class VersionTracker:
+    def __init__(self, ttl_seconds: float = 30, max_logged_writes: int = MAX_LOGGED_WRITES):
+        self.ttl_seconds = ttl_seconds
+        self._process = uuid.uuid4().hex[:8]
+        self.current = Version(0, time.time())
+        self._floor = self.current  # Version of the newest write dropped from the ring
+        self._log: Deque[LoggedWrite] = deque(maxlen=max_logged_writes)
+        self._memo: Dict[tuple, Version] = {}
+        self._memo_version = 0
+
+    def attach(self, bus):
+        bus.subscribe(self.handle_event)
+
+    def record(self, allocation_id: Optional[str], *documents: Optional[dict]):
+        # Called by AllocationService after every successful write, like AllocationCache.record_write
+        self.current = Version(self.current.number + 1, time.time())
+        if len(self._log) == self._log.maxlen:
+            self._floor = self._log[0].version
+        self._log.append(LoggedWrite(
+            self.current,
+            (allocation_id,) if allocation_id else (),
+            tuple(
+                {"employee_id": d.get("employee_id"), "vehicle_id": d.get("vehicle_id"), "allocation_date": d.get("allocation_date")}
+                for d in documents if d
+            )
+        ))
+
+    def handle_event(self, event: dict):
+        # Invalidation published by another worker (or a change stream); this
+        # process's own writes were already recorded by the service
+        if event.get("origin") == allocation_cache.origin:
+            return
+        documents = [
+            dict(d, allocation_date=datetime.fromisoformat(d["allocation_date"]) if d.get("allocation_date") else None)
+            for d in event.get("documents", [])
+        ]
+        self.record(event.get("allocation_id"), *documents)
+
+    def _find(self, key: tuple, touches) -> Version:
+        if self._memo_version != self.current.number:
+            self._memo.clear()
+            self._memo_version = self.current.number
+        version = self._memo.get(key)
+        if version is None:
+            if len(self._memo) >= MAX_LOGGED_WRITES:
+                self._memo.clear()
+            version = next((write.version for write in reversed(self._log) if touches(write)), self._floor)
+            self._memo[key] = version
+        return version
+
+    def filter_version(self, history_filter: tuple) -> Version:
+        # Last write that could change the rows of a normalized history filter
+        # (app.services.cache.history_filter_key). A write that carries no
+        # documents (a delete seen without its pre-image) touches every filter.
+        def touches(write: LoggedWrite) -> bool:
+            return not write.documents or any(filter_matches(history_filter, document) for document in write.documents)
+        return self._find(("filter", history_filter), touches)
+
+    def ids_version(self, allocation_ids: Iterable[str]) -> Version:
+        # Last update or delete of any of the ids; creates never change an existing id
+        ids = frozenset(allocation_ids)
+
+        def touches(write: LoggedWrite) -> bool:
+            return any(allocation_id in ids for allocation_id in write.allocation_ids)
+        return self._find(("ids", ids), touches)
+
+    def etag(self, version: Version, *parts) -> str:
+        # Weak tag over the version and the request that produced the representation
+        epoch = int(time.time() // self.ttl_seconds) if self.ttl_seconds > 0 else 0
+        digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+        return f'W/"{self._process}.{epoch}.{version.number}.{digest}"'
+
+
+# Shared by every request in this process
+version_tracker = VersionTracker(settings.etag_ttl_seconds)
+version_tracker.attach(invalidation_bus)
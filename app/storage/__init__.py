@@ -0,0 +1,63 @@
+from app.config import settings
+from app.database import close_db, get_database
+from app.storage.base import (
+    ALLOCATION_FIELDS,
+    ROLLUP_DIMENSIONS,
+    AllocationStore,
+    DuplicateAllocationError,
+    HistoryQuery,
+    RollupKey
+)
+from app.storage.archive import ArchivingAllocationStore
+from app.storage.memory import MemoryAllocationStore
+from app.storage.mongo import MongoAllocationStore
+from app.storage.planner import SORT_FIELDS, QueryPlan, plan_history
+
+_store = None
+
+
+async def get_store() -> AllocationStore:
+    # One store per process, chosen by STORAGE_BACKEND ("mongo" or "memory")
+    global _store
+    if _store is None:
+        if settings.storage_backend == "memory":
+            # Mirror the fleet and staff inserted by scripts/seed_data.py
+            _store = MemoryAllocationStore(
+                range(1, settings.memory_vehicle_count + 1),
+                range(1, settings.memory_employee_count + 1)
+            )
+        else:
+            _store = MongoAllocationStore(await get_database())
+        if settings.archive_enabled:
+            # Same engine for the archive; it never needs the entity ids
+            if settings.storage_backend == "memory":
+                archive = MemoryAllocationStore()
+            else:
+                archive = MongoAllocationStore(await get_database(), "allocations_archive")
+            _store = ArchivingAllocationStore(_store, archive, settings.archive_after_days)
+    return _store
+
+
+def close_store():
+    # Application shutdown: drop the store and close the MongoDB pool
+    global _store
+    _store = None
+    close_db()
+
+
+__all__ = [
+    "ALLOCATION_FIELDS",
+    "AllocationStore",
+    "ArchivingAllocationStore",
+    "DuplicateAllocationError",
+    "HistoryQuery",
+    "MemoryAllocationStore",
+    "MongoAllocationStore",
+    "QueryPlan",
+    "ROLLUP_DIMENSIONS",
+    "RollupKey",
+    "SORT_FIELDS",
+    "close_store",
+    "get_store",
+    "plan_history"
+]
@@ -0,0 +1,225 @@
+import asyncio
+from dataclasses import replace
+from datetime import date, datetime, timedelta
+from heapq import merge
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from bson import ObjectId
+from app.storage.base import AllocationStore, HistoryQuery, RollupKey
+from app.storage.memory import project
+
+# Hot/archive split. Allocations older than archive_after_days are moved by
+# the archiver (app.services.archive) from the hot store into an archive store
+# of the same engine, so the hot collection and its indexes stay sized to the
+# recent window. Past allocations cannot be created, updated or deleted, so
+# every write and conflict check touches the hot store only. History reads
+# consult the archive only when their date range reaches past the horizon and
+# merge both result sets in sort order; a row caught mid-move (copied but not
+# yet deleted from hot) is returned once.
+
+
+def archive_horizon(archive_after_days: int, today: Optional[date] = None) -> datetime:
+    # Allocations dated before the horizon are eligible for the archive
+    today = today or date.today()
+    return datetime.combine(today - timedelta(days=archive_after_days), datetime.min.time())
+
+
+def _merge_fields(query: HistoryQuery) -> Optional[List[str]]:
+    # The merge needs the sort key and _id of every row, whatever the projection
+    if not query.fields:
+        return None
+    return list(dict.fromkeys(query.fields + [query.sort_by, "_id"]))
+
+
+async def _next(stream: AsyncIterator[dict]) -> Optional[dict]:
+    # anext(stream, None) for Python 3.9
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class ArchivingAllocationStore(AllocationStore):
+    def __init__(self, hot: AllocationStore, archive: AllocationStore, archive_after_days: int = 90):
+        if archive_after_days < 1:
+            raise ValueError("archive_after_days must be at least 1 (only past allocations are immutable)")
+        self.hot = hot
+        self.archive = archive
+        self.archive_after_days = archive_after_days
+
+    @property
+    def horizon(self) -> datetime:
+        return archive_horizon(self.archive_after_days)
+
+    def _reads_archive(self, query: HistoryQuery) -> bool:
+        return query.start is None or query.start < self.horizon
+
+    def _merged(self, query: HistoryQuery, hot_rows, archive_rows):
+        # Both inputs are in query order; yields the union in query order
+        def key(document):
+            return (document.get(query.sort_by), document["_id"])
+
+        last_id = None
+        for document in merge(hot_rows, archive_rows, key=key, reverse=query.sort_order == -1):
+            if document["_id"] == last_id:
+                continue  # Same row in both stores while it is being archived
+            last_id = document["_id"]
+            yield project(document, query.fields) if query.fields else document
+
+    async def create_indexes(self):
+        await asyncio.gather(self.hot.create_indexes(), self.archive.create_indexes())
+
+    async def ensure_indexes(self) -> bool:
+        return any(await asyncio.gather(self.hot.ensure_indexes(), self.archive.ensure_indexes()))
+
+    async def insert(self, document: dict) -> ObjectId:
+        return await self.hot.insert(document)
+
+    async def insert_many(self, documents: List[dict]) -> Dict[int, Optional[str]]:
+        return await self.hot.insert_many(documents)
+
+    async def find_by_id(self, allocation_id: ObjectId) -> Optional[dict]:
+        document = await self.hot.find_by_id(allocation_id)
+        if document is None:
+            document = await self.archive.find_by_id(allocation_id)
+        return document
+
+    async def find_by_ids(self, allocation_ids: List[ObjectId]) -> List[dict]:
+        found = {document["_id"]: document for document in await self.hot.find_by_ids(allocation_ids)}
+        missing = [allocation_id for allocation_id in allocation_ids if allocation_id not in found]
+        if missing:
+            for document in await self.archive.find_by_ids(missing):
+                found.setdefault(document["_id"], document)
+        return list(found.values())
+
+    async def find_conflicts(self, keys: List[Tuple[Optional[int], Optional[int], datetime]]) -> List[dict]:
+        return await self.hot.find_conflicts(keys)
+
+    async def update(self, allocation_id: ObjectId, fields: dict, after: Optional[datetime] = None) -> Optional[dict]:
+        return await self.hot.update(allocation_id, fields, after)
+
+    async def delete(self, allocation_id: ObjectId, after: Optional[datetime] = None) -> Optional[dict]:
+        return await self.hot.delete(allocation_id, after)
+
+    async def delete_many(self, allocation_ids: List[ObjectId]) -> int:
+        return await self.hot.delete_many(allocation_ids)
+
+    async def find(self, query: HistoryQuery) -> List[dict]:
+        if not self._reads_archive(query):
+            return await self.hot.find(query)
+
+        # Each side must supply every row that could land in the requested page
+        part = replace(query, skip=0, limit=query.skip + query.limit if query.limit else None, fields=_merge_fields(query))
+        hot_rows, archive_rows = await asyncio.gather(self.hot.find(part), self.archive.find(part))
+        rows = list(self._merged(query, hot_rows, archive_rows))
+        stop = query.skip + query.limit if query.limit else None
+        return rows[query.skip:stop]
+
+    async def explain(self, query: HistoryQuery) -> dict:
+        explanation = await self.hot.explain(query)
+        if self._reads_archive(query):
+            part = replace(query, skip=0, limit=query.skip + query.limit if query.limit else None)
+            explanation["archive"] = await self.archive.explain(part)
+        return explanation
+
+    async def count(self, query: HistoryQuery) -> int:
+        if not self._reads_archive(query):
+            return await self.hot.count(query)
+        return sum(await asyncio.gather(self.hot.count(query), self.archive.count(query)))
+
+    async def estimated_count(self) -> int:
+        return sum(await asyncio.gather(self.hot.estimated_count(), self.archive.estimated_count()))
+
+    async def iterate(self, query: HistoryQuery, batch_size: int = 1000) -> AsyncIterator[dict]:
+        if not self._reads_archive(query):
+            async for document in self.hot.iterate(query, batch_size):
+                yield document
+            return
+
+        part = replace(query, skip=0, limit=query.skip + query.limit if query.limit else None, fields=_merge_fields(query))
+        streams = [self.hot.iterate(part, batch_size), self.archive.iterate(part, batch_size)]
+        heads: List[Optional[dict]] = [await _next(stream) for stream in streams]
+        descending = query.sort_order == -1
+        last_id = None
+        skipped = emitted = 0
+
+        def key(document):
+            return (document.get(query.sort_by), document["_id"])
+
+        while heads[0] is not None or heads[1] is not None:
+            if heads[1] is None:
+                side = 0
+            elif heads[0] is None:
+                side = 1
+            else:
+                first = key(heads[1]) > key(heads[0]) if descending else key(heads[1]) < key(heads[0])
+                side = 1 if first else 0
+            document = heads[side]
+            heads[side] = await _next(streams[side])
+
+            if document["_id"] == last_id:
+                continue
+            last_id = document["_id"]
+            if skipped < query.skip:
+                skipped += 1
+                continue
+            yield project(document, query.fields) if query.fields else document
+            emitted += 1
+            if query.limit and emitted >= query.limit:
+                break
+
+        for stream in streams:
+            await stream.aclose()
+
+    async def vehicles_on_dates(self, dates: List[datetime]) -> AsyncIterator[Tuple[datetime, int]]:
+        horizon = self.horizon
+        seen = set()
+        async for entry in self.hot.vehicles_on_dates(dates):
+            if entry[0] < horizon:
+                seen.add(entry)
+            yield entry
+        past = [allocation_date for allocation_date in dates if allocation_date < horizon]
+        if past:
+            async for entry in self.archive.vehicles_on_dates(past):
+                if entry not in seen:
+                    yield entry
+
+    def vehicle_ids(self, after: Optional[int] = None) -> AsyncIterator[int]:
+        return self.hot.vehicle_ids(after)
+
+    def employee_ids(self, after: Optional[int] = None) -> AsyncIterator[int]:
+        return self.hot.employee_ids(after)
+
+    async def adjust_rollups(self, deltas: Dict[RollupKey, int]):
+        await self.hot.adjust_rollups(deltas)
+
+    async def find_rollups(
+            self,
+            dimension: str,
+            start_month: str,
+            end_month: str,
+            entity_id: Optional[int] = None,
+            skip: int = 0,
+            limit: Optional[int] = None
+        ) -> List[dict]:
+        return await self.hot.find_rollups(dimension, start_month, end_month, entity_id, skip, limit)
+
+    async def rebuild_rollups(self, include: Sequence[AllocationStore] = ()) -> int:
+        return await self.hot.rebuild_rollups([self.archive, *include])
+
+    async def archive_batch(self, cutoff: datetime, batch_size: int = 1000) -> int:
+        # Moves up to batch_size of the oldest hot allocations dated before
+        # cutoff: copy first, then delete, so a crash in between leaves a
+        # duplicate (hidden by the merge, cleaned up by the next batch) rather
+        # than a lost row. Returns the number moved.
+        query = HistoryQuery(end=cutoff - timedelta(microseconds=1), sort_by="allocation_date", sort_order=1, limit=batch_size)
+        documents = await self.hot.find(query)
+        if not documents:
+            return 0
+
+        failed = await self.archive.insert_many([dict(document) for document in documents])
+        moved = []
+        for position, document in enumerate(documents):
+            # A failed copy is fine if an earlier, interrupted batch already made it
+            if position not in failed or await self.archive.find_by_id(document["_id"]) is not None:
+                moved.append(document["_id"])
+        return await self.hot.delete_many(moved)
@@ -0,0 +1,161 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from bson import ObjectId
+
+# Storage interface for AllocationService. It covers exactly the operations the
+# service needs, so the service does not depend on Motor and can run against
+# the in-memory engine in tests, benchmarks and single-node deployments.
+
+# Schema fields of an allocation document, _id first
+ALLOCATION_FIELDS = ["_id", "employee_id", "vehicle_id", "allocation_date", "purpose"]
+
+
+# Utilization rollups count allocated days per (dimension, entity id, "YYYY-MM")
+ROLLUP_DIMENSIONS = ("vehicle", "employee")
+RollupKey = Tuple[str, int, str]
+
+
+class DuplicateAllocationError(Exception):
+    # Raised when a write violates a unique index: (vehicle_id|employee_id,
+    # allocation_date), or another one such as _id
+    def __init__(self, field: Optional[str]):
+        super().__init__(f"Duplicate {field} for allocation_date" if field else "Duplicate key")
+        self.field = field  # "vehicle_id", "employee_id" or None for any other index
+
+
+@dataclass
+class HistoryQuery:
+    employee_id: Optional[int] = None
+    vehicle_id: Optional[int] = None
+    start: Optional[datetime] = None  # Inclusive allocation_date bounds
+    end: Optional[datetime] = None
+    sort_by: str = "allocation_date"
+    sort_order: int = -1  # _id breaks ties in the same direction
+    skip: int = 0
+    limit: Optional[int] = None
+    after: Optional[Tuple[Any, ObjectId]] = None  # Keyset position: rows strictly after (sort value, _id)
+    fields: Optional[List[str]] = None  # Projection; every field when None
+
+
+class AllocationStore(ABC):
+    @abstractmethod
+    async def create_indexes(self):
+        ...
+
+    async def ensure_indexes(self) -> bool:
+        # Startup check: builds the indexes only if they are behind
+        # app.database.INDEX_VERSION and returns whether it did
+        await self.create_indexes()
+        return True
+
+    @abstractmethod
+    async def insert(self, document: dict) -> ObjectId:
+        # Sets document["_id"]; raises DuplicateAllocationError
+        ...
+
+    @abstractmethod
+    async def insert_many(self, documents: List[dict]) -> Dict[int, Optional[str]]:
+        # Unordered insert; sets _id on every document and returns the failed
+        # positions mapped to the conflicting field (None for other errors).
+        # Raises if the write concern was not satisfied
+        ...
+
+    @abstractmethod
+    async def find_by_id(self, allocation_id: ObjectId) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def find_by_ids(self, allocation_ids: List[ObjectId]) -> List[dict]:
+        # The allocations that exist among the ids, in no particular order
+        ...
+
+    @abstractmethod
+    async def find_conflicts(self, keys: List[Tuple[Optional[int], Optional[int], datetime]]) -> List[dict]:
+        # Existing allocations holding any (vehicle_id, date) or (employee_id, date)
+        # of the given (vehicle_id, employee_id, date) keys. A None vehicle_id or
+        # employee_id leaves that side of the key out, so (None, employee_id,
+        # date) only looks up the employee
+        ...
+
+    @abstractmethod
+    async def update(self, allocation_id: ObjectId, fields: dict, after: Optional[datetime] = None) -> Optional[dict]:
+        # Atomic $set, applied only if allocation_date is later than after (when
+        # given); returns the document as it was before, None if nothing matched.
+        # Raises DuplicateAllocationError
+        ...
+
+    @abstractmethod
+    async def delete(self, allocation_id: ObjectId, after: Optional[datetime] = None) -> Optional[dict]:
+        # Same guard as update; returns the deleted document, None if nothing matched
+        ...
+
+    @abstractmethod
+    async def delete_many(self, allocation_ids: List[ObjectId]) -> int:
+        # Returns the number deleted
+        ...
+
+    @abstractmethod
+    async def find(self, query: HistoryQuery) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def explain(self, query: HistoryQuery) -> dict:
+        # Plan chosen for find(query) with the keys and documents it examined
+        ...
+
+    @abstractmethod
+    async def count(self, query: HistoryQuery) -> int:
+        # Rows matching the filter of the query (sort, paging and position ignored)
+        ...
+
+    @abstractmethod
+    async def estimated_count(self) -> int:
+        # Approximate size of the whole collection, from metadata where possible
+        ...
+
+    @abstractmethod
+    def iterate(self, query: HistoryQuery, batch_size: int = 1000) -> AsyncIterator[dict]:
+        # Streams every matching row (skip/limit honoured) holding one batch at a time
+        ...
+
+    @abstractmethod
+    def vehicles_on_dates(self, dates: List[datetime]) -> AsyncIterator[Tuple[datetime, int]]:
+        # (allocation_date, vehicle_id) of every allocation on the given dates
+        ...
+
+    @abstractmethod
+    def vehicle_ids(self, after: Optional[int] = None) -> AsyncIterator[int]:
+        # Ids of the fleet (the vehicles collection), only those greater than after if given
+        ...
+
+    @abstractmethod
+    def employee_ids(self, after: Optional[int] = None) -> AsyncIterator[int]:
+        # Ids of the employees collection, only those greater than after if given
+        ...
+
+    @abstractmethod
+    async def adjust_rollups(self, deltas: Dict[RollupKey, int]):
+        # Add each delta to its utilization counter, creating missing counters
+        ...
+
+    @abstractmethod
+    async def find_rollups(
+            self,
+            dimension: str,
+            start_month: str,
+            end_month: str,
+            entity_id: Optional[int] = None,
+            skip: int = 0,
+            limit: Optional[int] = None
+        ) -> List[dict]:
+        # Non-zero counters in [start_month, end_month], ordered by (month, entity_id),
+        # as {"dimension", "entity_id", "month", "days"}
+        ...
+
+    @abstractmethod
+    async def rebuild_rollups(self, include: Sequence["AllocationStore"] = ()) -> int:
+        # Recompute every counter from the allocations, plus those of the include
+        # stores (same engine); returns the number of counters
+        ...
@@ -0,0 +1,323 @@
+import asyncio
+import time
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import replace
+from datetime import datetime
+from itertools import chain, islice
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from bson import ObjectId
+from app.storage.base import AllocationStore, DuplicateAllocationError, HistoryQuery, RollupKey
+from app.storage.planner import plan_history
+
+# In-memory allocation engine. Documents live in a dict keyed by _id, the two
+# unique (field, allocation_date) constraints are hash maps, and the secondary
+# indexes from create_indexes are sorted lists of (key..., _id) tuples, so a
+# history range query is a bisect plus a walk over the k rows it returns.
+
+MIN_ID = ObjectId("0" * 24)
+MAX_ID = ObjectId("f" * 24)
+
+# Secondary indexes keyed by the equality filters they serve; allocation_date
+# is always the last key so date ranges and date sorts come straight off them
+SECONDARY_INDEXES = {
+    frozenset(): ("allocation_date",),
+    frozenset({"vehicle_id"}): ("vehicle_id", "allocation_date"),
+    frozenset({"employee_id"}): ("employee_id", "allocation_date"),
+    frozenset({"employee_id", "vehicle_id"}): ("employee_id", "vehicle_id", "allocation_date")
+}
+UNIQUE_FIELDS = ("vehicle_id", "employee_id")
+
+
+def project(document: dict, fields: Optional[List[str]]) -> dict:
+    if not fields:
+        return dict(document)
+    return {field: document[field] for field in fields if field in document}
+
+
+class MemoryAllocationStore(AllocationStore):
+    def __init__(self, vehicle_ids: Iterable[int] = (), employee_ids: Iterable[int] = ()):
+        self._documents: Dict[ObjectId, dict] = {}
+        self._ids: List[ObjectId] = []  # Primary index, sorted
+        self._indexes: Dict[tuple, list] = {fields: [] for fields in SECONDARY_INDEXES.values()}
+        self._unique: Dict[str, Dict[Tuple[int, datetime], ObjectId]] = {field: {} for field in UNIQUE_FIELDS}
+        self._vehicles = set(vehicle_ids)
+        self._employees = set(employee_ids)
+        self._rollups: Dict[RollupKey, int] = {}
+
+    def add_vehicles(self, vehicle_ids: Iterable[int]):
+        self._vehicles.update(vehicle_ids)
+
+    def add_employees(self, employee_ids: Iterable[int]):
+        self._employees.update(employee_ids)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def _index_entries(self, document: dict):
+        for fields, entries in self._indexes.items():
+            yield entries, tuple(document[field] for field in fields) + (document["_id"],)
+
+    def _add(self, document: dict):
+        self._documents[document["_id"]] = document
+        insort(self._ids, document["_id"])
+        for entries, key in self._index_entries(document):
+            insort(entries, key)
+        for field in UNIQUE_FIELDS:
+            self._unique[field][(document[field], document["allocation_date"])] = document["_id"]
+
+    def _remove(self, document: dict):
+        del self._documents[document["_id"]]
+        del self._ids[bisect_left(self._ids, document["_id"])]
+        for entries, key in self._index_entries(document):
+            del entries[bisect_left(entries, key)]
+        for field in UNIQUE_FIELDS:
+            self._unique[field].pop((document[field], document["allocation_date"]), None)
+
+    def _check_unique(self, document: dict):
+        for field in UNIQUE_FIELDS:
+            owner = self._unique[field].get((document[field], document["allocation_date"]))
+            if owner is not None and owner != document["_id"]:
+                raise DuplicateAllocationError(field)
+
+    async def create_indexes(self):
+        # Indexes are maintained on every write
+        pass
+
+    async def ensure_indexes(self) -> bool:
+        return False
+
+    async def insert(self, document: dict) -> ObjectId:
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._documents:
+            raise DuplicateAllocationError(None)  # Copies into the archive carry their _id
+        self._check_unique(document)
+        self._add(dict(document))
+        return document["_id"]
+
+    async def insert_many(self, documents: List[dict]) -> Dict[int, Optional[str]]:
+        failed = {}
+        for position, document in enumerate(documents):
+            try:
+                await self.insert(document)
+            except DuplicateAllocationError as e:
+                failed[position] = e.field
+        return failed
+
+    async def find_by_id(self, allocation_id: ObjectId) -> Optional[dict]:
+        document = self._documents.get(allocation_id)
+        return dict(document) if document else None
+
+    async def find_by_ids(self, allocation_ids: List[ObjectId]) -> List[dict]:
+        return [dict(self._documents[i]) for i in set(allocation_ids) if i in self._documents]
+
+    async def find_conflicts(self, keys: List[Tuple[Optional[int], Optional[int], datetime]]) -> List[dict]:
+        found = {}
+        for vehicle_id, employee_id, allocation_date in keys:
+            for field, value in (("vehicle_id", vehicle_id), ("employee_id", employee_id)):
+                if value is None:
+                    continue
+                owner = self._unique[field].get((value, allocation_date))
+                if owner is not None:
+                    found[owner] = self._documents[owner]
+        return [dict(document) for document in found.values()]
+
+    def _guarded(self, allocation_id: ObjectId, after: Optional[datetime]) -> Optional[dict]:
+        document = self._documents.get(allocation_id)
+        if document is None or (after is not None and document["allocation_date"] <= after):
+            return None
+        return document
+
+    async def update(self, allocation_id: ObjectId, fields: dict, after: Optional[datetime] = None) -> Optional[dict]:
+        document = self._guarded(allocation_id, after)
+        if document is None:
+            return None
+        updated = dict(document, **fields)
+        self._check_unique(updated)
+        self._remove(document)
+        self._add(updated)
+        return dict(document)
+
+    async def delete(self, allocation_id: ObjectId, after: Optional[datetime] = None) -> Optional[dict]:
+        document = self._guarded(allocation_id, after)
+        if document is None:
+            return None
+        self._remove(document)
+        return dict(document)
+
+    def _range(self, query: HistoryQuery) -> Tuple[dict, tuple, list, int, int]:
+        # Pick the index whose equality prefix matches the filter
+        equality = {}
+        if query.employee_id is not None:
+            equality["employee_id"] = query.employee_id
+        if query.vehicle_id is not None:
+            equality["vehicle_id"] = query.vehicle_id
+        fields = SECONDARY_INDEXES[frozenset(equality)]
+        entries = self._indexes[fields]
+        prefix = tuple(equality[field] for field in fields[:-1])
+
+        # Bound the allocation_date range
+        lo = bisect_left(entries, prefix + ((query.start, MIN_ID) if query.start is not None else ()))
+        if query.end is not None:
+            hi = bisect_right(entries, prefix + (query.end, MAX_ID))
+        elif prefix:
+            hi = bisect_left(entries, prefix[:-1] + (prefix[-1] + 1,))
+        else:
+            hi = len(entries)
+        return equality, prefix, entries, lo, hi
+
+    def _scan(self, query: HistoryQuery, examined: Optional[List[int]] = None) -> Iterator[dict]:
+        # Yields matching rows in query order; examined[0] counts the index
+        # entries visited (the explain keys/docs examined)
+        examined = examined if examined is not None else [0]
+        equality, prefix, entries, lo, hi = self._range(query)
+        ascending = query.sort_order == 1
+
+        if query.sort_by == "allocation_date":
+            # Index order is (date, _id): seek, then walk k entries
+            if query.after is not None:
+                position = prefix + tuple(query.after)
+                if ascending:
+                    lo = max(lo, bisect_right(entries, position))
+                else:
+                    hi = min(hi, bisect_left(entries, position))
+            for i in (range(lo, hi) if ascending else range(hi - 1, lo - 1, -1)):
+                examined[0] += 1
+                yield self._documents[entries[i][-1]]
+            return
+
+        if query.sort_by == "_id" and not equality:
+            # Walk the primary index, applying the date bounds to each row
+            lo, hi = 0, len(self._ids)
+            if query.after is not None:
+                if ascending:
+                    lo = bisect_right(self._ids, query.after[1])
+                else:
+                    hi = bisect_left(self._ids, query.after[1])
+            for i in (range(lo, hi) if ascending else range(hi - 1, lo - 1, -1)):
+                examined[0] += 1
+                document = self._documents[self._ids[i]]
+                allocation_date = document["allocation_date"]
+                if query.start is not None and allocation_date < query.start:
+                    continue
+                if query.end is not None and allocation_date > query.end:
+                    continue
+                yield document
+            return
+
+        # No index provides this order (bounded shapes only): sort the filtered rows in memory
+        def sort_key(document):
+            return (document.get(query.sort_by), document["_id"])
+
+        examined[0] += max(0, hi - lo)
+        rows = sorted((self._documents[entry[-1]] for entry in entries[lo:hi]), key=sort_key, reverse=not ascending)
+        if query.after is not None:
+            # For _id sorts the position is the _id itself
+            after = (query.after[1], query.after[1]) if query.sort_by == "_id" else tuple(query.after)
+            rows = [row for row in rows if (sort_key(row) > after if ascending else sort_key(row) < after)]
+        yield from rows
+
+    async def find(self, query: HistoryQuery) -> List[dict]:
+        stop = query.skip + query.limit if query.limit else None
+        return [project(document, query.fields) for document in islice(self._scan(query), query.skip, stop)]
+
+    async def explain(self, query: HistoryQuery) -> dict:
+        plan = plan_history(query)
+        examined = [0]
+        stop = query.skip + query.limit if query.limit else None
+        started = time.perf_counter()
+        returned = sum(1 for _ in islice(self._scan(query, examined), query.skip, stop))
+        return {
+            "plan": plan.describe(),
+            "stages": None,  # No server plan; the walk follows this engine's own index for the shape
+            "keys_examined": examined[0],
+            "docs_examined": examined[0],
+            "returned": returned,
+            "execution_time_ms": round((time.perf_counter() - started) * 1000)
+        }
+
+    async def count(self, query: HistoryQuery) -> int:
+        # The index range holds exactly the matching rows
+        _, _, _, lo, hi = self._range(query)
+        return max(0, hi - lo)
+
+    async def estimated_count(self) -> int:
+        return len(self._documents)
+
+    async def iterate(self, query: HistoryQuery, batch_size: int = 1000) -> AsyncIterator[dict]:
+        # Keyset-paged so writes between batches cannot shift the walk, and at
+        # most one batch is held at a time
+        remaining = query.limit
+        page_query = replace(query, fields=None)
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            page = await self.find(replace(page_query, limit=size))
+            for document in page:
+                yield project(document, query.fields)
+            if len(page) < size:
+                break
+            last = page[-1]
+            page_query = replace(page_query, skip=0, after=(last.get(query.sort_by), last["_id"]))
+            if remaining is not None:
+                remaining -= len(page)
+            await asyncio.sleep(0)  # Let other requests run between batches
+
+    async def vehicles_on_dates(self, dates: List[datetime]) -> AsyncIterator[Tuple[datetime, int]]:
+        entries = self._indexes[SECONDARY_INDEXES[frozenset()]]
+        for allocation_date in dates:
+            lo = bisect_left(entries, (allocation_date, MIN_ID))
+            hi = bisect_right(entries, (allocation_date, MAX_ID))
+            for entry in entries[lo:hi]:
+                yield allocation_date, self._documents[entry[-1]]["vehicle_id"]
+
+    async def vehicle_ids(self, after: Optional[int] = None) -> AsyncIterator[int]:
+        for vehicle_id in list(self._vehicles):
+            if after is None or vehicle_id > after:
+                yield vehicle_id
+
+    async def employee_ids(self, after: Optional[int] = None) -> AsyncIterator[int]:
+        for employee_id in list(self._employees):
+            if after is None or employee_id > after:
+                yield employee_id
+
+    async def adjust_rollups(self, deltas: Dict[RollupKey, int]):
+        for key, delta in deltas.items():
+            self._rollups[key] = self._rollups.get(key, 0) + delta
+
+    async def find_rollups(
+            self,
+            dimension: str,
+            start_month: str,
+            end_month: str,
+            entity_id: Optional[int] = None,
+            skip: int = 0,
+            limit: Optional[int] = None
+        ) -> List[dict]:
+        keys = sorted(
+            (month, key_entity_id)
+            for (key_dimension, key_entity_id, month), days in self._rollups.items()
+            if key_dimension == dimension and start_month <= month <= end_month and days > 0
+            and (entity_id is None or key_entity_id == entity_id)
+        )
+        stop = skip + limit if limit else None
+        return [
+            {"dimension": dimension, "entity_id": key_entity_id, "month": month,
+             "days": self._rollups[(dimension, key_entity_id, month)]}
+            for month, key_entity_id in islice(keys, skip, stop)
+        ]
+
+    async def delete_many(self, allocation_ids: List[ObjectId]) -> int:
+        deleted = 0
+        for allocation_id in allocation_ids:
+            deleted += await self.delete(allocation_id) is not None
+        return deleted
+
+    async def rebuild_rollups(self, include: Sequence[AllocationStore] = ()) -> int:
+        rollups: Dict[RollupKey, int] = {}
+        documents = [self._documents.values()] + [store._documents.values() for store in include]
+        for document in chain.from_iterable(documents):
+            month = document["allocation_date"].strftime("%Y-%m")
+            for dimension in ("vehicle", "employee"):
+                key = (dimension, document[f"{dimension}_id"], month)
+                rollups[key] = rollups.get(key, 0) + 1
+        self._rollups = rollups
+        return len(rollups)
@@ -0,0 +1,279 @@
+from dataclasses import replace
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError
+from app.database import create_indexes, indexes_current, record_indexes
+from app.services.pagination import seek_filter
+from app.storage.base import AllocationStore, DuplicateAllocationError, HistoryQuery, RollupKey
+from app.storage.planner import plan_history
+
+
+# Unique index name -> conflicting field, for servers that only report the
+# index name in the error message
+UNIQUE_INDEX_FIELDS = {
+    "vehicle_id_1_allocation_date_1": "vehicle_id",
+    "employee_id_1_allocation_date_1": "employee_id"
+}
+
+
+def duplicate_key_field(details: Optional[dict]) -> Optional[str]:
+    # Map the violated unique index back to the conflicting field, None for any
+    # other unique index (such as _id). Accepts DuplicateKeyError.details or a
+    # single BulkWriteError write error.
+    details = details or {}
+    key_pattern = details.get("keyPattern")
+    if key_pattern:
+        fields = set(key_pattern)
+        for field in ("vehicle_id", "employee_id"):
+            if fields == {field, "allocation_date"}:
+                return field
+        return None
+    errmsg = details.get("errmsg", "")
+    for index_name, field in UNIQUE_INDEX_FIELDS.items():
+        if f"index: {index_name} " in errmsg:
+            return field
+    return None
+
+
+def history_filter(query: HistoryQuery) -> dict:
+    mongo_query = {}
+    if query.employee_id is not None:
+        mongo_query["employee_id"] = query.employee_id
+    if query.vehicle_id is not None:
+        mongo_query["vehicle_id"] = query.vehicle_id
+    if query.start is not None or query.end is not None:
+        mongo_query["allocation_date"] = {}
+        if query.start is not None:
+            mongo_query["allocation_date"]["$gte"] = query.start
+        if query.end is not None:
+            mongo_query["allocation_date"]["$lte"] = query.end
+
+    # Seek past the last (sort key, _id) seen
+    if query.after is not None:
+        seek = seek_filter(query.sort_by, query.sort_order, *query.after)
+        mongo_query = {"$and": [mongo_query, seek]} if mongo_query else seek
+    return mongo_query
+
+
+# Recomputes allocation_rollups from scratch: one counter per (dimension,
+# entity, month), swapped in atomically by $out (which keeps the indexes)
+ROLLUP_PIPELINE = [
+    {"$project": {
+        "_id": 0,
+        "month": {"$dateToString": {"format": "%Y-%m", "date": "$allocation_date"}},
+        "keys": [
+            {"dimension": "vehicle", "entity_id": "$vehicle_id"},
+            {"dimension": "employee", "entity_id": "$employee_id"}
+        ]
+    }},
+    {"$unwind": "$keys"},
+    {"$group": {
+        "_id": {"dimension": "$keys.dimension", "entity_id": "$keys.entity_id", "month": "$month"},
+        "days": {"$sum": 1}
+    }},
+    {"$project": {
+        "_id": 0,
+        "dimension": "$_id.dimension",
+        "entity_id": "$_id.entity_id",
+        "month": "$_id.month",
+        "days": 1
+    }},
+    {"$out": "allocation_rollups"}
+]
+
+
+class MongoAllocationStore(AllocationStore):
+    def __init__(self, db: AsyncIOMotorDatabase, collection: str = "allocations"):
+        self.db = db
+        self.allocations = db[collection]
+
+    async def create_indexes(self):
+        await create_indexes(self.db, self.allocations.name)
+
+    async def ensure_indexes(self) -> bool:
+        # One read when current, instead of a create_index round trip per index
+        name = f"indexes.{self.allocations.name}"
+        if await indexes_current(self.db, name):
+            return False
+        await self.create_indexes()
+        await record_indexes(self.db, name)
+        return True
+
+    async def insert(self, document: dict) -> ObjectId:
+        try:
+            result = await self.allocations.insert_one(document)
+        except DuplicateKeyError as e:
+            raise DuplicateAllocationError(duplicate_key_field(e.details)) from e
+        return result.inserted_id
+
+    async def insert_many(self, documents: List[dict]) -> Dict[int, Optional[str]]:
+        failed = {}
+        try:
+            await self.allocations.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # The inserts that did not fail are not known to be durable either
+            write_concern_errors = e.details.get("writeConcernErrors")
+            if write_concern_errors:
+                error = write_concern_errors[0]
+                raise WriteConcernError(error.get("errmsg", "Write concern error"), error.get("code"), error) from e
+            for write_error in e.details.get("writeErrors", []):
+                if write_error.get("code") == 11000:
+                    failed[write_error["index"]] = duplicate_key_field(write_error)
+                else:
+                    failed[write_error["index"]] = None
+        return failed
+
+    async def find_by_id(self, allocation_id: ObjectId) -> Optional[dict]:
+        return await self.allocations.find_one({"_id": allocation_id})
+
+    async def find_by_ids(self, allocation_ids: List[ObjectId]) -> List[dict]:
+        return await self.allocations.find({"_id": {"$in": allocation_ids}}).to_list(length=None)
+
+    async def find_conflicts(self, keys: List[Tuple[Optional[int], Optional[int], datetime]]) -> List[dict]:
+        # One $or clause per date and field, so each clause is served by the
+        # (vehicle_id, allocation_date) or (employee_id, allocation_date) index
+        vehicles_by_date = {}
+        employees_by_date = {}
+        for vehicle_id, employee_id, allocation_date in keys:
+            if vehicle_id is not None:
+                vehicles_by_date.setdefault(allocation_date, set()).add(vehicle_id)
+            if employee_id is not None:
+                employees_by_date.setdefault(allocation_date, set()).add(employee_id)
+        clauses = [
+            {"allocation_date": d, "vehicle_id": {"$in": list(ids)}} for d, ids in vehicles_by_date.items()
+        ] + [
+            {"allocation_date": d, "employee_id": {"$in": list(ids)}} for d, ids in employees_by_date.items()
+        ]
+        if not clauses:
+            return []
+        cursor = self.allocations.find({"$or": clauses})
+        return await cursor.to_list(length=None)
+
+    @staticmethod
+    def _guard(allocation_id: ObjectId, after: Optional[datetime]) -> dict:
+        if after is None:
+            return {"_id": allocation_id}
+        return {"_id": allocation_id, "allocation_date": {"$gt": after}}
+
+    async def update(self, allocation_id: ObjectId, fields: dict, after: Optional[datetime] = None) -> Optional[dict]:
+        # One round trip: the guard, the $set and the unique indexes are applied atomically
+        try:
+            return await self.allocations.find_one_and_update(
+                self._guard(allocation_id, after),
+                {"$set": fields},
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError as e:
+            raise DuplicateAllocationError(duplicate_key_field(e.details)) from e
+
+    async def delete(self, allocation_id: ObjectId, after: Optional[datetime] = None) -> Optional[dict]:
+        return await self.allocations.find_one_and_delete(self._guard(allocation_id, after))
+
+    def _cursor(self, query: HistoryQuery):
+        projection = None
+        if query.fields:
+            projection = {field: 1 for field in query.fields}
+            if "_id" not in projection:
+                projection["_id"] = 0
+
+        # The plan pins the index and a total order (_id breaks ties where the
+        # sort key can repeat), so keyset pagination is stable
+        plan = plan_history(query)
+        cursor = self.allocations.find(history_filter(query), projection).sort(plan.sort).hint(plan.hint)
+        if query.skip:
+            cursor = cursor.skip(query.skip)
+        if query.limit:
+            cursor = cursor.limit(query.limit)
+        return cursor
+
+    async def find(self, query: HistoryQuery) -> List[dict]:
+        return await self._cursor(query).to_list(length=query.limit)
+
+    async def explain(self, query: HistoryQuery) -> dict:
+        explanation = await self._cursor(query).explain()
+        stats = explanation.get("executionStats", {})
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        winning_plan = winning_plan.get("queryPlan", winning_plan)  # Slot-based engine nests it
+        stages = []
+        while winning_plan:
+            stages.append(winning_plan.get("stage"))
+            winning_plan = winning_plan.get("inputStage")
+        return {
+            "plan": plan_history(query).describe(),
+            "stages": stages,
+            "keys_examined": stats.get("totalKeysExamined"),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "returned": stats.get("nReturned"),
+            "execution_time_ms": stats.get("executionTimeMillis")
+        }
+
+    async def count(self, query: HistoryQuery) -> int:
+        return await self.allocations.count_documents(history_filter(replace(query, after=None)))
+
+    async def estimated_count(self) -> int:
+        # Collection metadata; no scan
+        return await self.allocations.estimated_document_count()
+
+    async def iterate(self, query: HistoryQuery, batch_size: int = 1000) -> AsyncIterator[dict]:
+        async for document in self._cursor(query).batch_size(batch_size):
+            yield document
+
+    async def vehicles_on_dates(self, dates: List[datetime]) -> AsyncIterator[Tuple[datetime, int]]:
+        cursor = self.allocations.find(
+            {"allocation_date": {"$in": dates}},
+            {"_id": 0, "vehicle_id": 1, "allocation_date": 1}
+        )
+        async for allocation in cursor:
+            yield allocation["allocation_date"], allocation["vehicle_id"]
+
+    async def vehicle_ids(self, after: Optional[int] = None) -> AsyncIterator[int]:
+        async for vehicle in self.db.vehicles.find({} if after is None else {"_id": {"$gt": after}}, {"_id": 1}):
+            yield vehicle["_id"]
+
+    async def employee_ids(self, after: Optional[int] = None) -> AsyncIterator[int]:
+        async for employee in self.db.employees.find({} if after is None else {"_id": {"$gt": after}}, {"_id": 1}):
+            yield employee["_id"]
+
+    async def adjust_rollups(self, deltas: Dict[RollupKey, int]):
+        operations = [
+            UpdateOne(
+                {"dimension": dimension, "entity_id": entity_id, "month": month},
+                {"$inc": {"days": delta}},
+                upsert=True
+            )
+            for (dimension, entity_id, month), delta in deltas.items() if delta
+        ]
+        if operations:
+            await self.db.allocation_rollups.bulk_write(operations, ordered=False)
+
+    async def find_rollups(
+            self,
+            dimension: str,
+            start_month: str,
+            end_month: str,
+            entity_id: Optional[int] = None,
+            skip: int = 0,
+            limit: Optional[int] = None
+        ) -> List[dict]:
+        mongo_query = {"dimension": dimension, "month": {"$gte": start_month, "$lte": end_month}, "days": {"$gt": 0}}
+        if entity_id is not None:
+            mongo_query["entity_id"] = entity_id
+        cursor = self.db.allocation_rollups.find(mongo_query, {"_id": 0}).sort([("month", 1), ("entity_id", 1)])
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def delete_many(self, allocation_ids: List[ObjectId]) -> int:
+        result = await self.allocations.delete_many({"_id": {"$in": allocation_ids}})
+        return result.deleted_count
+
+    async def rebuild_rollups(self, include: Sequence[AllocationStore] = ()) -> int:
+        # Other Mongo stores (the archive) are folded in server-side with $unionWith
+        union = [{"$unionWith": store.allocations.name} for store in include]
+        await self.allocations.aggregate(union + ROLLUP_PIPELINE, allowDiskUse=True).to_list(length=None)
+        return await self.db.allocation_rollups.count_documents({})
@@ -0,0 +1,132 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from app.storage.base import HistoryQuery
+
+# Index-aware planning for history queries. Every (filter shape, sort) pair is
+# mapped onto one of the indexes built by create_indexes, so MongoDB never has
+# to sort an unbounded result set in memory (and hit its sort memory limit):
+#
+# - A filter on employee_id or vehicle_id matches at most one allocation per
+#   date (both are unique per date), so any whitelisted sort is allowed; rows
+#   come off the equality prefix of an index and date sorts need no extra sort.
+# - Without one, the result is unbounded and only index orders are accepted:
+#   allocation_date (with _id as tie-breaker) or _id.
+#
+# Each shape also has its covering choice: when the caller asks for a
+# projection, the plan takes the shape's index that holds every requested
+# field (plus the sort key, and _id when resuming after a cursor), so the rows
+# come from the index keys without fetching a document. The employee_id shape
+# has two such indexes, and only a projection with vehicle_id moves it to the
+# (employee_id, vehicle_id, allocation_date) one, where a date sort is done in
+# memory over the employee's bounded rows. QueryPlan.covering lists the fields
+# the chosen index can return.
+
+SORT_FIELDS = ("allocation_date", "_id", "employee_id", "vehicle_id")
+UNBOUNDED_SORT_FIELDS = ("allocation_date", "_id")
+
+# Equality filter shape -> index keys that can serve it, matching
+# app.database.create_indexes. The first one is used unless a later one covers
+# the projection and the first does not
+EMPLOYEE_DATE_INDEX = [("employee_id", 1), ("allocation_date", 1)]
+EMPLOYEE_VEHICLE_DATE_INDEX = [("employee_id", 1), ("vehicle_id", 1), ("allocation_date", 1)]
+INDEXES = {
+    frozenset(): [[("allocation_date", 1), ("_id", 1)]],
+    frozenset({"vehicle_id"}): [[("vehicle_id", 1), ("allocation_date", 1)]],
+    frozenset({"employee_id"}): [EMPLOYEE_DATE_INDEX, EMPLOYEE_VEHICLE_DATE_INDEX],
+    frozenset({"employee_id", "vehicle_id"}): [EMPLOYEE_VEHICLE_DATE_INDEX]
+}
+ID_INDEX = [("_id", 1)]
+
+
+@dataclass
+class QueryPlan:
+    shape: List[str]  # Equality-filtered fields, sorted
+    hint: List[Tuple[str, int]]  # Index keys passed as the hint
+    sort: List[Tuple[str, int]]  # Sort sent to the server
+    in_memory_sort: bool  # The index does not provide the order (bounded shapes only)
+    covered: bool  # The projection is answered from the index alone
+    projection: Optional[List[str]]
+    covering: List[str]  # Fields the chosen index can return without a document fetch
+
+    @property
+    def index_name(self) -> str:
+        if self.hint == ID_INDEX:
+            return "_id_"
+        return "_".join(f"{field}_{order}" for field, order in self.hint)
+
+    def describe(self) -> dict:
+        return {
+            "shape": self.shape,
+            "index": self.index_name,
+            "sort": [[field, order] for field, order in self.sort],
+            "in_memory_sort": self.in_memory_sort,
+            "covered": self.covered,
+            "projection": self.projection,
+            "covering_fields": self.covering
+        }
+
+
+def covers(hint: List[Tuple[str, int]], query: HistoryQuery) -> bool:
+    # Whether the index keys hold everything the query reads back: the
+    # projection, the sort key and, to seek past a cursor, _id
+    if not query.fields:
+        return False
+    needed = set(query.fields) | {query.sort_by}
+    if query.after is not None:
+        needed.add("_id")
+    return needed <= {field for field, _ in hint}
+
+
+def choose_index(shape: frozenset, query: HistoryQuery) -> List[Tuple[str, int]]:
+    candidates = INDEXES[shape]
+    return next((hint for hint in candidates if covers(hint, query)), candidates[0])
+
+
+def plan_history(query: HistoryQuery) -> QueryPlan:
+    # Raises ValueError for sorts no index can serve
+    if query.sort_by not in SORT_FIELDS:
+        raise ValueError(f"sort_by must be one of {', '.join(SORT_FIELDS)}")
+    if query.sort_order not in (1, -1):
+        raise ValueError("sort_order must be 1 or -1")
+
+    shape = frozenset(
+        field for field, value in (("employee_id", query.employee_id), ("vehicle_id", query.vehicle_id))
+        if value is not None
+    )
+    bounded = bool(shape)
+    if not bounded and query.sort_by not in UNBOUNDED_SORT_FIELDS:
+        raise ValueError(
+            f"sort_by={query.sort_by} needs an employee_id or vehicle_id filter; "
+            f"without one sort by {' or '.join(UNBOUNDED_SORT_FIELDS)}"
+        )
+
+    if query.sort_by == "_id" and not bounded:
+        # Walk the _id index; date bounds, if any, are applied to the keys it visits
+        hint = ID_INDEX
+        sort = [("_id", query.sort_order)]
+        in_memory_sort = False
+    else:
+        hint = choose_index(shape, query)
+        if query.sort_by == "allocation_date":
+            # Unique per date within an equality shape, so no tie-breaker is needed,
+            # and the order comes straight off an index whose keys continue
+            # with allocation_date after the equality fields
+            sort = [("allocation_date", query.sort_order)]
+            if not bounded:
+                sort.append(("_id", query.sort_order))
+            in_memory_sort = next(field for field, _ in hint if field not in shape) != "allocation_date"
+        else:
+            sort = [(query.sort_by, query.sort_order)]
+            if query.sort_by != "_id":
+                sort.append(("_id", query.sort_order))
+            in_memory_sort = True
+
+    return QueryPlan(
+        shape=sorted(shape),
+        hint=hint,
+        sort=sort,
+        in_memory_sort=in_memory_sort,
+        covered=covers(hint, query),
+        projection=query.fields,
+        covering=[field for field, _ in hint]
+    )
@@ -0,0 +1,245 @@
+# Synthetic data generator for performance testing. Produces allocations at
+# production scale (tens of millions) with hot vehicles and busy dates, and
+# either loads them into MongoDB with parallel unordered batches or writes them
+# to NDJSON for the in-process benchmarks (tests/bench_common.py --dataset).
+#
+#   python -m scripts.generate_data --allocations 10000000 --days 1825 --workers 8 --defer-indexes --drop
+#   python -m scripts.generate_data --allocations 1000000 --sink ndjson --path allocations.ndjson
+#
+# Every date is generated from its own seeded RNG, so a given --seed always
+# yields the same dataset whatever the batch size or number of workers. The
+# generated rows never violate the unique (vehicle_id, allocation_date) and
+# (employee_id, allocation_date) indexes.
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Iterator, List
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+
+from app.config import settings
+from app.database import create_indexes
+
+PURPOSES = ["Client visit", "Site inspection", "Airport transfer", "Delivery", "Training", "Conference"]
+
+
+def distribute(total: int, weights: List[float], capacity: int) -> List[int]:
+    # Splits total over the days in proportion to their weights, at most
+    # capacity per day. Days whose share exceeds capacity are filled and the
+    # rest is split again over the others; the largest remainders take the
+    # leftover units, so the counts add up to total exactly (or to the
+    # capacity of every day when total exceeds it)
+    counts = [0] * len(weights)
+    open_days = [day for day, weight in enumerate(weights) if weight > 0]
+    remaining = min(total, capacity * len(open_days))
+    while remaining > 0 and open_days:
+        weight = sum(weights[day] for day in open_days)
+        shares = {day: remaining * weights[day] / weight for day in open_days}
+        full = [day for day in open_days if shares[day] >= capacity]
+        if full:
+            for day in full:
+                counts[day] = capacity
+            remaining -= capacity * len(full)
+            open_days = [day for day in open_days if shares[day] < capacity]
+            continue
+        for day in open_days:
+            counts[day] = int(shares[day])
+        left = remaining - sum(counts[day] for day in open_days)
+        for day in sorted(open_days, key=lambda day: shares[day] - counts[day], reverse=True)[:left]:
+            counts[day] += 1
+        break
+    return counts
+
+
+class AllocationGenerator:
+    def __init__(self, args):
+        self.seed = args.seed
+        self.start = args.start_date
+        self.days = args.days
+        self.employees = args.employees
+        self.hot_share = args.hot_share
+
+        rng = random.Random(args.seed)
+        vehicles = list(range(1, args.vehicles + 1))
+        rng.shuffle(vehicles)
+        hot_count = max(1, int(args.vehicles * args.hot_vehicles))
+        self.hot = vehicles[:hot_count]
+        self.cold = vehicles[hot_count:]
+
+        # Busy dates carry busy_factor times the load of an ordinary date
+        busy = set(rng.sample(range(args.days), int(args.days * args.busy_dates)))
+        weights = [args.busy_factor if day in busy else 1.0 for day in range(args.days)]
+        capacity = min(args.vehicles, args.employees)  # One allocation per vehicle and per employee per date
+        self.per_day = distribute(args.allocations, weights, capacity)
+
+    @property
+    def total(self) -> int:
+        return sum(self.per_day)
+
+    def day(self, offset: int) -> List[dict]:
+        rng = random.Random(self.seed * 1_000_003 + offset)
+        count = self.per_day[offset]
+        hot = min(len(self.hot), round(count * self.hot_share))
+        cold = min(len(self.cold), count - hot)
+        hot = count - cold  # Spill onto the hot set when the cold set is too small
+        vehicles = rng.sample(self.hot, hot) + rng.sample(self.cold, cold)
+        employees = rng.sample(range(1, self.employees + 1), count)
+        allocation_date = datetime.combine(self.start + timedelta(days=offset), datetime.min.time())
+        return [
+            {
+                "employee_id": employee_id,
+                "vehicle_id": vehicle_id,
+                "allocation_date": allocation_date,
+                "purpose": rng.choice(PURPOSES)
+            }
+            for vehicle_id, employee_id in zip(vehicles, employees)
+        ]
+
+    def batches(self, batch_size: int) -> Iterator[List[dict]]:
+        batch = []
+        for offset in range(self.days):
+            batch.extend(self.day(offset))
+            while len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
+        if batch:
+            yield batch
+
+
+class Progress:
+    def __init__(self, total: int, interval: float = 5):
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+        self.interval = interval
+        self._last_report = self.started
+
+    def advance(self, count: int):
+        self.done += count
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            print(f"  {self.done:,}/{self.total:,} documents, {self.rate():,.0f} docs/s")
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.done / elapsed if elapsed > 0 else 0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+async def seed_entities(db, vehicles: int, employees: int, batch_size: int):
+    # The employees, vehicles and drivers collections of scripts/seed_data.py, at scale
+    for name, count in (("employees", employees), ("vehicles", vehicles), ("drivers", vehicles)):
+        await db[name].drop()
+        for first in range(1, count + 1, batch_size):
+            ids = range(first, min(count, first + batch_size - 1) + 1)
+            if name == "vehicles":
+                documents = [{"_id": i, "name": f"Vehicle {i}", "driver_id": i} for i in ids]
+            else:
+                documents = [{"_id": i, "name": f"{name[:-1].capitalize()} {i}"} for i in ids]
+            await db[name].insert_many(documents, ordered=False)
+
+
+async def load_mongo(args, generator: AllocationGenerator):
+    client = AsyncIOMotorClient(args.mongodb_url, maxPoolSize=args.workers)
+    db = client[args.database]
+    try:
+        if args.drop:
+            await db.allocations.drop()
+        if args.seed_entities:
+            await seed_entities(db, args.vehicles, args.employees, args.batch_size)
+        if args.defer_indexes:
+            # Loading into a bare collection and building the indexes once is much
+            # faster than maintaining them on every insert
+            await db.allocations.drop_indexes()
+        else:
+            await create_indexes(db)
+
+        progress = Progress(generator.total)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=args.workers * 2)
+        failed = 0
+
+        async def worker():
+            nonlocal failed
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                try:
+                    await db.allocations.insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    # Only possible when loading on top of existing data
+                    failed += len(e.details.get("writeErrors", []))
+                progress.advance(len(batch))
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.workers)]
+        for batch in generator.batches(args.batch_size):
+            await queue.put(batch)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        print(
+            f"Inserted {progress.done - failed:,} allocations ({failed:,} rejected) in {progress.elapsed():.1f}s: "
+            f"{progress.rate():,.0f} docs/s"
+        )
+
+        if args.defer_indexes:
+            started = time.perf_counter()
+            await create_indexes(db)
+            print(f"Built indexes in {time.perf_counter() - started:.1f}s")
+    finally:
+        client.close()
+
+
+def write_ndjson(args, generator: AllocationGenerator):
+    progress = Progress(generator.total)
+    with open(args.path, "w") as f:
+        for batch in generator.batches(args.batch_size):
+            f.write("".join(
+                json.dumps(dict(document, allocation_date=document["allocation_date"].date().isoformat())) + "\n"
+                for document in batch
+            ))
+            progress.advance(len(batch))
+    print(f"Wrote {progress.done:,} allocations to {args.path} in {progress.elapsed():.1f}s: {progress.rate():,.0f} docs/s")
+
+
+async def main(args):
+    generator = AllocationGenerator(args)
+    print(
+        f"Generating {generator.total:,} allocations over {args.days} days "
+        f"({args.vehicles:,} vehicles, {args.employees:,} employees, seed {args.seed})"
+    )
+    if args.sink == "ndjson":
+        write_ndjson(args, generator)
+    else:
+        await load_mongo(args, generator)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic allocations for performance testing")
+    parser.add_argument("--allocations", type=int, default=1_000_000, help="Target number of allocations")
+    parser.add_argument("--vehicles", type=int, default=10_000)
+    parser.add_argument("--employees", type=int, default=10_000)
+    parser.add_argument("--start-date", type=date.fromisoformat, default=date.today() - timedelta(days=365))
+    parser.add_argument("--days", type=int, default=730, help="Date span of the allocations")
+    parser.add_argument("--hot-vehicles", type=float, default=0.1, help="Fraction of vehicles that are hot")
+    parser.add_argument("--hot-share", type=float, default=0.5, help="Share of each date's allocations on hot vehicles")
+    parser.add_argument("--busy-dates", type=float, default=0.1, help="Fraction of dates that are busy")
+    parser.add_argument("--busy-factor", type=float, default=3.0, help="Load of a busy date relative to others")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sink", choices=["mongo", "ndjson"], default="mongo")
+    parser.add_argument("--path", default="allocations.ndjson", help="Output file for --sink ndjson")
+    parser.add_argument("--mongodb-url", default=settings.mongodb_url)
+    parser.add_argument("--database", default=settings.database_name)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent insert_many batches")
+    parser.add_argument("--defer-indexes", action="store_true", help="Drop indexes before loading, build them after")
+    parser.add_argument("--drop", action="store_true", help="Drop the allocations collection first")
+    parser.add_argument("--seed-entities", action="store_true", help="Also (re)create employees, vehicles and drivers")
+    asyncio.run(main(parser.parse_args()))
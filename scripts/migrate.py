@@ -0,0 +1,28 @@
+# Build the MongoDB indexes if they are behind app.database.INDEX_VERSION.
+# scripts.serve runs this once before starting workers; run it by hand before
+# rolling out a release that bumps INDEX_VERSION:
+#
+#   python -m scripts.migrate [--force]
+import argparse
+import asyncio
+import time
+from app.storage import close_store, get_store
+
+async def migrate(force: bool = False) -> bool:
+    store = await get_store()
+    try:
+        started = time.perf_counter()
+        if force:
+            await store.create_indexes()
+            created = True
+        else:
+            created = await store.ensure_indexes()
+        print(f"Indexes {'created' if created else 'already current'} in {time.perf_counter() - started:.2f}s")
+        return created
+    finally:
+        close_store()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create MongoDB indexes when they are out of date")
+    parser.add_argument("--force", action="store_true", help="Create the indexes even if the recorded version is current")
+    asyncio.run(migrate(parser.parse_args().force))
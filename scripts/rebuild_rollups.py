@@ -0,0 +1,17 @@
+# Recompute the utilization rollups from the allocations collection, e.g. after
+# enabling ROLLUPS_ENABLED on existing data or to repair drift:
+#
+#   python -m scripts.rebuild_rollups
+import asyncio
+import time
+from app.storage import get_store
+
+async def rebuild_rollups():
+    store = await get_store()
+    await store.create_indexes()
+    started = time.perf_counter()
+    count = await store.rebuild_rollups()
+    print(f"Rebuilt {count} rollup counters in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_rollups())
@@ -0,0 +1,38 @@
+# Production launcher: checks the indexes once, then starts --workers uvicorn
+# worker processes. Each worker's MongoDB pool is MONGO_CONNECTION_BUDGET
+# divided by the worker count, and workers skip the startup index check:
+#
+#   MONGO_CONNECTION_BUDGET=200 python -m scripts.serve --workers 4 --port 8000
+import argparse
+import asyncio
+import os
+import uvicorn
+from app.config import settings
+from scripts.migrate import migrate
+
+def serve(args):
+    asyncio.run(migrate())
+
+    # Read by every worker's Settings
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    os.environ["INDEX_CHECK_ON_STARTUP"] = "false"
+    settings.web_concurrency = args.workers
+    print(f"Starting {args.workers} workers with a MongoDB pool of {settings.worker_pool_size()} each")
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan="on",
+        proxy_headers=True,
+        timeout_graceful_shutdown=args.graceful_timeout
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the API with multiple worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.web_concurrency, help="Defaults to WEB_CONCURRENCY")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Seconds to finish in-flight requests on shutdown")
+    serve(parser.parse_args())
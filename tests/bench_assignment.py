@@ -0,0 +1,112 @@
+# tests/bench_assignment.py
+#
+# Times the assignment solver on one date: --requests employee requests
+# against a fleet of --vehicles with a share already booked, a mix of
+# unrestricted requests, requests limited to a vehicle class and requests
+# limited to a handful of vehicles, many with preferences on popular vehicles.
+# Reports the matching alone, then the full endpoint path (conflict query,
+# solve, one bulk commit):
+#
+#   python -m tests.bench_assignment --requests 5000 --vehicles 10000 [--backend memory]
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from app.models.schemas import AssignmentRequest
+from app.services.allocation import AllocationService
+from app.services.assignment import AssignmentService, match_requests, popcount
+from app.services.occupancy import OccupancyIndex
+from tests.bench_common import add_backend_argument, open_store
+
+
+def make_requests(args, allocation_date: date):
+    rng = random.Random(args.seed)
+    vehicles = list(range(1, args.vehicles + 1))
+    classes = [vehicles[i::args.classes] for i in range(args.classes)]
+    popular = rng.sample(vehicles, max(1, args.vehicles // 100))
+    requests = []
+    for i in range(args.requests):
+        kind = rng.random()
+        if kind < 0.5:
+            eligible = None
+        elif kind < 0.8:
+            eligible = rng.choice(classes)
+        else:
+            eligible = rng.sample(vehicles, rng.randint(5, 20))
+        pool = eligible or popular
+        preferred = rng.sample(pool, min(3, len(pool))) if rng.random() < 0.4 else []
+        requests.append(AssignmentRequest(
+            employee_id=100_000 + i,
+            allocation_date=allocation_date,
+            purpose=f"Bench {i}",
+            preferred_vehicle_ids=preferred,
+            eligible_vehicle_ids=eligible
+        ))
+    return requests
+
+
+async def main(args):
+    allocation_date = date.today() + timedelta(days=1)
+    requests = make_requests(args, allocation_date)
+
+    async with open_store(args.backend, 100, args.dataset) as store:
+        if hasattr(store, "add_vehicles"):
+            store.add_vehicles(range(1, args.vehicles + 1))
+        else:
+            await store.db.vehicles.insert_many([{"_id": i} for i in range(1, args.vehicles + 1)])
+
+        # Book a share of the fleet for other employees
+        rng = random.Random(args.seed + 1)
+        booked = rng.sample(range(1, args.vehicles + 1), int(args.vehicles * args.booked))
+        await store.insert_many([
+            {
+                "employee_id": i + 1,
+                "vehicle_id": vehicle_id,
+                "allocation_date": datetime.combine(allocation_date, datetime.min.time()),
+                "purpose": "Booked"
+            }
+            for i, vehicle_id in enumerate(booked)
+        ])
+
+        occupancy = OccupancyIndex()
+        free = await occupancy.free_mask(store, [datetime.combine(allocation_date, datetime.min.time())])
+        masks = {}
+        eligible = []
+        for request in requests:
+            if request.eligible_vehicle_ids is None:
+                eligible.append(free)
+                continue
+            key = tuple(request.eligible_vehicle_ids)
+            masks.setdefault(key, occupancy.to_mask(key))
+            eligible.append(masks[key] & free)
+        preferences = [occupancy.to_positions(request.preferred_vehicle_ids) for request in requests]
+
+        started = time.perf_counter()
+        vehicles = match_requests(eligible, preferences)
+        solved = time.perf_counter() - started
+        assigned = sum(1 for vehicle_id in vehicles if vehicle_id is not None)
+        print(
+            f"match      requests={len(requests)} vehicles={args.vehicles} free={popcount(free)} "
+            f"assigned={assigned} time={solved * 1000:.1f}ms"
+        )
+
+        service = AssignmentService(AllocationService(store, occupancy), occupancy)
+        started = time.perf_counter()
+        results = await service.assign(requests, dry_run=args.dry_run)
+        elapsed = time.perf_counter() - started
+        committed = sum(1 for result in results if result["status"] == "success")
+        print(f"endpoint   assigned={committed} dry_run={args.dry_run} time={elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vehicle assignment solver")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--vehicles", type=int, default=10000)
+    parser.add_argument("--booked", type=float, default=0.3, help="Share of the fleet already booked")
+    parser.add_argument("--classes", type=int, default=20, help="Vehicle classes requests can be limited to")
+    parser.add_argument("--dry-run", action="store_true", help="Solve without committing")
+    parser.add_argument("--seed", type=int, default=42)
+    add_backend_argument(parser)
+    asyncio.run(main(parser.parse_args()))
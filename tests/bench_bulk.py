@@ -0,0 +1,47 @@
+# tests/bench_bulk.py
+#
+# Compares booking a batch one create_allocation call at a time against a
+# single create_allocations_bulk call:
+#
+#   python -m tests.bench_bulk --items 10000 [--backend memory]
+import argparse
+import asyncio
+import time
+
+from app.services.allocation import AllocationService
+from tests.bench_common import add_backend_argument, make_payloads, open_store
+
+
+async def main(args):
+    payloads = make_payloads(args.items, args.seed)
+
+    async with open_store(args.backend, dataset=args.dataset) as store:
+        service = AllocationService(store)
+        started = time.perf_counter()
+        created = 0
+        for payload in payloads:
+            try:
+                await service.create_allocation(payload)
+                created += 1
+            except ValueError:
+                pass
+        loop_elapsed = time.perf_counter() - started
+        print(f"loop  items={len(payloads)} created={created} elapsed={loop_elapsed:.3f}s")
+
+    async with open_store(args.backend, dataset=args.dataset) as store:
+        service = AllocationService(store)
+        started = time.perf_counter()
+        results = await service.create_allocations_bulk(payloads)
+        bulk_elapsed = time.perf_counter() - started
+        created = sum(1 for result in results if result["status"] == "success")
+        print(f"bulk  items={len(payloads)} created={created} elapsed={bulk_elapsed:.3f}s")
+
+    print(f"speedup {loop_elapsed / bulk_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bulk allocation creates")
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    add_backend_argument(parser)
+    asyncio.run(main(parser.parse_args()))
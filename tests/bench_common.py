@@ -0,0 +1,87 @@
+# tests/bench_common.py
+#
+# Shared helpers for the benchmark scripts: every benchmark can run against
+# MongoDB (a scratch database on the configured server) or, with
+# --backend memory, fully offline against the in-memory engine. --dataset
+# preloads an NDJSON file from scripts/generate_data.py so the benchmark runs
+# against production-sized indexes.
+import json
+import random
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.config import settings
+from app.models.schemas import AllocationCreate
+from app.storage import AllocationStore, MemoryAllocationStore, MongoAllocationStore
+
+
+def add_backend_argument(parser):
+    parser.add_argument("--backend", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument("--dataset", help="NDJSON allocations to preload (scripts/generate_data.py --sink ndjson)")
+
+
+async def load_dataset(store: AllocationStore, path: str, batch_size: int = 10000) -> int:
+    loaded = 0
+    batch = []
+    with open(path) as f:
+        for line in f:
+            document = json.loads(line)
+            document["allocation_date"] = datetime.fromisoformat(document["allocation_date"])
+            batch.append(document)
+            if len(batch) == batch_size:
+                await store.insert_many(batch)
+                loaded += len(batch)
+                batch = []
+    if batch:
+        await store.insert_many(batch)
+        loaded += len(batch)
+    return loaded
+
+
+@asynccontextmanager
+async def open_store(backend: str, max_pool_size: int = 100, dataset: str = None):
+    # Yields a fresh, indexed store, empty unless a dataset is given; the mongo
+    # one is dropped afterwards
+    if backend == "memory":
+        store = MemoryAllocationStore(range(1, 10001))
+        await store.create_indexes()
+        if dataset:
+            print(f"Preloaded {await load_dataset(store, dataset):,} allocations")
+        yield store
+        return
+
+    client = AsyncIOMotorClient(settings.mongodb_url, maxPoolSize=max_pool_size)
+    db = client[f"{settings.database_name}_bench"]
+    try:
+        await db.allocations.drop()
+        store = MongoAllocationStore(db)
+        await store.create_indexes()
+        if dataset:
+            print(f"Preloaded {await load_dataset(store, dataset):,} allocations")
+        yield store
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+def make_payloads(count: int, seed: int):
+    # Mostly unique bookings with a small share of deliberate conflicts
+    rng = random.Random(seed)
+    today = date.today()
+    payloads = []
+    for i in range(count):
+        payloads.append(AllocationCreate(
+            employee_id=rng.randint(1, 1000) if rng.random() < 0.05 else 1000 + i,
+            vehicle_id=rng.randint(1, 1000) if rng.random() < 0.05 else 1000 + i,
+            allocation_date=today + timedelta(days=rng.randint(1, 30)),
+            purpose=f"Bench {i}"
+        ))
+    return payloads
+
+
+def percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,94 @@
+# tests/bench_create.py
+#
+# Compares the legacy four-round-trip create path, the single-insert path, the
+# single path with utilization rollups (ROLLUPS_ENABLED, on in the app by
+# default: one more round trip per create) and coalesced creates (batched
+# through one conflict query and insert_many) under concurrent creates:
+#
+#   python -m tests.bench_create --requests 5000 --concurrency 50 [--backend memory]
+import argparse
+import asyncio
+import time
+from datetime import date, datetime
+
+from app.models.schemas import AllocationCreate
+from app.services.allocation import AllocationService
+from app.services.coalescer import CreateCoalescer
+from app.storage import AllocationStore
+from tests.bench_common import add_backend_argument, make_payloads, open_store, percentile
+
+
+async def legacy_create_allocation(store: AllocationStore, allocation: AllocationCreate) -> dict:
+    # The pre-index create path: two conflict reads, an insert and a read back
+    allocation_date = datetime.combine(allocation.allocation_date, datetime.min.time())
+    vehicle_conflicts = await store.find_conflicts([(allocation.vehicle_id, None, allocation_date)])
+    if any(c["vehicle_id"] == allocation.vehicle_id for c in vehicle_conflicts):
+        raise ValueError("Vehicle already allocated for this date")
+    employee_conflicts = await store.find_conflicts([(None, allocation.employee_id, allocation_date)])
+    if any(c["employee_id"] == allocation.employee_id for c in employee_conflicts):
+        raise ValueError("This employee already has allocated a vehicle for themselves at this date")
+    if allocation.allocation_date <= date.today():
+        raise ValueError("Allocation date must be in the future")
+    allocation_dict = allocation.model_dump()
+    allocation_dict["allocation_date"] = allocation_date
+    inserted_id = await store.insert(allocation_dict)
+    allocation_data = await store.find_by_id(inserted_id)
+    allocation_data["_id"] = str(allocation_data["_id"])
+    return allocation_data
+
+
+async def run_path(name, create, payloads, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    conflicts = 0
+
+    async def one(payload):
+        nonlocal conflicts
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await create(payload)
+            except ValueError:
+                conflicts += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in payloads))
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{name:<10} requests={len(payloads)} conflicts={conflicts} "
+        f"throughput={len(payloads) / elapsed:,.0f}/s "
+        f"p50={percentile(latencies, 50) * 1000:.2f}ms p99={percentile(latencies, 99) * 1000:.2f}ms"
+    )
+
+
+async def main(args):
+    payloads = make_payloads(args.requests, args.seed)
+
+    async with open_store(args.backend, args.concurrency, args.dataset) as store:
+        await run_path("legacy", lambda p: legacy_create_allocation(store, p), payloads, args.concurrency)
+
+    async with open_store(args.backend, args.concurrency, args.dataset) as store:
+        service = AllocationService(store)
+        await run_path("single", service.create_allocation, payloads, args.concurrency)
+
+    async with open_store(args.backend, args.concurrency, args.dataset) as store:
+        service = AllocationService(store, rollups=True)
+        await run_path("rollups", service.create_allocation, payloads, args.concurrency)
+
+    async with open_store(args.backend, args.concurrency, args.dataset) as store:
+        service = AllocationService(store)
+        coalescer = CreateCoalescer(args.window_ms / 1000, args.max_batch)
+        await run_path("coalesced", lambda p: coalescer.submit(service, p), payloads, args.concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark allocation create round trips")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--window-ms", type=float, default=2, help="Coalescing flush window")
+    parser.add_argument("--max-batch", type=int, default=256, help="Coalescing batch size")
+    add_backend_argument(parser)
+    asyncio.run(main(parser.parse_args()))
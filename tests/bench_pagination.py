@@ -0,0 +1,72 @@
+# tests/bench_pagination.py
+#
+# Measures history page latency at increasing depths with skip and with
+# keyset cursors:
+#
+#   python -m tests.bench_pagination --rows 500000 --limit 10 [--backend memory]
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from app.services.allocation import AllocationService
+from app.services.pagination import encode_cursor
+from app.storage import HistoryQuery
+from tests.bench_common import add_backend_argument, open_store
+
+
+async def seed(store, rows: int):
+    start = datetime(2030, 1, 1)
+    batch = []
+    for i in range(rows):
+        batch.append({
+            "employee_id": i,
+            "vehicle_id": i,
+            "allocation_date": start + timedelta(days=i % 3650),
+            "purpose": "Bench"
+        })
+        if len(batch) == 10000:
+            await store.insert_many(batch)
+            batch = []
+    if batch:
+        await store.insert_many(batch)
+
+
+async def timed(coro_factory, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await coro_factory()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def main(args):
+    async with open_store(args.backend, dataset=args.dataset) as store:
+        service = AllocationService(store)
+        await seed(store, args.rows)
+
+        print(f"{'page':>8} {'skip ms':>10} {'cursor ms':>10}")
+        page = 1
+        while (page - 1) * args.limit < args.rows:
+            skip = (page - 1) * args.limit
+            skip_time = await timed(lambda: service.get_allocation_history(skip=skip, limit=args.limit), args.repeats)
+
+            # Build the cursor for this depth directly (setup cost, not measured)
+            cursor = None
+            if skip:
+                previous = (await store.find(HistoryQuery(skip=skip - 1, limit=1)))[0]
+                cursor = encode_cursor("allocation_date", -1, previous["allocation_date"], previous["_id"])
+            cursor_time = await timed(lambda: service.get_allocation_history(limit=args.limit, cursor=cursor), args.repeats)
+
+            print(f"{page:>8} {skip_time * 1000:>10.2f} {cursor_time * 1000:>10.2f}")
+            page *= 10
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark deep history pages: skip vs cursor")
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    add_backend_argument(parser)
+    asyncio.run(main(parser.parse_args()))
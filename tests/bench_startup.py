@@ -0,0 +1,153 @@
+# tests/bench_startup.py
+#
+# Measures worker startup time and steady-state RSS per worker.
+#
+# By default it starts the production launcher (scripts.serve) with --workers
+# worker processes and reports:
+# - the time until the first request succeeds;
+# - each worker's RSS after startup and again after --requests warm-up
+#   requests spread over the workers;
+# - the time the workers take to shut down on SIGINT.
+#
+# --in-process times the import of app.main and the lifespan startup in this
+# process, and reports this process's RSS; it needs no server or uvicorn.
+#
+#   python -m tests.bench_startup --workers 4 [--storage memory]
+#   python -m tests.bench_startup --in-process [--storage memory]
+#
+# RSS is read from /proc, so this runs on Linux only.
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+PROBE_PATH = "/api/v1/allocations/?limit=1"
+
+
+def rss_mb(pid) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def worker_pids(launcher: int):
+    # uvicorn's worker processes: the launcher's children that run the app
+    # (not the multiprocessing resource tracker)
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == launcher and b"resource_tracker" not in cmdline:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+async def warm_up(base_url: str, requests: int, concurrency: int):
+    # New connections for every request, so the kernel spreads them over the workers
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            async with httpx.AsyncClient(base_url=base_url) as client:
+                await client.get(PROBE_PATH)
+    await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def print_rss(label: str, pids):
+    values = [rss_mb(pid) for pid in pids]
+    if values:
+        print(
+            f"{label:<18} workers={len(values)} rss_mb per worker: "
+            f"min={min(values):.1f} mean={sum(values) / len(values):.1f} max={max(values):.1f}"
+        )
+
+
+def run_server(args):
+    env = dict(os.environ, STORAGE_BACKEND=args.storage)
+    base_url = f"http://127.0.0.1:{args.port}"
+    started = time.perf_counter()
+    launcher = subprocess.Popen(
+        [sys.executable, "-m", "scripts.serve", "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers)],
+        env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL
+    )
+    try:
+        while True:
+            if launcher.poll() is not None:
+                sys.exit(f"Launcher exited with {launcher.returncode}")
+            try:
+                if httpx.get(base_url + PROBE_PATH, timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+        print(f"first response after {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        # Give the remaining workers time to finish their own startup
+        time.sleep(args.settle)
+        # A single worker runs in the launcher process itself
+        pids = worker_pids(launcher.pid) or [launcher.pid]
+        print(f"launcher rss_mb={rss_mb(launcher.pid):.1f}")
+        print_rss("after startup", pids)
+        asyncio.run(warm_up(base_url, args.requests, args.concurrency))
+        print_rss("steady state", pids)
+
+        stopping = time.perf_counter()
+        launcher.send_signal(signal.SIGINT)
+        launcher.wait(timeout=60)
+        print(f"shutdown in {(time.perf_counter() - stopping) * 1000:.0f} ms")
+    finally:
+        if launcher.poll() is None:
+            launcher.kill()
+
+
+async def run_in_process(args):
+    os.environ["STORAGE_BACKEND"] = args.storage
+    before = rss_mb("self")
+    started = time.perf_counter()
+    from app.main import app
+    imported = time.perf_counter()
+    print(f"import app.main   {(imported - started) * 1000:.0f} ms, rss_mb {before:.1f} -> {rss_mb('self'):.1f}")
+
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        print(f"lifespan startup  {(ready - imported) * 1000:.0f} ms, rss_mb={rss_mb('self'):.1f}")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            for _ in range(args.requests):
+                await client.get(PROBE_PATH)
+        print(f"steady state      rss_mb={rss_mb('self'):.1f} after {args.requests} requests")
+        stopping = time.perf_counter()
+    print(f"lifespan shutdown {(time.perf_counter() - stopping) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure worker startup time and RSS")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--storage", choices=["mongo", "memory"], default="mongo", help="STORAGE_BACKEND of the app")
+    parser.add_argument("--requests", type=int, default=2000, help="Warm-up requests before the steady-state RSS")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--settle", type=float, default=2, help="Seconds to wait for every worker after the first response")
+    parser.add_argument("--verbose", action="store_true", help="Show the server's output")
+    parser.add_argument("--in-process", action="store_true", help="Time import and lifespan in this process, without a server")
+    args = parser.parse_args()
+    if args.in_process:
+        asyncio.run(run_in_process(args))
+    else:
+        run_server(args)
@@ -0,0 +1,141 @@
+# tests/bench_update.py
+#
+# Compares the legacy read-check-write-read update and delete paths with the
+# single conditional find_one_and_update / find_one_and_delete, reporting
+# store round trips per request alongside throughput and latency:
+#
+#   python -m tests.bench_update --requests 5000 --concurrency 50 [--backend memory]
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, datetime
+
+from bson import ObjectId
+
+from app.models.schemas import AllocationUpdate
+from app.services.allocation import AllocationService
+from app.storage import AllocationStore
+from tests.bench_common import add_backend_argument, make_payloads, open_store, percentile
+
+
+class RoundTripCounter:
+    # Proxy counting every awaited store call; each one is a round trip to MongoDB
+    def __init__(self, store: AllocationStore):
+        self._store = store
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._store, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        async def counted(*args, **kwargs):
+            self.calls += 1
+            return await attribute(*args, **kwargs)
+        return counted
+
+
+async def legacy_update_allocation(store, allocation_id: str, update_data: AllocationUpdate) -> dict:
+    # The pre-find_one_and_update path: read, conflict reads, update, read back
+    allocation = await store.find_by_id(ObjectId(allocation_id))
+    if not allocation:
+        raise ValueError("Allocation not found")
+    if allocation["allocation_date"].date() <= date.today():
+        raise ValueError("Cannot update past allocations")
+    update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
+    if update_data.vehicle_id and update_data.vehicle_id != allocation["vehicle_id"]:
+        conflicts = await store.find_conflicts([(update_data.vehicle_id, None, allocation["allocation_date"])])
+        if any(c["vehicle_id"] == update_data.vehicle_id for c in conflicts):
+            raise ValueError("Vehicle already allocated for this date")
+    if update_data.employee_id and update_data.employee_id != allocation["employee_id"]:
+        conflicts = await store.find_conflicts([(None, update_data.employee_id, allocation["allocation_date"])])
+        if any(c["employee_id"] == update_data.employee_id for c in conflicts):
+            raise ValueError("This employee already has allocated a vehicle for themselves at this date")
+    await store.update(ObjectId(allocation_id), update_dict)
+    return await store.find_by_id(ObjectId(allocation_id))
+
+
+async def legacy_delete_allocation(store, allocation_id: str):
+    allocation = await store.find_by_id(ObjectId(allocation_id))
+    if not allocation:
+        raise ValueError("Allocation not found")
+    if allocation["allocation_date"].date() <= date.today():
+        raise ValueError("Cannot delete past allocations")
+    await store.delete(ObjectId(allocation_id))
+
+
+async def seed(store: AllocationStore, count: int, seed: int):
+    # count future allocations to update, with unique vehicles and employees
+    documents = []
+    for payload in make_payloads(count, seed):
+        document = payload.model_dump()
+        document["allocation_date"] = datetime.combine(payload.allocation_date, datetime.min.time())
+        documents.append(document)
+    failed = await store.insert_many(documents)
+    return [str(document["_id"]) for position, document in enumerate(documents) if position not in failed]
+
+
+def make_updates(ids, seed: int):
+    # Half purpose-only, half a vehicle move (a tenth onto the shared ids 1..1000, which may be taken)
+    rng = random.Random(seed)
+    updates = []
+    for i, allocation_id in enumerate(ids):
+        if rng.random() < 0.5:
+            updates.append((allocation_id, AllocationUpdate(purpose=f"Updated {i}")))
+        else:
+            vehicle_id = rng.randint(1, 1000) if rng.random() < 0.1 else 100_000 + i
+            updates.append((allocation_id, AllocationUpdate(vehicle_id=vehicle_id)))
+    return updates
+
+
+async def run_path(name, call, items, concurrency: int, counter: RoundTripCounter):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(item):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call(*item)
+            except ValueError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    counter.calls = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(one(item) for item in items))
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{name:<22} requests={len(items)} errors={errors} "
+        f"round_trips/request={counter.calls / len(items):.2f} "
+        f"throughput={len(items) / elapsed:,.0f}/s "
+        f"p50={percentile(latencies, 50) * 1000:.2f}ms p99={percentile(latencies, 99) * 1000:.2f}ms"
+    )
+
+
+async def main(args):
+    for name, atomic in (("legacy", False), ("find_one_and_*", True)):
+        async with open_store(args.backend, args.concurrency, args.dataset) as store:
+            ids = await seed(store, args.requests, args.seed)
+            counter = RoundTripCounter(store)
+            service = AllocationService(counter)
+            if atomic:
+                update, delete = service.update_allocation, service.delete_allocation
+            else:
+                update = lambda *item: legacy_update_allocation(counter, *item)
+                delete = lambda allocation_id: legacy_delete_allocation(counter, allocation_id)
+            await run_path(f"{name} update", update, make_updates(ids, args.seed), args.concurrency, counter)
+            await run_path(f"{name} delete", delete, [(allocation_id,) for allocation_id in ids], args.concurrency, counter)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark allocation update and delete round trips")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    add_backend_argument(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,8 @@
+import os
+
+# The service tests run against the in-memory engine; Settings still needs a
+# MongoDB URL and database name to import
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DATABASE_NAME", "vehicle_allocation_test")
+# The API tests run the app against the in-memory engine too
+os.environ.setdefault("STORAGE_BACKEND", "memory")
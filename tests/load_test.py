@@ -1,176 +1,354 @@
-# from locust import HttpUser, task, between
-
-# class VehicleAllocationUser(HttpUser):
-#     wait_time = between(1, 3)
-
-#     @task
-#     def create_allocation(self):
-#         self.client.post("/api/v1/allocations/", json={
-#             "employee_id": 1,
-#             "vehicle_id": 1,
-#             "allocation_date": "2024-12-01",
-#             "purpose": "Test"
-#         })
-
 # tests/load_test.py
+#
+# Open-loop, scenario-driven load generator for the allocation API.
+#
+# Requests are issued on a fixed arrival schedule (--rate per second) whether
+# or not earlier ones have finished, and latency is measured from each
+# request's intended start time, so a stalled server shows up in the tail
+# instead of silently slowing the load down (coordinated omission). Latencies
+# go into per-endpoint, per-status log-linear histograms with constant memory.
+#
+#   python -m tests.load_test --rate 200 --duration 60 --warmup 10
+#   python -m tests.load_test --sweep 50,100,200,400,800 --duration 20
+#   python -m tests.load_test --in-process --backend memory --rate 500
+#   python -m tests.load_test --in-process --pool-size 10 --sweep 100,400 [--no-admission]
+#
+# --in-process drives app.main:app through httpx's ASGI transport, so no
+# server or network is needed. The JSON report (--output) is stable and can be
+# diffed between runs.
+import argparse
 import asyncio
-import aiohttp
-import time
-from datetime import datetime, timedelta
-import random
-from concurrent.futures import ThreadPoolExecutor
-import statistics
 import json
+import random
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+# Log-linear buckets: values below 2**SUB_BUCKET_BITS microseconds are exact,
+# larger ones keep SUB_BUCKET_BITS - 1 significant bits (< 1% relative error)
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+REPORTED_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts: Dict[int, int] = {}  # Bucket index -> count; bounded by the value range
+        self.total = 0
+        self.sum_us = 0
+        self.min_us: Optional[int] = None
+        self.max_us = 0
+
+    @staticmethod
+    def _index(value_us: int) -> int:
+        if value_us < (1 << SUB_BUCKET_BITS):
+            return value_us
+        shift = value_us.bit_length() - SUB_BUCKET_BITS
+        return (shift << (SUB_BUCKET_BITS - 1)) + (value_us >> shift)
+
+    @staticmethod
+    def _upper_bound(index: int) -> int:
+        if index < (1 << SUB_BUCKET_BITS):
+            return index
+        shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+        mantissa = index - (shift << (SUB_BUCKET_BITS - 1))
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        value_us = max(0, int(seconds * 1_000_000))
+        index = self._index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum_us += value_us
+        self.min_us = value_us if self.min_us is None else min(self.min_us, value_us)
+        self.max_us = max(self.max_us, value_us)
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+
+    def percentile(self, q: float) -> int:
+        if not self.total:
+            return 0
+        rank = max(1, int(round(q / 100 * self.total)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max_us)
+        return self.max_us
+
+    def summary(self) -> dict:
+        # Milliseconds, rounded so reports diff cleanly
+        summary = {
+            "count": self.total,
+            "min_ms": round((self.min_us or 0) / 1000, 3),
+            "mean_ms": round(self.sum_us / self.total / 1000, 3) if self.total else 0,
+            "max_ms": round(self.max_us / 1000, 3)
+        }
+        for q in REPORTED_PERCENTILES:
+            summary[f"p{q:g}_ms"] = round(self.percentile(q) / 1000, 3)
+        return summary
+
+
+class EmulatedPool:
+    # Stands in for the Motor pool in --in-process runs: every awaited store
+    # call holds one of pool_size connections for db_latency seconds, and a call
+    # that waits wait_timeout for one fails with WaitQueueTimeoutError, as with
+    # maxPoolSize / waitQueueTimeoutMS. Checkout waits are reported to the
+    # admission controller like the pool listener does.
+    def __init__(self, store, pool_size: int, db_latency: float, wait_timeout: float):
+        from app.admission import admission_controller
+        self._store = store
+        self._connections = asyncio.Semaphore(pool_size)
+        self._db_latency = db_latency
+        self._wait_timeout = wait_timeout
+        self._controller = admission_controller
+
+    def __getattr__(self, name):
+        attribute = getattr(self._store, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        async def pooled(*args, **kwargs):
+            from pymongo.errors import WaitQueueTimeoutError
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._connections.acquire(), self._wait_timeout)
+            except asyncio.TimeoutError:
+                self._controller.observe_pool_wait(self._wait_timeout)
+                raise WaitQueueTimeoutError("Timed out waiting for a pooled connection")
+            self._controller.observe_pool_wait(time.perf_counter() - started)
+            try:
+                await asyncio.sleep(self._db_latency)
+                return await attribute(*args, **kwargs)
+            finally:
+                self._connections.release()
+        return pooled
+
+
+# Scenario steps build (endpoint label, method, path, params, json body)
+Request = Tuple[str, str, str, Optional[dict], Optional[dict]]
+
 
-class VehicleAllocationLoadTest:
-    def __init__(self, base_url: str, num_users: int, test_duration: int):
-        self.base_url = base_url
-        self.num_users = num_users
-        self.test_duration = test_duration
-        self.results = []
-        self.errors = []
-        self.success_count = 0
-        self.fail_count = 0
-        
-    async def make_request(self, session, endpoint: str, method: str = "GET", data: dict = None):
-        start_time = time.time()
+def create_step(rng: random.Random) -> Request:
+    future_date = date.today() + timedelta(days=rng.randint(1, 365))
+    return ("POST /api/v1/allocations/", "POST", "/api/v1/allocations/", None, {
+        "employee_id": rng.randint(1, 1000),
+        "vehicle_id": rng.randint(1, 1000),
+        "allocation_date": future_date.isoformat(),
+        "purpose": f"Load test {rng.randint(1, 1000)}"
+    })
+
+
+def list_step(rng: random.Random) -> Request:
+    return ("GET /api/v1/allocations/", "GET", "/api/v1/allocations/", {"limit": 10}, None)
+
+
+def history_step(rng: random.Random) -> Request:
+    params = {"limit": 10}
+    if rng.random() < 0.5:
+        params["employee_id"] = rng.randint(1, 1000)
+    if rng.random() < 0.3:
+        params["vehicle_id"] = rng.randint(1, 1000)
+    return ("GET /api/v1/allocations/history", "GET", "/api/v1/allocations/history", params, None)
+
+
+def availability_step(rng: random.Random) -> Request:
+    start = date.today() + timedelta(days=rng.randint(1, 60))
+    return ("GET /api/v1/vehicles/available", "GET", "/api/v1/vehicles/available", {
+        "start_date": start.isoformat(),
+        "end_date": (start + timedelta(days=rng.randint(0, 29))).isoformat()
+    }, None)
+
+
+# Weighted request mixes
+SCENARIOS: Dict[str, List[Tuple[Callable[[random.Random], Request], int]]] = {
+    "mixed": [(create_step, 1), (list_step, 1), (history_step, 1)],
+    "writes": [(create_step, 1)],
+    "reads": [(list_step, 1), (history_step, 2), (availability_step, 1)]
+}
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, scenario: str, seed: int, max_in_flight: int, timeout: float):
+        self.client = client
+        self.steps = [step for step, _ in SCENARIOS[scenario]]
+        self.weights = [weight for _, weight in SCENARIOS[scenario]]
+        self.rng = random.Random(seed)
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+
+    async def _fire(self, request: Request, intended: float, results: Optional[dict]):
+        label, method, path, params, body = request
+        sent = time.perf_counter()
         try:
-            if method == "GET":
-                async with session.get(f"{self.base_url}{endpoint}") as response:
-                    response_data = await response.json()
-                    if response.status == 200:
-                        self.success_count += 1
-                    else:
-                        self.fail_count += 1
-                        self.errors.append({
-                            "endpoint": endpoint,
-                            "method": method,
-                            "data": None,
-                            "status": response.status,
-                            "response_data": response_data
-                        })
-            elif method == "POST":
-                async with session.post(f"{self.base_url}{endpoint}", json=data) as response:
-                    response_data = await response.json()
-                    if response.status == 200:
-                        self.success_count += 1
-                    else:
-                        self.fail_count += 1
-                        self.errors.append({
-                            "endpoint": endpoint,
-                            "method": method,
-                            "data": data,
-                            "status": response.status,
-                            "response_data": response_data
-                        })
-            
-            end_time = time.time()
-            if response.status == 200:
-                self.results.append(end_time - start_time)  # Only log successful responses
-            return True
-        except Exception as e:
-            self.fail_count += 1
-            self.errors.append({
-                "endpoint": endpoint,
-                "method": method,
-                "data": data,
-                "error_message": str(e)
-            })
-            print(f"Error: {e}")
-            return False
-
-    async def simulate_user(self, user_id: int):
-        async with aiohttp.ClientSession() as session:
-            start_time = time.time()
-            
-            while time.time() - start_time < self.test_duration:
-                # Random allocation date in the future
-                future_date = datetime.now() + timedelta(days=random.randint(1, 30))
-                
-                # Create allocation
-                allocation_data = {
-                    "employee_id": random.randint(1, 100),
-                    "vehicle_id": random.randint(1, 50),
-                    "allocation_date": future_date.strftime("%Y-%m-%d"),
-                    "purpose": f"Test purpose {random.randint(1, 1000)}"
-                }
-                
-                await self.make_request(
-                    session,
-                    "/api/v1/allocations/",
-                    method="POST",
-                    data=allocation_data
-                )
-                
-                # Get allocations list
-                await self.make_request(
-                    session,
-                    "/api/v1/allocations/"
-                )
-                
-                # Get allocation history with random filters
-                params = {
-                    "employee_id": random.randint(1, 999),
-                    "vehicle_id": random.randint(1, 999),
-                    "skip": random.randint(0, 50),
-                    "limit": 10
-                }
-                query_string = "&".join(f"{k}={v}" for k, v in params.items())
-                await self.make_request(
-                    session,
-                    f"/api/v1/allocations/history?{query_string}"
-                )
-                
-                # Small delay between requests
-                await asyncio.sleep(random.uniform(0.1, 0.5))
-
-    async def run(self):
-        tasks = [self.simulate_user(i) for i in range(self.num_users)]
-        await asyncio.gather(*tasks)
-        
-        # Calculate statistics
-        if self.results:
-            avg_response_time = statistics.mean(self.results)
-            p95_response_time = statistics.quantiles(self.results, n=20)[18]  # 95th percentile
-            p99_response_time = statistics.quantiles(self.results, n=100)[98]  # 99th percentile
-            success_rate = (self.success_count / (self.success_count + self.fail_count)) * 100
-            
-            # Log results to a JSON file
-            test_summary = {
-                "Total Requests": len(self.results) + len(self.errors),
-                "Successful Requests": self.success_count,
-                "Failed Requests": self.fail_count,
-                "Success Rate": f"{success_rate:.2f}%",
-                "Average Response Time": f"{avg_response_time:.3f} seconds",
-                "95th Percentile Response Time": f"{p95_response_time:.3f} seconds",
-                "99th Percentile Response Time": f"{p99_response_time:.3f} seconds",
-                "Requests per Second": f"{(len(self.results) + len(self.errors)) / self.test_duration:.2f}",
-                "Errors": self.errors
+            response = await asyncio.wait_for(
+                self.client.request(method, path, params=params, json=body), self.timeout
+            )
+            status = str(response.status_code)
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except Exception:
+            status = "error"
+        done = time.perf_counter()
+        if results is not None:
+            latency, service = results.setdefault((label, status), (LatencyHistogram(), LatencyHistogram()))
+            latency.record(done - intended)  # From the scheduled start: no coordinated omission
+            service.record(done - sent)  # From the actual send, for comparison
+
+    async def run_phase(self, rate: float, duration: float, warmup: float) -> dict:
+        results: Dict[Tuple[str, str], Tuple[LatencyHistogram, LatencyHistogram]] = {}
+        in_flight = set()
+        dropped = 0
+        scheduled = 0
+        start = time.perf_counter()
+        measure_from = start + warmup
+        stop = measure_from + duration
+
+        i = 0
+        while True:
+            intended = start + i / rate
+            if intended >= stop:
+                break
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            i += 1
+            request = self.rng.choices(self.steps, self.weights)[0](self.rng)
+            measured = intended >= measure_from
+            if len(in_flight) >= self.max_in_flight:
+                # The client itself is saturated; count it rather than queueing forever
+                if measured:
+                    dropped += 1
+                continue
+            if measured:
+                scheduled += 1
+            task = asyncio.create_task(self._fire(request, intended, results if measured else None))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        elapsed = time.perf_counter() - measure_from
+
+        overall = LatencyHistogram()
+        successful = LatencyHistogram()
+        endpoints: Dict[str, Dict[str, dict]] = {}
+        shed = 0
+        for (label, status), (latency, service) in sorted(results.items()):
+            endpoints.setdefault(label, {})[status] = {
+                "latency": latency.summary(),
+                "service_time": service.summary()
             }
-            
-            with open("load_test_results.json", "w") as f:
-                json.dump(test_summary, f, indent=4)
-                
-            print(f"\nLoad Test Results:")
-            print(f"Total Requests: {len(self.results) + len(self.errors)}")
-            print(f"Successful Requests: {self.success_count}")
-            print(f"Failed Requests: {self.fail_count}")
-            print(f"Success Rate: {success_rate:.2f}%")
-            print(f"Average Response Time: {avg_response_time:.3f} seconds")
-            print(f"95th Percentile Response Time: {p95_response_time:.3f} seconds")
-            print(f"99th Percentile Response Time: {p99_response_time:.3f} seconds")
-            print(f"Requests per Second: {(len(self.results) + len(self.errors)) / self.test_duration:.2f}")
+            overall.merge(latency)
+            if status.startswith("2"):
+                successful.merge(latency)
+            elif status in ("429", "503"):
+                # Rejected by admission control
+                shed += latency.total
+        completed = successful.total
+
+        return {
+            "target_rate": rate,
+            "duration_s": duration,
+            "warmup_s": warmup,
+            "scheduled": scheduled,
+            "dropped": dropped,
+            "successful": completed,
+            "shed": shed,
+            "achieved_throughput": round(completed / elapsed, 2) if elapsed > 0 else 0,
+            "latency": overall.summary(),
+            "successful_latency": successful.summary(),
+            "endpoints": endpoints
+        }
+
+
+def build_client(args) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    if not args.in_process:
+        return httpx.AsyncClient(base_url=args.base_url, limits=limits)
+
+    # Drive the ASGI app directly: no server, no network
+    from app.config import settings
+    settings.storage_backend = args.backend
+    settings.admission_enabled = args.admission
+    from app.main import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver", limits=limits)
+
+
+async def main(args):
+    rates = [float(rate) for rate in args.sweep.split(",")] if args.sweep else [args.rate]
+    async with build_client(args) as client:
+        if args.in_process:
+            # ASGITransport does not run startup handlers
+            import app.storage
+            store = await app.storage.get_store()
+            await store.create_indexes()
+            if args.pool_size:
+                app.storage._store = EmulatedPool(store, args.pool_size, args.db_latency / 1000, args.pool_timeout)
+
+        load_test = LoadTest(client, args.scenario, args.seed, args.max_in_flight, args.timeout)
+        runs = []
+        for rate in rates:
+            print(f"Running {args.scenario} at {rate:g} req/s for {args.duration:g}s (+{args.warmup:g}s warm-up)...")
+            run = await load_test.run_phase(rate, args.duration, args.warmup)
+            runs.append(run)
+            latency = run["latency"]
+            print(
+                f"  throughput={run['achieved_throughput']}/s successful={run['successful']} shed={run['shed']} "
+                f"dropped={run['dropped']} p50={latency['p50_ms']}ms p99={latency['p99_ms']}ms "
+                f"p99.9={latency['p99.9_ms']}ms successful_p99={run['successful_latency']['p99_ms']}ms"
+            )
+
+    report = {
+        "config": {
+            "scenario": args.scenario,
+            "target": "in-process" if args.in_process else args.base_url,
+            "backend": args.backend if args.in_process else None,
+            "admission": args.admission if args.in_process else None,
+            "emulated_pool": {
+                "size": args.pool_size, "db_latency_ms": args.db_latency, "timeout_s": args.pool_timeout
+            } if args.in_process and args.pool_size else None,
+            "seed": args.seed,
+            "rates": rates,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup
+        },
+        "runs": runs
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Report written to {args.output}")
+
 
 if __name__ == "__main__":
-    base_url = "http://localhost:8000"  # Change this to your API URL
-    num_concurrent_users = 50
-    test_duration_seconds = 60
-    
-    load_test = VehicleAllocationLoadTest(
-        base_url=base_url,
-        num_users=num_concurrent_users,
-        test_duration=test_duration_seconds
+    parser = argparse.ArgumentParser(description="Open-loop load test for the allocation API")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--in-process", action="store_true", help="Drive app.main:app without a server")
+    parser.add_argument("--backend", choices=["mongo", "memory"], default="memory", help="Storage for --in-process")
+    parser.add_argument(
+        "--no-admission", dest="admission", action="store_false",
+        help="Disable admission control for --in-process, to compare overload behaviour"
     )
-    
-    print(f"Starting load test with {num_concurrent_users} concurrent users for {test_duration_seconds} seconds...")
-    asyncio.run(load_test.run())
+    parser.add_argument("--pool-size", type=int, default=0, help="Emulate a MongoDB pool of this size for --in-process")
+    parser.add_argument("--db-latency", type=float, default=10, help="Milliseconds per store call with --pool-size")
+    parser.add_argument("--pool-timeout", type=float, default=5, help="Pool wait queue timeout in seconds with --pool-size")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--rate", type=float, default=100, help="Arrivals per second")
+    parser.add_argument("--sweep", help="Comma-separated rates for a latency-vs-throughput sweep")
+    parser.add_argument("--duration", type=float, default=60, help="Measured seconds per rate")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds before each rate")
+    parser.add_argument("--max-in-flight", type=int, default=10000)
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="load_test_results.json")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,692 @@
+import asyncio
+import contextvars
+import random
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, WriteConcernError
+
+from app.admission import READ, SCAN, WRITE, AdmissionController
+from app.config import Settings, settings
+from app.metrics import ROLLUP_WRITE_FAILURES
+from app.models.schemas import AllocationCreate, AllocationSeriesCreate, AllocationUpdate, AssignmentRequest
+from app.profiling import Profiler, RequestCapture, command_shape, normalize_query
+from app.services.allocation import AllocationService, SeriesConflictError
+from app.services.assignment import AssignmentService, ids_to_mask, match_requests
+from app.services.cache import AllocationCache, history_filter_key
+from app.services.coalescer import CreateCoalescer
+from app.services import feed
+from app.services.feed import ChangeBroker, ChangeStreamSource, LocalChangeSource
+from app.services.occupancy import OccupancyIndex, mask_to_ids
+from app.services.pagination import next_cursor
+from app.services.registry import EntityRegistry
+from app.services.versions import VersionTracker
+from app.storage import ArchivingAllocationStore, HistoryQuery, MemoryAllocationStore, plan_history
+from app.storage.mongo import MongoAllocationStore, duplicate_key_field
+from scripts.generate_data import AllocationGenerator, distribute
+
+
+def booking(employee_id: int, vehicle_id: int, days_ahead: int = 1) -> AllocationCreate:
+    return AllocationCreate(
+        employee_id=employee_id,
+        vehicle_id=vehicle_id,
+        allocation_date=date.today() + timedelta(days=days_ahead),
+        purpose="Test"
+    )
+
+
+@pytest.fixture
+def service():
+    return AllocationService(MemoryAllocationStore(range(1, 11)))
+
+
+@pytest.mark.asyncio
+async def test_create_rejects_conflicts(service):
+    created = await service.create_allocation(booking(1, 1))
+    assert isinstance(created["_id"], str)
+
+    with pytest.raises(ValueError, match="Vehicle already allocated"):
+        await service.create_allocation(booking(2, 1))
+    with pytest.raises(ValueError, match="employee already has allocated"):
+        await service.create_allocation(booking(1, 2))
+    with pytest.raises(ValueError, match="must be in the future"):
+        await service.create_allocation(booking(3, 3, days_ahead=0))
+
+
+@pytest.mark.asyncio
+async def test_mongo_duplicates_and_write_concern_errors():
+    assert duplicate_key_field({"keyPattern": {"vehicle_id": 1, "allocation_date": 1}}) == "vehicle_id"
+    assert duplicate_key_field({"keyPattern": {"employee_id": 1, "allocation_date": 1}}) == "employee_id"
+    assert duplicate_key_field({"keyPattern": {"_id": 1}}) is None
+    assert duplicate_key_field({"errmsg": "E11000 duplicate key error collection: t.allocations index: vehicle_id_1_allocation_date_1 dup key"}) == "vehicle_id"
+    assert duplicate_key_field({"errmsg": "E11000 duplicate key error collection: t.allocations index: _id_ dup key"}) is None
+
+    class Collection:
+        name = "allocations"
+
+        def __init__(self, details):
+            self.details = details
+
+        async def insert_many(self, documents, ordered):
+            raise BulkWriteError(self.details)
+
+    duplicate = {"index": 0, "code": 11000, "keyPattern": {"_id": 1}}
+    store = MongoAllocationStore({"allocations": Collection({"writeErrors": [duplicate], "writeConcernErrors": []})})
+    assert await store.insert_many([{}]) == {0: None}
+    store = MongoAllocationStore({"allocations": Collection({"writeErrors": [], "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication timed out"}]})})
+    with pytest.raises(WriteConcernError, match="replication"):
+        await store.insert_many([{}])
+
+
+@pytest.mark.asyncio
+async def test_bulk_reports_each_item(service):
+    await service.create_allocation(booking(1, 1))
+    results = await service.create_allocations_bulk([
+        booking(2, 2),
+        booking(3, 2),  # Same vehicle as the previous item
+        booking(4, 1),  # Vehicle already booked in the store
+        booking(5, 5, days_ahead=0)
+    ])
+    assert [result["status"] for result in results] == ["success", "error", "error", "error"]
+
+
+@pytest.mark.asyncio
+async def test_update_and_delete(service):
+    created = await service.create_allocation(booking(1, 1))
+    await service.create_allocation(booking(2, 2))
+
+    with pytest.raises(ValueError, match="Vehicle already allocated"):
+        await service.update_allocation(created["_id"], AllocationUpdate(vehicle_id=2))
+
+    updated = await service.update_allocation(created["_id"], AllocationUpdate(vehicle_id=3, purpose="Moved"))
+    assert (updated.vehicle_id, updated.purpose) == (3, "Moved")
+
+    await service.delete_allocation(created["_id"])
+    assert await service.get_allocation(created["_id"]) is None
+
+
+@pytest.mark.asyncio
+async def test_update_and_delete_guard_past_allocations(service):
+    today = datetime.combine(date.today(), datetime.min.time())
+    past_id = await service.store.insert({"employee_id": 1, "vehicle_id": 1, "allocation_date": today, "purpose": "Test"})
+
+    with pytest.raises(ValueError, match="Cannot update past"):
+        await service.update_allocation(str(past_id), AllocationUpdate(purpose="Moved"))
+    with pytest.raises(ValueError, match="Cannot delete past"):
+        await service.delete_allocation(str(past_id))
+    with pytest.raises(ValueError, match="not found"):
+        await service.delete_allocation(str(ObjectId()))
+    assert (await service.store.find_by_id(past_id))["purpose"] == "Test"
+
+
+@pytest.mark.asyncio
+async def test_occupancy_shares_one_load_per_date():
+    class SlowStore(MemoryAllocationStore):
+        loads = 0
+
+        async def vehicles_on_dates(self, dates):
+            SlowStore.loads += 1
+            await asyncio.sleep(0.01)
+            async for entry in super().vehicles_on_dates(dates):
+                yield entry
+
+    store = SlowStore([1, 2, 3, 10 ** 12])
+    occupancy = OccupancyIndex()
+    allocation_date = datetime(2030, 1, 1)
+    await store.insert({"employee_id": 1, "vehicle_id": 2, "allocation_date": allocation_date, "purpose": "Test"})
+
+    async def write_during_load():
+        await asyncio.sleep(0.005)
+        occupancy.occupy(10 ** 12, allocation_date)
+
+    first, second, _ = await asyncio.gather(
+        occupancy.available_vehicle_ids(store, [allocation_date]),
+        occupancy.available_vehicle_ids(store, [allocation_date]),
+        write_during_load()
+    )
+    assert first == second == [1, 3]
+    assert SlowStore.loads == 1
+    # Bits are dense positions, however large the ids
+    assert (await occupancy.free_mask(store, [allocation_date])).bit_length() <= 4
+    assert occupancy.to_mask([10 ** 15]) == 0
+
+@pytest.mark.asyncio
+async def test_writes_invalidate_cached_lookups_and_history():
+    cache = AllocationCache(max_entries=100, max_history_pages=100, ttl_seconds=60)
+    service = AllocationService(MemoryAllocationStore(range(1, 11)), cache=cache)
+    created = await service.create_allocation(booking(1, 1))
+    other = await service.create_allocation(booking(2, 2))
+
+    assert len(await service.get_allocation_history(employee_id=1)) == 1
+    assert len(await service.get_allocation_history(employee_id=2)) == 1
+    assert (await service.get_allocation(created["_id"])).vehicle_id == 1
+    assert len(await service.get_allocation_history(employee_id=1)) == 1
+    assert cache.history.hits == 1
+
+    # Only the pages and lookup the write touches are dropped
+    await service.update_allocation(created["_id"], AllocationUpdate(vehicle_id=3))
+    assert (await service.get_allocation(created["_id"])).vehicle_id == 3
+    assert (await service.get_allocation_history(employee_id=1))[0]["vehicle_id"] == 3
+    assert len(await service.get_allocation_history(employee_id=2)) == 1
+    assert cache.history.hits == 2
+
+    await service.create_allocation(booking(1, 4, days_ahead=2))
+    assert len(await service.get_allocation_history(employee_id=1)) == 2
+    await service.delete_allocation(other["_id"])
+    assert await service.get_allocation(other["_id"]) is None
+    assert await service.get_allocation_history(employee_id=2) == []
+
+
+def test_cache_defaults_off_for_workers_without_a_change_stream():
+    def cache_active(**overrides):
+        return Settings(mongodb_url="mongodb://localhost", database_name="test", **overrides).cache_active()
+    assert cache_active(web_concurrency=1)
+    assert not cache_active(web_concurrency=4)
+    assert cache_active(web_concurrency=4, cache_change_stream=True)
+    assert cache_active(web_concurrency=4, cache_enabled=True)
+    assert not cache_active(web_concurrency=1, cache_enabled=False)
+
+@pytest.mark.asyncio
+async def test_history_cursor_walks_every_row_once(service):
+    for i in range(1, 8):
+        await service.create_allocation(booking(i, i, days_ahead=i % 3 + 1))
+
+    seen = []
+    cursor = None
+    while True:
+        page = await service.get_allocation_history(limit=3, cursor=cursor)
+        seen.extend(page)
+        cursor = next_cursor(page, 3, "allocation_date", -1)
+        if cursor is None:
+            break
+
+    assert len({row["_id"] for row in seen}) == 7
+    dates = [row["allocation_date"] for row in seen]
+    assert dates == sorted(dates, reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_rollups_track_writes_and_match_rebuild():
+    store = MemoryAllocationStore(range(1, 11))
+    service = AllocationService(store, rollups=True)
+    first = await service.create_allocation(booking(1, 1))
+    await service.create_allocations_bulk([booking(2, 1, days_ahead=2), booking(3, 2)])
+    await service.update_allocation(first["_id"], AllocationUpdate(vehicle_id=3))
+    await service.delete_allocation(first["_id"])
+
+    months = [(date.today() + timedelta(days=days)).strftime("%Y-%m") for days in (1, 2)]
+    incremental = await store.find_rollups("vehicle", min(months), max(months))
+    assert sum(row["days"] for row in incremental) == 2
+
+    await store.rebuild_rollups()
+    assert await store.find_rollups("vehicle", min(months), max(months)) == incremental
+
+
+@pytest.mark.asyncio
+async def test_lost_rollup_writes_are_counted():
+    class FailingRollups(MemoryAllocationStore):
+        async def adjust_rollups(self, deltas):
+            raise ConnectionError("rollups unavailable")
+
+    service = AllocationService(FailingRollups(range(1, 11)), rollups=True)
+    failures = ROLLUP_WRITE_FAILURES._values.get((), 0)
+    created = await service.create_allocation(booking(1, 1))
+    # The allocation is written; only its counters are lost
+    assert await service.get_allocation(created["_id"]) is not None
+    assert ROLLUP_WRITE_FAILURES._values[()] == failures + 1
+
+
+@pytest.mark.asyncio
+async def test_history_filters_zero_ids_and_rejects_unindexed_sorts(service):
+    await service.create_allocation(booking(0, 1))
+    await service.create_allocation(booking(1, 2))
+
+    page = await service.get_allocation_history(employee_id=0)
+    assert [row["employee_id"] for row in page] == [0]
+
+    with pytest.raises(ValueError, match="sort_by must be one of"):
+        await service.get_allocation_history(sort_by="purpose")
+    with pytest.raises(ValueError, match="needs an employee_id or vehicle_id filter"):
+        await service.get_allocation_history(sort_by="vehicle_id")
+    assert await service.get_allocation_history(employee_id=1, sort_by="vehicle_id")
+
+
+def test_planner_chooses_a_covering_index_per_shape():
+    plan = plan_history(HistoryQuery(employee_id=1))
+    assert (plan.index_name, plan.covered, plan.in_memory_sort) == ("employee_id_1_allocation_date_1", False, False)
+
+    plan = plan_history(HistoryQuery(employee_id=1, fields=["employee_id", "allocation_date"]))
+    assert (plan.index_name, plan.covered, plan.in_memory_sort) == ("employee_id_1_allocation_date_1", True, False)
+
+    # Only the three-field index holds vehicle_id; its date order needs a (bounded) sort
+    plan = plan_history(HistoryQuery(employee_id=1, fields=["vehicle_id", "allocation_date"]))
+    assert (plan.index_name, plan.covered, plan.in_memory_sort) == ("employee_id_1_vehicle_id_1_allocation_date_1", True, True)
+    assert plan.describe()["covering_fields"] == ["employee_id", "vehicle_id", "allocation_date"]
+
+    # Resuming after a cursor seeks on _id, which no shape index holds
+    plan = plan_history(HistoryQuery(employee_id=1, fields=["vehicle_id", "allocation_date"], after=(datetime(2030, 1, 1), ObjectId())))
+    assert (plan.index_name, plan.covered) == ("employee_id_1_allocation_date_1", False)
+
+    plan = plan_history(HistoryQuery(fields=["_id", "allocation_date"]))
+    assert (plan.index_name, plan.covered) == ("allocation_date_1__id_1", True)
+    assert not plan_history(HistoryQuery(vehicle_id=1, fields=["employee_id"])).covered
+
+def test_generator_is_deterministic_and_within_capacity():
+    def generator(**overrides):
+        args = dict(
+            seed=42, start_date=date(2030, 1, 1), days=730, allocations=20000, vehicles=10000, employees=10000,
+            hot_vehicles=0.1, hot_share=0.5, busy_dates=0.1, busy_factor=3.0
+        )
+        args.update(overrides)
+        return AllocationGenerator(SimpleNamespace(**args))
+
+    # Exactly the requested count, spread with busy dates carrying more
+    assert generator().total == 20000
+    assert max(generator().per_day) > 2 * min(generator().per_day)
+    assert distribute(10, [1, 3, 1], 4) == [3, 4, 3]
+
+    # The same seed yields the same rows, whatever the batch size
+    rows = [row for batch in generator(days=20, allocations=500).batches(64) for row in batch]
+    assert rows == [row for batch in generator(days=20, allocations=500).batches(1000) for row in batch]
+    assert generator(seed=7).day(3) != generator().day(3)
+
+    # Capped at one allocation per vehicle and per employee each day
+    small = generator(days=10, allocations=10000, vehicles=50, employees=40)
+    assert small.per_day == [40] * 10
+    for offset in range(10):
+        day = small.day(offset)
+        assert len({row["vehicle_id"] for row in day}) == len({row["employee_id"] for row in day}) == 40
+
+@pytest.mark.asyncio
+async def test_registry_rejects_unknown_ids_without_store_reads():
+    store = MemoryAllocationStore(range(1, 11), range(1, 11))
+    registry = EntityRegistry(miss_refresh_seconds=3600)
+    await registry.load(store)
+    service = AllocationService(store, registry=registry)
+
+    await service.create_allocation(booking(1, 1))
+    with pytest.raises(ValueError, match="Employee 11 does not exist"):
+        await service.create_allocation(booking(11, 2))
+    with pytest.raises(ValueError, match="Vehicle 0 does not exist"):
+        await service.create_allocation(booking(2, 0))
+
+    # Picked up by the next incremental refresh
+    store.add_employees([11])
+    await registry.refresh(store)
+    await service.create_allocation(booking(11, 2))
+
+
+@pytest.mark.asyncio
+async def test_coalescer_batches_creates_and_maps_errors():
+    request_var = contextvars.ContextVar("request", default=None)
+
+    class FlakyStore(MemoryAllocationStore):
+        async def insert_many(self, documents):
+            failed = await super().insert_many(documents)
+            # A write error that is not a duplicate key
+            failed.update({position: None for position, document in enumerate(documents) if document["vehicle_id"] == 9})
+            return failed
+
+    class CountingService(AllocationService):
+        batches = []
+
+        async def create_allocations_bulk(self, allocations):
+            CountingService.batches.append((len(allocations), request_var.get()))
+            return await super().create_allocations_bulk(allocations)
+
+    service = CountingService(FlakyStore(range(1, 11)))
+    coalescer = CreateCoalescer(flush_seconds=0.01, max_batch=4)
+
+    async def submit(allocation):
+        request_var.set("request")
+        return await coalescer.submit(service, allocation)
+
+    results = await asyncio.gather(
+        submit(booking(1, 1)),
+        submit(booking(2, 1)),  # Same vehicle and date as the first: the earlier caller wins
+        submit(booking(3, 9)),
+        submit(booking(4, 4)),
+        submit(booking(5, 5)),  # Past max_batch: the next batch, flushed by the timer (single insert)
+        return_exceptions=True
+    )
+    # Written outside the first caller's context
+    assert CountingService.batches == [(4, None)]
+    assert results[0]["vehicle_id"] == 1 and results[3]["vehicle_id"] == 4 and results[4]["vehicle_id"] == 5
+    assert isinstance(results[1], ValueError) and "Vehicle already allocated" in str(results[1])
+    assert type(results[2]) is RuntimeError
+    assert not coalescer._writes
+
+@pytest.mark.asyncio
+async def test_archived_history_matches_unsplit_store():
+    plain = MemoryAllocationStore(range(1, 11))
+    store = ArchivingAllocationStore(MemoryAllocationStore(range(1, 11)), MemoryAllocationStore(), archive_after_days=30)
+    today = datetime.combine(date.today(), datetime.min.time())
+    for days_ago in range(60):
+        for vehicle_id in (1, 2, 3):
+            document = {
+                "_id": ObjectId(),
+                "employee_id": vehicle_id,
+                "vehicle_id": vehicle_id,
+                "allocation_date": today - timedelta(days=days_ago),
+                "purpose": "Test"
+            }
+            await plain.insert(dict(document))
+            await store.insert(dict(document))
+
+    # Interrupted move: copied to the archive but still in hot
+    await store.archive.insert(await store.hot.find_by_id(document["_id"]))
+    assert await store.archive_batch(store.horizon, batch_size=50) == 50
+    assert await store.archive_batch(store.horizon, batch_size=50) == 37
+    assert len(store.hot) == 93 and len(store.archive) == 87
+
+    for query in (
+        HistoryQuery(limit=25, skip=20),
+        HistoryQuery(sort_by="_id", sort_order=1, limit=40),
+        HistoryQuery(vehicle_id=2, sort_order=1, fields=["purpose"]),
+        HistoryQuery(start=today - timedelta(days=10))
+    ):
+        assert await store.find(query) == await plain.find(query)
+        assert [row async for row in store.iterate(query, batch_size=7)] == await plain.find(query)
+        assert await store.count(query) == await plain.count(query)
+
+
+@pytest.mark.asyncio
+async def test_series_books_every_date_or_none(service):
+    start = date.today() + timedelta(days=1)
+    weekdays = AllocationSeriesCreate(
+        employee_id=1, vehicle_id=1, start_date=start, end_date=start + timedelta(days=20),
+        weekdays=[0, 1, 2, 3, 4], purpose="Test"
+    )
+    created = await service.create_allocation_series(weekdays)
+    assert len(created) == 15
+    assert all(row["allocation_date"].weekday() < 5 for row in created)
+
+    # Another employee on the same vehicle every day: 15 clashes, nothing booked
+    daily = AllocationSeriesCreate(
+        employee_id=2, vehicle_id=1, start_date=start, end_date=start + timedelta(days=20), purpose="Test"
+    )
+    with pytest.raises(SeriesConflictError) as raised:
+        await service.create_allocation_series(daily)
+    assert [conflict["field"] for conflict in raised.value.conflicts] == ["vehicle_id"] * 15
+    assert len(service.store) == 15
+
+
+@pytest.mark.asyncio
+async def test_versions_track_matching_writes_only():
+    versions = VersionTracker()
+    service = AllocationService(MemoryAllocationStore(range(1, 11)), versions=versions)
+    vehicle_1 = history_filter_key(None, 1, None, None)
+    created = await service.create_allocation(booking(1, 1))
+    seen = versions.filter_version(vehicle_1)
+
+    other = await service.create_allocation(booking(2, 2))
+    await service.update_allocation(other["_id"], AllocationUpdate(purpose="Moved"))
+    assert versions.filter_version(vehicle_1) == seen
+    assert versions.ids_version([created["_id"]]).number == 0
+
+    await service.update_allocation(created["_id"], AllocationUpdate(purpose="Moved"))
+    assert versions.filter_version(vehicle_1).number > seen.number
+    assert versions.ids_version([created["_id"]]) == versions.current
+
+
+@pytest.mark.asyncio
+async def test_feed_filters_resumes_and_drops_slow_subscribers():
+    broker = ChangeBroker(history_size=3, queue_size=2)
+    service = AllocationService(MemoryAllocationStore(range(1, 11)), feed=LocalChangeSource(broker))
+    vehicle_1 = broker.subscribe(history_filter_key(None, 1, None, None))
+    everything = broker.subscribe(history_filter_key(None, None, None, None))
+
+    created = await service.create_allocation(booking(1, 1))
+    await service.create_allocation(booking(2, 2))
+    first = await vehicle_1.next(0)
+    assert first.op == "create" and await vehicle_1.next(0) is None
+
+    # Moving off vehicle 1 still reaches its subscribers through the pre-image
+    await service.update_allocation(created["_id"], AllocationUpdate(vehicle_id=3))
+    assert (await vehicle_1.next(0)).op == "update"
+
+    # A third pending event overflows the unfiltered queue
+    assert everything.closed and broker.dropped == 1
+    assert [event.op for event in broker.subscribe(everything.history_filter, first.token).pending] == ["create", "update"]
+    assert broker.subscribe(everything.history_filter, "stale.0").reset
+
+
+@pytest.mark.asyncio
+async def test_feed_source_fits_the_backend_and_server(monkeypatch):
+    # The in-memory backend has no change stream to follow
+    monkeypatch.setattr(settings, "feed_source", "change_stream")
+    monkeypatch.setattr(feed, "_source", None)
+    assert isinstance(await feed.get_change_source(), LocalChangeSource)
+    feed.close_change_source()
+
+    class Stream:
+        resume_token = {"_data": "1"}
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if self.sent:
+                raise asyncio.CancelledError()
+            self.sent = True
+            document = {"_id": 1, "employee_id": 1, "vehicle_id": 1, "allocation_date": datetime(2030, 1, 1), "purpose": "Test"}
+            return {"operationType": "insert", "documentKey": {"_id": 1}, "fullDocument": document}
+
+    class Collection:
+        def watch(self, **options):
+            self.options = options
+            stream = Stream()
+            stream.sent = False
+            return stream
+
+    async def server_info():
+        return {"versionArray": [5, 0, 0, 0]}
+
+    db = SimpleNamespace(allocations=Collection(), client=SimpleNamespace(server_info=server_info))
+    broker = ChangeBroker()
+    everything = broker.subscribe(history_filter_key(None, None, None, None))
+    with pytest.raises(asyncio.CancelledError):
+        await ChangeStreamSource(broker, db).run()
+    # Pre-images are left out on a server older than 6.0
+    assert db.allocations.options == {"full_document": "updateLookup", "resume_after": None}
+    assert (await everything.next(0)).op == "create"
+
+
+@pytest.mark.asyncio
+async def test_admission_prefers_writes_and_adapts_to_latency():
+    controller = AdmissionController(
+        initial_limit=4, min_limit=2, target_latency=0.1, queue_timeout=0.05, window_seconds=60,
+        shares=(1.0, 1.0, 0.5), route_limits={"GET /export": 1}
+    )
+    assert await controller.acquire("GET /export", SCAN) is None
+    assert await controller.acquire("GET /export", SCAN) == 429
+    assert await controller.acquire("GET /history", SCAN) is None
+    # Half the limit is in use: further scans are shed, reads still fit
+    assert await controller.acquire("GET /history", SCAN) == 503
+    assert await controller.acquire("GET /list", READ) is None
+    assert await controller.acquire("GET /list", READ) is None
+
+    # Full: a queued write is granted the next free slot ahead of an earlier read
+    read = asyncio.ensure_future(controller.acquire("GET /list", READ))
+    write = asyncio.ensure_future(controller.acquire("POST /create", WRITE))
+    await asyncio.sleep(0)
+    controller.release("GET /list", READ, 0.01)
+    assert await write is None
+    assert await read == 503
+
+    # A window over the latency target shrinks the limit
+    controller.window_seconds = 0
+    controller.release("GET /export", SCAN, 0.5)
+    assert controller.limit == 3
+
+
+@pytest.mark.asyncio
+async def test_admission_recovers_from_a_pool_wait_spike_without_releases():
+    controller = AdmissionController(initial_limit=8, min_limit=2, pool_wait_threshold=0.1, queue_timeout=0, window_seconds=60)
+    # A failed checkout without a duration counts as an endless wait
+    controller.observe_pool_wait(float("inf"))
+    controller._window_start -= 60
+    assert await controller.acquire("GET /history", SCAN) == 503
+    # Reads are still admitted, up to their share of the shrunk limit
+    assert controller.limit == 6 and controller.capacity(READ) == 5
+    assert [await controller.acquire("GET /list", READ) for _ in range(2)] == [None, None]
+
+    # Nothing was released, yet the next window no longer sees the spike
+    controller._window_start -= 60
+    assert await controller.acquire("GET /history", SCAN) is None
+    assert controller.pool_wait == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_cancelled_waiters_give_back_their_slots():
+    controller = AdmissionController(
+        initial_limit=1, min_limit=1, queue_timeout=5, window_seconds=60, shares=(1.0, 1.0, 1.0),
+        route_limits={"GET /list": 2}
+    )
+    assert await controller.acquire("GET /list", READ) is None
+
+    # Cancelled while queued: the waiter leaves and its route count is undone
+    waiter = asyncio.ensure_future(controller.acquire("GET /list", READ))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert not controller._waiters and controller._route_in_flight["GET /list"] == 1
+
+    # Cancelled after the slot was granted but before it resumed: either the
+    # grant wins (wait_for on 3.11 and earlier returns it) and the caller
+    # releases as usual, or the cancellation does and acquire releases the slot
+    waiter = asyncio.ensure_future(controller.acquire("GET /list", READ))
+    await asyncio.sleep(0)
+    controller.release("GET /list", READ, None)
+    waiter.cancel()
+    try:
+        assert await waiter is None
+        controller.release("GET /list", READ, None)
+    except asyncio.CancelledError:
+        pass
+    assert controller.total == 0 and controller._route_in_flight["GET /list"] == 0
+    assert await controller.acquire("GET /list", READ) is None
+
+
+@pytest.mark.asyncio
+async def test_slow_request_log_keeps_shapes_and_own_samples():
+    assert normalize_query(b"limit=10&employee_id=5&employee_id=6&cursor=") == "cursor=?&employee_id=?&limit=?"
+    assert command_shape({
+        "find": "allocations",
+        "filter": {"employee_id": 5, "allocation_date": {"$gte": datetime(2024, 1, 1)}},
+        "limit": 10,
+        "lsid": {"id": "session"}
+    }) == {"find": "str", "filter": {"employee_id": "int", "allocation_date": {"$gte": "datetime"}}, "limit": "int"}
+    assert command_shape({"insert": "allocations", "documents": [{"a": 1}, {"a": 2}]}) == {"insert": "str", "documents": [{"a": "int"}, "x2"]}
+
+    profiler = Profiler(interval=0.001, slow_threshold=0.02, slow_log_size=2)
+    profiler.configure(slow_log=True)
+    try:
+        async def request(path: str, busy: float):
+            capture = RequestCapture("GET", path, "", 0.0)
+            task = profiler.begin(capture)
+            started = time.perf_counter()
+            while time.perf_counter() - started < busy:
+                pass
+            await asyncio.sleep(0.05)
+            capture.duration_ms = (time.perf_counter() - started) * 1000
+            profiler.end(task, capture)
+
+        await asyncio.gather(request("/slow", 0.1), asyncio.sleep(0))
+        logged = profiler.slow_requests[0]
+        assert logged["route"] == "/slow"
+        assert logged["stacks"] and all("test_allocation_service.py:request" in entry["stack"] for entry in logged["stacks"])
+        # The 50 ms await is not CPU time of the request
+        assert logged["sampled_cpu_ms"] < logged["duration_ms"] - 25
+
+        profiler.configure(slow_threshold=1)
+        await request("/fast", 0)
+        assert len(profiler.slow_requests) == 1
+        assert not profiler.profile()["samples"]
+    finally:
+        profiler.configure(slow_log=False)
+    assert profiler._thread is None
+
+
+def test_worker_pools_share_the_connection_budget():
+    def pool_size(**overrides):
+        return Settings(mongodb_url="mongodb://localhost", database_name="test", **overrides).worker_pool_size()
+    assert pool_size(mongo_max_pool_size=50, mongo_connection_budget=0) == 50
+    assert pool_size(mongo_connection_budget=200, web_concurrency=4) == 50
+    assert pool_size(mongo_connection_budget=200, web_concurrency=8) == 25
+    assert pool_size(mongo_connection_budget=2, web_concurrency=8) == 1
+
+
+def test_assignment_matching_is_maximum():
+    def maximum(eligible):
+        # Plain augmenting-path matching over vehicle lists
+        owner = {}
+
+        def augment(request, seen):
+            for vehicle_id in mask_to_ids(eligible[request]):
+                if vehicle_id not in seen:
+                    seen.add(vehicle_id)
+                    if vehicle_id not in owner or augment(owner[vehicle_id], seen):
+                        owner[vehicle_id] = request
+                        return True
+            return False
+        return sum(augment(request, set()) for request in range(len(eligible)))
+
+    rng = random.Random(7)
+    for _ in range(200):
+        vehicles = rng.randint(1, 12)
+        eligible = [ids_to_mask(rng.sample(range(vehicles), rng.randint(0, min(3, vehicles)))) for _ in range(rng.randint(1, 12))]
+        preferences = [rng.sample(range(vehicles), 1) for _ in eligible]
+        assigned = match_requests(eligible, preferences)
+        chosen = [vehicle_id for vehicle_id in assigned if vehicle_id is not None]
+        assert len(chosen) == len(set(chosen)) == maximum(eligible)
+        assert all(vehicle_id is None or (mask >> vehicle_id) & 1 for mask, vehicle_id in zip(eligible, assigned))
+
+
+@pytest.mark.asyncio
+async def test_assignment_drops_unknown_vehicle_ids_and_checks_employees_only():
+    store = MemoryAllocationStore(range(1, 11))
+    occupancy = OccupancyIndex()
+    allocations = AllocationService(store, occupancy)
+    await allocations.create_allocation(booking(1, 1))
+    assignment = AssignmentService(allocations, occupancy)
+
+    def request(employee_id, eligible, preferred=()):
+        return AssignmentRequest(
+            employee_id=employee_id, allocation_date=date.today() + timedelta(days=1), purpose="Test",
+            eligible_vehicle_ids=eligible, preferred_vehicle_ids=list(preferred)
+        )
+
+    started = time.perf_counter()
+    results = await assignment.assign([
+        request(1, [2]),  # Already holds vehicle 1 on the date
+        request(2, [2_000_000_000, 10**11, 3], preferred=[10**11]),
+        request(3, [10**11])
+    ], dry_run=True)
+    assert time.perf_counter() - started < 1
+    assert [(result["status"], result["vehicle_id"]) for result in results] == [("error", None), ("success", 3), ("error", None)]
+    # Ids outside the fleet never get a position
+    assert occupancy.to_positions([2_000_000_000, 10**11]) == []
+
+    class Collection:
+        def find(self, query):
+            self.query = query
+            return SimpleNamespace(to_list=lambda length: asyncio.sleep(0, []))
+
+    collection = Collection()
+    day = datetime(2030, 1, 1)
+    await MongoAllocationStore({"allocations": collection}).find_conflicts([(None, 1, day), (2, None, day)])
+    assert collection.query == {"$or": [
+        {"allocation_date": day, "vehicle_id": {"$in": [2]}},
+        {"allocation_date": day, "employee_id": {"$in": [1]}}
+    ]}
@@ -0,0 +1,378 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import database, storage
+from app.config import settings
+from app.database import INDEX_VERSION
+from app.main import app
+from app.profiling import profiler
+from app.services.cache import allocation_cache
+from app.services.export import export_stream
+from app.services.occupancy import occupancy_index
+from app.storage.mongo import MongoAllocationStore
+
+
+@pytest.fixture
+def client():
+    # Each lifespan opens a fresh in-memory store; the in-process caches
+    # outlive it, so they are emptied first
+    allocation_cache.clear()
+    occupancy_index.invalidate()
+    with TestClient(app) as client:
+        yield client
+
+
+class FakeCollection:
+    # Records index builds; the migrations collection keeps its markers
+    def __init__(self, name: str):
+        self.name = name
+        self.indexes = []
+        self.documents = {}
+
+    async def create_index(self, keys, **options):
+        self.indexes.append(keys)
+
+    async def find_one(self, query):
+        return self.documents.get(query["_id"])
+
+    async def update_one(self, query, update, upsert=False):
+        document = self.documents.setdefault(query["_id"], {"_id": query["_id"]})
+        document["version"] = max(document.get("version", 0), update["$max"]["version"])
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return self.collections.setdefault(name, FakeCollection(name))
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        return self[name]
+
+
+class FakeClient:
+    # Stands in for AsyncIOMotorClient: one database, and whether close() was called
+    instances = []
+
+    def __init__(self, url, **options):
+        self.options = options
+        self.closed = False
+        self.database = FakeDatabase()
+        FakeClient.instances.append(self)
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        return self.database
+
+    def close(self):
+        self.closed = True
+
+
+def book(client: TestClient, count: int, days_ahead: int = 1):
+    # count allocations on one date, employee and vehicle i for i in 1..count
+    allocation_date = (date.today() + timedelta(days=days_ahead)).isoformat()
+    response = client.post("/api/v1/allocations/bulk", json={"items": [
+        {"employee_id": i, "vehicle_id": i, "allocation_date": allocation_date, "purpose": "Test"}
+        for i in range(1, count + 1)
+    ]})
+    assert response.status_code == 200
+    assert all(item["status"] == "success" for item in response.json()["data"])
+
+
+def allocation(employee_id: int, vehicle_id: int, days_ahead: int = 1) -> dict:
+    return {
+        "employee_id": employee_id, "vehicle_id": vehicle_id, "purpose": "Test",
+        "allocation_date": (date.today() + timedelta(days=days_ahead)).isoformat()
+    }
+
+
+def sse_request(path: str, done) -> tuple:
+    # Scope, receive and send for driving the ASGI app directly (TestClient
+    # waits for the whole body, and a feed never ends): send collects SSE
+    # frames until done(frames), then receive reports the disconnect
+    frames = []
+    buffer = ""
+    disconnected = asyncio.Event()
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(b"host", b"test")], "client": ("test", 1), "server": ("test", 80)
+    }
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal buffer
+        if message["type"] == "http.response.body":
+            buffer += message.get("body", b"").decode()
+            *complete, buffer = buffer.split("\n\n")
+            frames.extend(complete)
+            if done(frames):
+                disconnected.set()
+
+    return scope, receive, send, frames
+
+
+def test_export_streams_every_row_in_batches(client):
+    book(client, 5)
+    book(client, 2, days_ahead=2)
+
+    response = client.get("/api/v1/allocations/export", params={"batch_size": 2, "sort_order": 1})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 7
+    assert set(rows[0]) == {"_id", "employee_id", "vehicle_id", "allocation_date", "purpose"}
+    assert [row["allocation_date"] for row in rows] == sorted(row["allocation_date"] for row in rows)
+
+    response = client.get("/api/v1/allocations/export", params={
+        "format": "csv", "fields": "vehicle_id,allocation_date", "employee_id": 3
+    })
+    assert response.headers["content-type"].startswith("text/csv")
+    assert 'filename="allocations.csv"' in response.headers["content-disposition"]
+    assert list(csv.reader(io.StringIO(response.text))) == [
+        ["vehicle_id", "allocation_date"],
+        ["3", (date.today() + timedelta(days=1)).isoformat()]
+    ]
+
+    response = client.get("/api/v1/allocations/export", params={"fields": "vehicle_id,secret"})
+    assert response.status_code == 400
+    assert "secret" in response.json()["detail"]
+
+
+def test_export_writes_one_chunk_per_batch():
+    # The test client joins the chunks of a streamed body, so the encoders are driven directly
+    async def rows():
+        for i in range(5):
+            yield {"employee_id": i, "allocation_date": datetime(2030, 1, 1)}
+
+    async def chunks(fmt):
+        return [chunk async for chunk in export_stream(rows(), fmt, ["employee_id", "allocation_date"], 2)]
+
+    ndjson = asyncio.run(chunks("ndjson"))
+    assert [chunk.count(b"\n") for chunk in ndjson] == [2, 2, 1]
+    assert json.loads(ndjson[0].splitlines()[0]) == {"employee_id": 0, "allocation_date": "2030-01-01"}
+    # The CSV header goes out with the first batch
+    assert [chunk.count(b"\n") for chunk in asyncio.run(chunks("csv"))] == [3, 2, 1]
+
+
+def scrape(client: TestClient) -> dict:
+    # Prometheus text format -> {'name{labels}': value}
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = {}
+    for line in response.text.splitlines():
+        if not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            samples[series] = float(value)
+    return samples
+
+
+def test_metrics_count_requests_by_route_template(client):
+    book(client, 1)
+    allocation_id = client.get("/api/v1/allocations/").json()["data"][0]["_id"]
+    series = 'http_request_duration_seconds_count{method="GET",route="/api/v1/allocations/{allocation_id}",status="%s"}'
+    before = scrape(client)
+
+    client.get(f"/api/v1/allocations/{allocation_id}")
+    client.get(f"/api/v1/allocations/{allocation_id}")
+    client.get("/api/v1/allocations/0123456789abcdef01234567")
+    after = scrape(client)
+    assert after[series % 200] - before.get(series % 200, 0) == 2
+    assert after[series % 404] - before.get(series % 404, 0) == 1
+    # Labelled by template, never by the raw id
+    assert not any(allocation_id in key for key in after)
+
+    text = client.get("/metrics").text
+    for name, kind in [
+        ("http_request_duration_seconds", "histogram"),
+        ("http_requests_in_flight", "gauge"),
+        ("http_requests_shed_total", "counter"),
+        ("mongodb_command_duration_seconds", "histogram")
+    ]:
+        assert f"# TYPE {name} {kind}\n" in text
+        assert f"# HELP {name} " in text
+
+    # Buckets are cumulative and +Inf equals the count
+    prefix = 'http_request_duration_seconds_bucket{method="GET",route="/api/v1/allocations/{allocation_id}",status="200",le='
+    buckets = [value for key, value in after.items() if key.startswith(prefix)]
+    assert buckets == sorted(buckets)
+    assert after[prefix + '"+Inf"}'] == after[series % 200]
+
+
+def test_history_totals_are_exact_for_filters_and_estimated_without(client):
+    book(client, 5)
+    book(client, 2, days_ahead=2)
+
+    body = client.get("/api/v1/allocations/history").json()
+    assert body.get("total") is None
+
+    body = client.get("/api/v1/allocations/history", params={"include_total": True, "limit": 2}).json()
+    assert (len(body["data"]), body["total"], body["total_estimated"]) == (2, 7, True)
+
+    params = {"include_total": True, "limit": 1, "employee_id": 1}
+    body = client.get("/api/v1/allocations/history", params=params).json()
+    assert (len(body["data"]), body["total"], body["total_estimated"]) == (1, 2, False)
+    # Every page of the view reports the same total
+    body = client.get("/api/v1/allocations/history", params=dict(params, cursor=body["next_cursor"])).json()
+    assert body["total"] == 2
+
+    # A matching write drops the cached count
+    response = client.post("/api/v1/allocations/", json={
+        "employee_id": 1, "vehicle_id": 1, "allocation_date": (date.today() + timedelta(days=3)).isoformat(), "purpose": "Test"
+    })
+    assert response.status_code == 200
+    assert client.get("/api/v1/allocations/history", params=params).json()["total"] == 3
+    body = client.get("/api/v1/allocations/history", params={"include_total": True, "employee_id": 5}).json()
+    assert (body["total"], body["total_estimated"]) == (1, False)
+
+
+def test_unchanged_reads_revalidate_with_304(client, monkeypatch):
+    book(client, 3)
+
+    response = client.get("/api/v1/allocations/history", params={"employee_id": 1})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    response = client.get("/api/v1/allocations/history", params={"employee_id": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    # A tag only validates the request it came from, and a write the filter
+    # matches (employee 1 again) changes it
+    book(client, 1, days_ahead=2)
+    response = client.get("/api/v1/allocations/history", params={"employee_id": 2}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    response = client.get("/api/v1/allocations/history", params={"employee_id": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+    # Another worker could not match this worker's tags
+    monkeypatch.setattr(settings, "web_concurrency", 4)
+    response = client.get("/api/v1/allocations/history", params={"employee_id": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+
+
+def test_lifespan_opens_and_closes_the_worker_pool(monkeypatch):
+    monkeypatch.setattr(database, "AsyncIOMotorClient", FakeClient)
+    monkeypatch.setattr(storage, "_store", None)
+    monkeypatch.setattr(FakeClient, "instances", [])
+    for name, value in {
+        "storage_backend": "mongo", "registry_enabled": False, "index_check_on_startup": False,
+        "mongo_connection_budget": 200, "web_concurrency": 4, "mongo_min_pool_size": 10
+    }.items():
+        monkeypatch.setattr(settings, name, value)
+
+    with TestClient(app):
+        [client] = FakeClient.instances
+        assert database._client is client and not client.closed
+        assert (client.options["maxPoolSize"], client.options["minPoolSize"]) == (50, 10)
+    assert client.closed
+    assert database._client is None and storage._store is None
+
+
+@pytest.mark.asyncio
+async def test_indexes_are_built_once_per_index_version():
+    db = FakeDatabase()
+    store = MongoAllocationStore(db)
+    assert await store.ensure_indexes()
+    built = len(db.allocations.indexes)
+    assert built and db.migrations.documents["indexes.allocations"]["version"] == INDEX_VERSION
+
+    # The marker is current: one read, no index builds
+    assert not await store.ensure_indexes()
+    assert len(db.allocations.indexes) == built
+
+    # A marker behind INDEX_VERSION builds them again
+    db.migrations.documents["indexes.allocations"]["version"] = INDEX_VERSION - 1
+    assert await store.ensure_indexes()
+    assert len(db.allocations.indexes) == 2 * built
+
+
+def test_admin_endpoints_are_off_by_default_and_slow_requests_keep_templates(client, monkeypatch):
+    for method, path in [
+        ("GET", "/api/v1/admin/profiler"), ("PUT", "/api/v1/admin/profiler"),
+        ("PUT", "/api/v1/admin/slow-requests"), ("DELETE", "/api/v1/admin/cache")
+    ]:
+        assert client.request(method, path, json={"enabled": True}).status_code == 404
+
+    book(client, 1)
+    allocation_id = client.get("/api/v1/allocations/").json()["data"][0]["_id"]
+    monkeypatch.setattr(profiler, "slow_log_enabled", True)
+    monkeypatch.setattr(profiler, "slow_threshold", 0)
+    client.get(f"/api/v1/allocations/{allocation_id}")
+    assert profiler.slow_requests[0]["route"] == "/api/v1/allocations/{allocation_id}"
+
+
+@pytest.mark.asyncio
+async def test_sse_feed_filters_writes_carries_previous_and_heartbeats(monkeypatch):
+    allocation_cache.clear()
+    occupancy_index.invalidate()
+    monkeypatch.setattr(storage, "_store", None)
+    monkeypatch.setattr(settings, "feed_heartbeat_seconds", 0.05)
+
+    def done(frames):
+        return sum(frame.startswith("id: ") for frame in frames) >= 2 and ": keepalive" in frames
+
+    scope, receive, send, frames = sse_request("/api/v1/feed/allocations?vehicle_id=1", done)
+    feed = asyncio.ensure_future(app(scope, receive, send))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        await asyncio.sleep(0.01)  # Subscribed
+        assert (await client.post("/api/v1/allocations/", json=allocation(2, 2))).status_code == 200
+        created = (await client.post("/api/v1/allocations/", json=allocation(1, 1))).json()["data"]
+        response = await client.put(f"/api/v1/allocations/{created['_id']}", json={"vehicle_id": 3})
+        assert response.status_code == 200
+        await asyncio.wait_for(feed, 5)
+
+    events = []
+    for frame in frames:
+        if frame.startswith("id: "):
+            fields = dict(line.split(": ", 1) for line in frame.splitlines())
+            events.append((fields["event"], json.loads(fields["data"])))
+    # Vehicle 2's booking is filtered out; moving off vehicle 1 still arrives
+    assert [op for op, _ in events] == ["create", "update"]
+    assert events[0][1]["allocation"]["vehicle_id"] == 1 and events[0][1]["previous"] is None
+    assert events[1][1]["allocation"]["vehicle_id"] == 3
+    assert events[1][1]["previous"]["vehicle_id"] == 1
+
+
+def test_websocket_feed_filters_writes_carries_previous_and_heartbeats(client, monkeypatch):
+    monkeypatch.setattr(settings, "feed_heartbeat_seconds", 0.05)
+    with client.websocket_connect("/api/v1/feed/allocations/ws?employee_id=1") as websocket:
+        assert websocket.receive_json() == {"op": "heartbeat"}
+        client.post("/api/v1/allocations/", json=allocation(2, 2))
+        created = client.post("/api/v1/allocations/", json=allocation(1, 1)).json()["data"]
+        client.delete(f"/api/v1/allocations/{created['_id']}")
+
+        messages = []
+        while len(messages) < 2:
+            message = websocket.receive_json()
+            if message["op"] != "heartbeat":
+                messages.append(message)
+    assert [message["op"] for message in messages] == ["create", "delete"]
+    assert messages[0]["allocation"]["employee_id"] == 1
+    assert messages[1]["allocation"] is None and messages[1]["previous"]["_id"] == created["_id"]
+
+
+def test_local_feed_is_off_across_workers(client, monkeypatch):
+    monkeypatch.setattr(settings, "web_concurrency", 4)
+    assert client.get("/api/v1/feed/allocations").status_code == 404
+    monkeypatch.setattr(settings, "feed_source", "change_stream")
+    assert settings.feed_active()